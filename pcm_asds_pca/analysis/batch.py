@@ -0,0 +1,141 @@
+# ============================================================================
+# Run pca.py and spectra.py without prompts, pauses, windows or browsers
+# Settings are read from settings.py, then overridden by a .json or .toml
+# config file and then by --set arguments, e.g.
+#
+#   python -m pcm_asds_pca.analysis.batch pca spectra --config run.toml --set NUM_PCS=4
+#
+# Exits with 0 on success, 1 if a run fails and 2 if the arguments are invalid
+# ============================================================================
+
+import argparse
+import ast
+import json
+import os
+import pathlib
+import sys
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+COMMANDS = ("pca", "spectra")
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        prog="python -m pcm_asds_pca.analysis.batch",
+        description="Run pca.py and spectra.py non-interactively",
+    )
+    parser.add_argument("commands", nargs="+", choices=COMMANDS)
+    parser.add_argument(
+        "--config", help="Settings to override, from a .json or .toml file"
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Override a setting, e.g. --set NUM_PCS=4 or --set 'ROWS_TO_REMOVE_IN_PCA=[\"H\"]'",
+    )
+    args = parser.parse_args(argv)
+
+    # Settings must be overridden before the analysis modules import them
+    from pcm_asds_pca.config import settings
+
+    try:
+        overrides = read_config(args.config) if args.config else {}
+        overrides.update(parse_overrides(args.set))
+        apply_settings(settings, overrides)
+    except (OSError, ValueError) as e:
+        print(f"Invalid settings: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    settings.BATCH_MODE = True
+
+    # No windows or browsers are opened, plots are only saved to file
+    os.environ["BOKEH_BROWSER"] = "none"
+
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+    for command in args.commands:
+
+        if command == "pca":
+            from pcm_asds_pca.analysis.pca import main as run
+        else:
+            from pcm_asds_pca.analysis.spectra import main as run
+
+        try:
+            run()
+        except SystemExit as e:
+            if e.code in (None, 0):
+                continue
+
+            if not isinstance(e.code, int):
+                print(e.code, file=sys.stderr)
+
+            return EXIT_FAILED
+
+    return EXIT_OK
+
+
+def read_config(path):
+    path = pathlib.Path(path)
+
+    match path.suffix.lower():
+
+        case ".json":
+            with open(path, encoding="utf-8") as f:
+                config = json.load(f)
+
+        case ".toml":
+            import tomllib
+
+            with open(path, "rb") as f:
+                config = tomllib.load(f)
+
+        case _:
+            raise ValueError(f"Unsupported config file: {path.name}")
+
+    if not isinstance(config, dict):
+        raise ValueError(f"{path.name} must map setting names to values")
+
+    return config
+
+
+def parse_overrides(assignments):
+    overrides = {}
+
+    for assignment in assignments:
+        name, sep, value = assignment.partition("=")
+
+        if not sep:
+            raise ValueError(f"Expected NAME=VALUE, got {assignment}")
+
+        # Python literals (e.g. 4, True, None, [2, 3], (200, 1800)), otherwise a string
+        try:
+            overrides[name.strip()] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name.strip()] = value
+
+    return overrides
+
+
+def apply_settings(settings, overrides):
+    for name, value in overrides.items():
+
+        if not name.isupper() or not hasattr(settings, name):
+            raise ValueError(f"Unknown setting {name}")
+
+        # Lists in .json and .toml files stand in for tuples
+        if isinstance(getattr(settings, name), tuple) and isinstance(value, list):
+            value = tuple(value)
+
+        setattr(settings, name, value)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
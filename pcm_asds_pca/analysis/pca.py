@@ -4,12 +4,13 @@
 # The PCA model is saved to the pca_output/ folder.
 # ====================================================================================
 
+import io
 import json
 import numpy as np
+import os
 import pandas as pd
 import pathlib
 import pcm_asds_pca.pyphi.pyphi as phi
-import ramanspy as rp
 import shutil
 import sys
 import time
@@ -18,25 +19,47 @@ from contextlib import redirect_stderr, redirect_stdout
 
 from pcm_asds_pca.config.settings import *
 
+from pcm_asds_pca.core.align import align_spectra, common_grid
+
+from pcm_asds_pca.core.filters import removed_in_pca, select
+
+from pcm_asds_pca.core.header import group_by_settings
+
+from pcm_asds_pca.core.incremental import IncrementalPCA, row_digests, split
+
+from pcm_asds_pca.core.layout import layout_file
+
+from pcm_asds_pca.core.model import (
+    export_model,
+    open_model,
+    remove_exports,
+    write_model,
+)
+
 from pcm_asds_pca.core.parse import parse
 
-from pcm_asds_pca.core.sample import Sample
+from pcm_asds_pca.core.randomized import CHUNK_ROWS, randomized_pca
+
+from pcm_asds_pca.core.report import (
+    write_csv,
+    write_dataframes_report,
+    write_model_report,
+)
 
-from pprint import pprint
+from pcm_asds_pca.core.stages import cached, files_fingerprint, fingerprint
+
+from pcm_asds_pca.core.store import open_store, store_folder
+
+from pcm_asds_pca.core.table import SampleTable
+
+# Preprocessed spectra streamed for randomised PCA, in STAGE_CACHE_FOLDER
+SPECTRA_FILE = "spectra.npy"
 
 
 def main():
 
     # Define upper and lower bounds for wavenumber range to be included in PCA
-    if WAVENUMBER_RANGE_FOR_PCA[0] is None:
-        lower_bound = MINIMUM_WAVENUMBER
-    else:
-        lower_bound = WAVENUMBER_RANGE_FOR_PCA[0]
-
-    if WAVENUMBER_RANGE_FOR_PCA[1] is None:
-        upper_bound = MAXIMUM_WAVENUMBER
-    else:
-        upper_bound = WAVENUMBER_RANGE_FOR_PCA[1]
+    lower_bound, upper_bound = wavenumber_bounds(WAVENUMBER_RANGE_FOR_PCA)
 
     # Check that PCA is set to be conducted
     if CONDUCT_PCA is False:
@@ -46,7 +69,7 @@ def main():
     folder = pathlib.Path(f"{PATH_TO_DIR}/{PCA_OUTPUT}")
     trash = pathlib.Path.home() / ".Trash"
 
-    if folder.exists() and any(folder.iterdir()):
+    if folder.exists() and any(folder.iterdir()) and BATCH_MODE is False:
 
         print()
         delete = input(
@@ -66,252 +89,560 @@ def main():
     else:
         folder.mkdir(parents=True, exist_ok=True)
 
+    # Optional exports that this run does not write are removed, so that
+    # exports of a previous model are never read as those of this model
+    remove_exports(PCA_OUTPUT, keep=EXPORT_MODEL)
+
+    if EXPORT_DATAFRAMES is not True:
+        for name in ("spectral_df.csv", "sample_df.csv"):
+            pathlib.Path(PCA_OUTPUT, name).unlink(missing_ok=True)
+
     # Parse all multiwell files in the analyse/ folder
     parsed_files = parse()
 
-    dataframes_1_and_2 = []
-    dataframe_3 = []
-    dicts = []
+    # Each stage below is reused from the stage cache while its inputs are unchanged
+
+    dataframes_key = fingerprint(
+        parsed_files,
+        files_fingerprint(sorted(store_folder().iterdir())),
+        files_fingerprint([layout_file()]),
+        lower_bound,
+        upper_bound,
+        NORMALISE_TO_COUNTS_PER_SECOND,
+        SPECTRAL_ALIGNMENT,
+        PLATES_TO_REMOVE_IN_PCA,
+        ROWS_TO_REMOVE_IN_PCA,
+        COLS_TO_REMOVE_IN_PCA,
+        APPEARANCE_TO_REMOVE_IN_PCA,
+    )
 
-    print("Creating dataframes...")
-    print()
+    preprocessing_key = fingerprint(
+        dataframes_key,
+        PREPROCESS_WITH_SNV,
+        PREPROCESS_WITH_SAVGOL,
+        (SAVGOL_WINDOW, SAVGOL_DERIVATIVE, SAVGOL_POLYNOMIAL),
+    )
 
-    for file in parsed_files:
-
-        spectrum = rp.load.labspec(f"{PATH_TO_DIR}{file}")
-
-        sample = Sample(file, spectrum)
-
-        # ====================================
-        # Filter samples to be included in PCA
-        # ====================================
-
-        if sample.row in ROWS_TO_REMOVE_IN_PCA:
-            continue
-        elif sample.col in COLS_TO_REMOVE_IN_PCA:
-            continue
-        elif sample.plate in PLATES_TO_REMOVE_IN_PCA:
-            continue
-        elif sample.appearance == APPEARANCE_TO_REMOVE_IN_PCA:
-            continue
-
-        # =======================
-        # Create sample dataframe
-        # =======================
-
-        dicts.append(
-            dict(
-                sample=sample,
-                plate=sample.plate,
-                well=sample.well,
-                row=sample.row,
-                column=sample.col,
-                concentration=sample.concentration,
-                drug=sample.drug,
-                drug_loading=sample.drug_loading,
-                polymer=sample.polymer,
-                appearance=sample.appearance,
-                volume=sample.volume,
-            )
+    if PCA_ALGORITHM == "randomized" and INCREMENTAL_PCA is False:
+
+        # Spectra are streamed from the spectral store into a memory-mapped
+        # matrix, which randomized_pca reads a chunk at a time
+        spectral_df, sample_df = stream_dataframes(
+            parsed_files,
+            lower_bound,
+            upper_bound,
+            f"{PATH_TO_DIR}{STAGE_CACHE_FOLDER}/{SPECTRA_FILE}",
         )
 
-        # =========================
-        # Create spectral dataframe
-        # =========================
+    else:
+        spectral_df, sample_df = cached(
+            "dataframes",
+            dataframes_key,
+            lambda: create_dataframes(parsed_files, lower_bound, upper_bound),
+        )
 
-        with open(f"{PATH_TO_DIR}{file}") as f:
+        spectral_df = cached(
+            "preprocessing", preprocessing_key, lambda: preprocess(spectral_df)
+        )
 
-            l_1_2 = []
-            l_3 = []
+    # Summarise dataframes in a .txt file
+    write_dataframes_report(
+        f"{PCA_OUTPUT}/dataframes.txt", spectral_df, sample_df, rows=REPORT_ROWS
+    )
 
-            for line in f:
-                if line[0] != "#":
-                    shift, intensity = line.split("\t", maxsplit=1)
+    if EXPORT_DATAFRAMES is True:
+        write_csv(f"{PCA_OUTPUT}/spectral_df.csv", spectral_df)
+        sample_df.to_csv(f"{PCA_OUTPUT}/sample_df.csv")
 
-                    shift = float(shift)
-                    intensity = float(intensity[:-1])
+    # Check that CROSS_VAL and NUM_PCS are set to valid values
+    if CROSS_VAL > 100 or CROSS_VAL < 0:
+        sys.exit("CROSS_VAL must be an integer between 0 and 100")
 
-                    # Crop dataframe according to WAVENUMBER_RANGE_FOR_PCA
-                    if lower_bound != MINIMUM_WAVENUMBER:
-                        if shift < lower_bound:
-                            continue
+    if NUM_PCS <= 0:
+        sys.exit("NUM_PCS must be an integer greater than 0")
 
-                    if upper_bound != MAXIMUM_WAVENUMBER:
-                        if shift > upper_bound:
-                            continue
+    if PCA_ALGORITHM not in ("pyphi", "randomized"):
+        sys.exit('PCA_ALGORITHM must be "pyphi" or "randomized"')
 
-                    if sample.plate in [0, 1, 2]:
+    if PCA_ALGORITHM == "randomized" and CROSS_VAL != 0:
+        sys.exit('CROSS_VAL must be 0 when PCA_ALGORITHM is "randomized"')
 
-                        l_1_2.append(
-                            dict(
-                                sample=sample,
-                                shift=shift,
-                                intensity=intensity,
-                            )
-                        )
+    settings = pca_settings()
 
-                    elif sample.plate == 3:
+    if INCREMENTAL_PCA is True:
 
-                        l_3.append(
-                            dict(
-                                sample=sample,
-                                shift=shift,
-                                intensity=intensity,
-                            )
-                        )
+        if CROSS_VAL != 0:
+            sys.exit("CROSS_VAL must be 0 when INCREMENTAL_PCA is True")
 
-            if l_1_2 != []:
-                df = pd.DataFrame(l_1_2)
-                df = df.pivot(index="sample", columns="shift", values="intensity")
-                dataframes_1_and_2.append(df)
+        # Only spectra that are not yet in the saved model are fitted
+        incremental, order, absorbed = update_pca(spectral_df, sample_df, settings)
 
-            if l_3 != []:
-                df = pd.DataFrame(l_3)
-                df = df.pivot(index="sample", columns="shift", values="intensity")
-                dataframe_3.append(df)
+        pcaobj = incremental.to_pcaobj()
+        diagnostics = incremental.summary(absorbed)
 
-    plates_1_and_2 = pd.concat(dataframes_1_and_2)
+        # Spectra are kept in the order they were absorbed into the model
+        spectral_df = spectral_df.iloc[order]
+        sample_df = sample_df.iloc[order]
 
-    # ========================================================================================================================================
-    # NOTE: Plates 1 and 2 were collected with an acquisition time of 5s whereas plate 3 was collected with an acquisition time of 3s.
-    # This means that the shift values for plate 3 are different to those of plates 1 and 2. Because plate 3's shifts only vary from plates
-    # 1 and 2 by a maximum of 0.07 across the entire wavenumber range (please see check.py from an earlier commit), the decision was made to
-    # combine plate 3's data into the dataframe for PCA using the shift numbers from plates 1 and 2. This means that the shift numbers for
-    # plate 3 have been disregarded. To avoid this error, acquisition time should be consistent across plates when collecting using multiwell.
-    # ========================================================================================================================================
+    else:
+        incremental = None
 
-    if dataframe_3 != []:
+        pca_key = fingerprint(
+            preprocessing_key, int(NUM_PCS), int(CROSS_VAL), PCA_ALGORITHM
+        )
 
-        plate_3 = pd.concat(dataframe_3)
+        pcaobj, diagnostics = cached("PCA", pca_key, lambda: fit_pca(spectral_df))
 
-        if plate_3.shape[1] != plates_1_and_2.shape[1]:
-            sys.exit(
-                "The dataframe for plate 3 does not have the same number of columns as the dataframe for plates 1 and 2."
-            )
+    # Save sample_df to .pkl file
+    # This file is not human-readable
+    sample_df.to_pickle(f"{PCA_OUTPUT}/sample_df_not_viewable.pkl")
 
-        plate_3_aligned = pd.DataFrame(
-            plate_3.values,
-            columns=plates_1_and_2.columns,
-            index=plate_3.index,
-        )
+    with open(f"{PCA_OUTPUT}/pca_terminal_output.txt", "w") as f:
+        f.write(diagnostics)
 
-        spectral_df = pd.concat([plates_1_and_2, plate_3_aligned], axis=0)
+    # Summarise pcaobj in a .txt file
+    write_model_report(f"{PCA_OUTPUT}/pcaobj.txt", pcaobj, rows=REPORT_ROWS)
 
-    else:
-        spectral_df = plates_1_and_2
+    # Save settings from settings.py at PCA runtime
+    with open(f"{PCA_OUTPUT}/pca_settings.json", "w") as f:
+        json.dump(settings, f, indent=2)
+
+    # Confirm PCA ran successfully
+    for i in pcaobj["r2x"]:
+
+        if np.isnan(i):
+            sys.exit(f"PCA not successful.")
+
+    # If successful, save pcaobj as a versioned model of memory-mappable .npy arrays
+    # with the settings and sample ids in model.json
+    # Use pcm_asds_pca.core.model.open_model to load it for plotting and further analysis
+    model = write_model(
+        f"{PCA_OUTPUT}/{MODEL_FOLDER}",
+        pcaobj,
+        settings,
+        spectrum=spectral_df.index,
+        extra=None if incremental is None else incremental.state(),
+    )
+
+    if EXPORT_MODEL is not None:
+        try:
+            export_model(open_model(model), PCA_OUTPUT, EXPORT_MODEL, sample_df)
+        except (ValueError, ImportError) as e:
+            sys.exit(f"Could not export the PCA model: {e}")
 
     print(
-        f"Dataframes created with shifts between {lower_bound} and {upper_bound} cm-1."
+        f"""PCA successfully conducted with {NUM_PCS} Principal Components, removing {CROSS_VAL}% of data per round.\n
+    Please see \"{PCA_OUTPUT}/dataframes.txt\" for a summary of the dataframes analysed by PCA.\n
+    Please see \"{PCA_OUTPUT}/files_analysed.txt\" for a list of the files analysed.\n
+    Please see \"{PCA_OUTPUT}/pca_settings.json\" for the settings applied to the dataframes before PCA.\n
+    Please see \"{PCA_OUTPUT}/pca_terminal_output.txt\" for the diagnostics sent to the terminal.\n
+    Please see \"{PCA_OUTPUT}/pcaobj.txt\" for a summary of the PCA model.\n
+    Please see \"{PCA_OUTPUT}/{MODEL_FOLDER}/model.json\" for the arrays saved in the PCA model.
+    """
     )
-    print()
 
-    sample_df = pd.DataFrame(dicts).set_index("sample")
 
-    # =============
-    # Preprocessing
-    # =============
+# =================================================
+# Settings from settings.py at PCA runtime
+# Saved to pca_settings.json and with the PCA model
+# =================================================
+def pca_settings():
+
+    settings = {}
+    settings["Principal Components"] = NUM_PCS
+    settings["Cross_val"] = CROSS_VAL
+    settings["PCA algorithm"] = PCA_ALGORITHM
+    settings["Savitzky-Golay"] = PREPROCESS_WITH_SAVGOL
+
+    if PREPROCESS_WITH_SAVGOL is True:
+        settings["Savitzky-Golay Derivative"] = SAVGOL_DERIVATIVE
+        settings["Savitzky-Golay Polynomial"] = SAVGOL_POLYNOMIAL
+        settings["Savitzky-Golay Window"] = SAVGOL_WINDOW
+
+    settings["Standard Normal Variate"] = PREPROCESS_WITH_SNV
+    settings["Counts per second"] = NORMALISE_TO_COUNTS_PER_SECOND
+    settings["Spectral alignment"] = SPECTRAL_ALIGNMENT
+    settings["Plates removed"] = PLATES_TO_REMOVE_IN_PCA
+    settings["Sample rows removed"] = ROWS_TO_REMOVE_IN_PCA
+    settings["Sample columns removed"] = COLS_TO_REMOVE_IN_PCA
+    settings["Samples removed"] = APPEARANCE_TO_REMOVE_IN_PCA
+    settings["Wavenumber range"] = WAVENUMBER_RANGE_FOR_PCA
+
+    return settings
+
+
+# ======================================================================
+# Incremental PCA
+# Absorbs the spectra that are not yet in the model saved in PCA_OUTPUT,
+# refitting every spectrum if there is no incremental model, or if its
+# settings have changed or some of its spectra are no longer analysed or
+# have changed since they were absorbed
+# Returns the model, the positions of its spectra in spectral_df and the
+# number of spectra absorbed
+# ======================================================================
+def update_pca(spectral_df, sample_df, settings):
+
+    keys = pd.Index(
+        sample_df["plate"].astype(str)
+        + "/"
+        + sample_df["well"].astype(str)
+        + "/"
+        + sample_df["replicate"].astype(str)
+    )
+
+    digests = row_digests(split(spectral_df)[0])
+
+    incremental = resume_pca(keys, digests, settings)
+
+    if incremental is not None:
+        new = ~keys.isin(incremental.keys)
+
+        try:
+            incremental.partial_fit(spectral_df[new], keys=keys[new])
+            return incremental, keys.get_indexer(incremental.keys), int(new.sum())
+        except ValueError as e:
+            print(f"Refitting PCA on every spectrum: {e}")
+            print()
+
+    incremental = IncrementalPCA(NUM_PCS)
+
+    try:
+        incremental.partial_fit(spectral_df, keys=keys)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    return incremental, np.arange(len(keys)), len(keys)
+
+
+def resume_pca(keys, digests, settings):
+
+    try:
+        model = open_model(f"{PCA_OUTPUT}/{MODEL_FOLDER}")
+        incremental = IncrementalPCA.from_model(model)
+    except (OSError, ValueError, KeyError):
+        return None
 
-    if PREPROCESS_WITH_SNV is True:
+    # Settings are compared as saved in model.json
+    if model.settings != json.loads(json.dumps(settings, default=str)):
+        print("Refitting PCA on every spectrum: settings have changed.")
+        print()
+        return None
+
+    if not set(incremental.keys) <= set(keys):
+        print("Refitting PCA on every spectrum: spectra have been removed.")
+        print()
+        return None
+
+    # A spectrum acquired again under the same plate, well and replicate is
+    # treated as removed and added again
+    digests = dict(zip(keys, digests))
+
+    if any(digests[k] != d for k, d in zip(incremental.keys, incremental.digests)):
+        print("Refitting PCA on every spectrum: spectra have changed.")
+        print()
+        return None
+
+    return incremental
+
+
+# =============
+# Preprocessing
+# =============
+def preprocess(
+    spectral_df,
+    snv=PREPROCESS_WITH_SNV,
+    savgol=PREPROCESS_WITH_SAVGOL,
+    window=SAVGOL_WINDOW,
+    derivative=SAVGOL_DERIVATIVE,
+    polynomial=SAVGOL_POLYNOMIAL,
+):
+
+    if snv is True:
         print("Processing with Standard Normal Variate...")
         print()
         spectral_df = phi.spectra_snv(spectral_df)
         print("Standard Normal Variate applied.")
         print()
 
-    if PREPROCESS_WITH_SAVGOL is True:
+    if savgol is True:
         print("Processing with Savitzky-Golay...")
         print()
-        spectral_df, _ = phi.spectra_savgol(
-            SAVGOL_WINDOW, SAVGOL_DERIVATIVE, SAVGOL_POLYNOMIAL, spectral_df
-        )
+        spectral_df, _ = phi.spectra_savgol(window, derivative, polynomial, spectral_df)
         print(
-            f"Savitzky-Golay filter applied with derivative order {SAVGOL_DERIVATIVE}, polynomial order {SAVGOL_POLYNOMIAL}, and window size {SAVGOL_WINDOW}."
+            f"Savitzky-Golay filter applied with derivative order {derivative}, polynomial order {polynomial}, and window size {window}."
         )
         print()
 
-    # Save dataframes to .txt file
-    with open(f"{PCA_OUTPUT}/dataframes.txt", "w") as f:
-        with pd.option_context(
-            "display.max_rows",
-            None,
-            "display.max_columns",
-            None,
-            "display.max_colwidth",
-            None,
-            "display.width",
-            None,
-        ):
-            print(spectral_df, file=f)
-            print(file=f)
-            print(file=f)
-            print(sample_df, file=f)
+    return spectral_df
 
-    # Save sample_df to .pkl file
-    # This file is not human-readable
-    sample_df.to_pickle(f"{PCA_OUTPUT}/sample_df_not_viewable.pkl")
 
-    # Check that CROSS_VAL and NUM_PCS are set to valid values
-    if CROSS_VAL > 100 or CROSS_VAL < 0:
-        sys.exit("CROSS_VAL must be an integer between 0 and 100")
+# ==================================================================
+# Principal Component Analysis
+# Returns the PCA model and the diagnostics printed while fitting it
+# ==================================================================
+def fit_pca(spectral_df, num_pcs=NUM_PCS, cross_val=CROSS_VAL, algorithm=PCA_ALGORITHM):
 
-    if NUM_PCS <= 0:
-        sys.exit("NUM_PCS must be an integer greater than 0")
+    diagnostics = io.StringIO()
 
-    with open(f"{PCA_OUTPUT}/pca_terminal_output.txt", "w") as f:
-        with redirect_stderr(f), redirect_stdout(f):
+    with redirect_stderr(diagnostics), redirect_stdout(diagnostics):
 
-            # ============================
-            # Principle Component Analysis
-            # ============================
+        if algorithm == "randomized":
 
-            pcaobj = phi.pca(spectral_df, int(NUM_PCS), cross_val=int(CROSS_VAL))
+            if cross_val != 0:
+                raise ValueError(
+                    'CROSS_VAL must be 0 when PCA_ALGORITHM is "randomized"'
+                )
 
-    # Save pcaobj to a .txt file
-    with open(f"{PCA_OUTPUT}/pcaobj.txt", "w") as f:
-        pprint(pcaobj, stream=f)
+            # Ids are read as by phi.pca, which takes the first column as obsidX
+            # A memory-mapped spectral_df is read in place, without a copy
+            pcaobj = randomized_pca(
+                spectral_df.to_numpy(copy=False)[:, 1:],
+                int(num_pcs),
+                obsid=spectral_df.iloc[:, 0].astype(str),
+                varid=spectral_df.columns[1:],
+            )
+        else:
+            pcaobj = phi.pca(spectral_df, int(num_pcs), cross_val=int(cross_val))
 
-    # Save settings from settings.py at PCA runtime
-    with open(f"{PCA_OUTPUT}/pca_settings.json", "w") as f:
+    return pcaobj, diagnostics.getvalue()
 
-        settings = {}
-        settings["Principal Components"] = NUM_PCS
-        settings["Cross_val"] = CROSS_VAL
-        settings["Savitzky-Golay"] = PREPROCESS_WITH_SAVGOL
 
-        if PREPROCESS_WITH_SAVGOL is True:
-            settings["Savitzky-Golay Derivative"] = SAVGOL_DERIVATIVE
-            settings["Savitzky-Golay Polynomial"] = SAVGOL_POLYNOMIAL
-            settings["Savitzky-Golay Window"] = SAVGOL_WINDOW
+# =====================================================================
+# Create the spectral and sample dataframes for the parsed files
+# Spectra are read from the memory-mapped spectral store written by parse()
+# =====================================================================
+def create_dataframes(parsed_files, lower_bound, upper_bound):
 
-        settings["Standard Normal Variate"] = PREPROCESS_WITH_SNV
-        settings["Plates removed"] = PLATES_TO_REMOVE_IN_PCA
-        settings["Sample rows removed"] = ROWS_TO_REMOVE_IN_PCA
-        settings["Sample columns removed"] = COLS_TO_REMOVE_IN_PCA
-        settings["Samples removed"] = APPEARANCE_TO_REMOVE_IN_PCA
-        settings["Wavenumber range"] = WAVENUMBER_RANGE_FOR_PCA
+    print("Creating dataframes...")
+    print()
 
-        json.dump(settings, f, indent=2)
+    store, samples, rows, grid = select_spectra(parsed_files)
 
-    # Confirm PCA ran successfully
-    for i in pcaobj["r2x"]:
+    matrix, deviation = align_rows(store, rows, grid)
 
-        if np.isnan(i):
-            sys.exit(f"PCA not successful.")
+    print(
+        f"Spectra aligned onto {grid.size} shifts ({SPECTRAL_ALIGNMENT}), maximum axis deviation {deviation:.3f} cm-1."
+    )
+    print()
 
-    # If successful, save pcaobj to .npy file
-    # This is a format that can be loaded into Python for plotting and further analysis
-    # This file is not human-readable
-    np.save(f"{PCA_OUTPUT}/pcaobj_not_viewable.npy", pcaobj)
+    # =========================
+    # Create spectral dataframe
+    # =========================
 
-    sys.exit(
-        f"""PCA successfully conducted with {NUM_PCS} Principal Components, removing {CROSS_VAL}% of data per round.\n
-    Please see \"{PCA_OUTPUT}/dataframes.txt\" for the dataframes analysed by PCA.\n
-    Please see \"{PCA_OUTPUT}/files_analysed.txt\" for a list of the files analysed.\n
-    Please see \"{PCA_OUTPUT}/pca_settings.json\" for the settings applied to the dataframes before PCA.\n
-    Please see \"{PCA_OUTPUT}/pca_terminal_output.txt\" for the diagnostics sent to the terminal.\n
-    Please see \"{PCA_OUTPUT}/pcaobj.txt\" for the elements of the PCA model.
-    """
+    # Crop spectra according to WAVENUMBER_RANGE_FOR_PCA
+    crop = crop_grid(grid, lower_bound, upper_bound)
+
+    # The cropped matrix is a view of the aligned spectra
+    spectral_df = pd.DataFrame(
+        matrix[:, crop],
+        index=pd.Index(rows, name="spectrum"),
+        columns=pd.Index(grid[crop], name="shift"),
+        copy=False,
+    )
+
+    print(
+        f"Dataframes created with shifts between {lower_bound} and {upper_bound} cm-1."
     )
+    print()
+
+    sample_df = samples.to_frame()
+
+    return spectral_df, sample_df
+
+
+# =========================================================================
+# Create the preprocessed spectral dataframe and the sample dataframe for
+# randomised PCA, reading CHUNK_ROWS spectra at a time from the spectral
+# store. Every chunk is aligned, cropped and preprocessed and written to a
+# memory-mapped .npy file at path, so the spectra are never held in memory
+# =========================================================================
+def stream_dataframes(
+    parsed_files, lower_bound, upper_bound, path, chunk_rows=CHUNK_ROWS
+):
+
+    print("Creating dataframes...")
+    print()
+
+    store, samples, rows, grid = select_spectra(parsed_files)
+
+    crop = crop_grid(grid, lower_bound, upper_bound)
+
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Written to a temporary file first, as a previous matrix may still be mapped
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+
+    matrix = None
+    deviation = 0.0
+
+    for start in range(0, rows.size, chunk_rows):
+        chunk = rows[start : start + chunk_rows]
+
+        aligned, chunk_deviation = align_rows(store, chunk, grid)
+        deviation = max(deviation, chunk_deviation)
+
+        chunk_df = pd.DataFrame(
+            aligned[:, crop], columns=pd.Index(grid[crop], name="shift"), copy=False
+        )
+
+        # Preprocessing is reported for the first chunk only
+        if start == 0:
+            chunk_df = preprocess(chunk_df)
+        else:
+            with redirect_stdout(io.StringIO()):
+                chunk_df = preprocess(chunk_df)
+
+        # The Savitzky-Golay filter drops shifts at both ends
+        if matrix is None:
+            columns = chunk_df.columns
+
+            matrix = np.lib.format.open_memmap(
+                tmp, mode="w+", dtype=np.float64, shape=(rows.size, columns.size)
+            )
+
+        matrix[start : start + chunk.size] = chunk_df.to_numpy(dtype=np.float64)
+
+    matrix.flush()
+    del matrix
+
+    os.replace(tmp, path)
+
+    print(
+        f"Spectra aligned onto {grid.size} shifts ({SPECTRAL_ALIGNMENT}), maximum axis deviation {deviation:.3f} cm-1."
+    )
+    print()
+
+    spectral_df = pd.DataFrame(
+        np.load(path, mmap_mode="r"),
+        index=pd.Index(rows, name="spectrum"),
+        columns=columns,
+        copy=False,
+    )
+
+    print(
+        f"Dataframes created with shifts between {lower_bound} and {upper_bound} cm-1, preprocessed {chunk_rows} spectra at a time into {path}."
+    )
+    print()
+
+    sample_df = samples.to_frame()
+
+    return spectral_df, sample_df
+
+
+# =====================================================================
+# Samples selected for PCA, their rows in the spectral store and the
+# common grid their spectra are aligned onto
+# =====================================================================
+def select_spectra(parsed_files):
+
+    store = open_store()
+
+    # Plate, well and layout metadata of every sample in columnar arrays
+    samples = SampleTable.from_records(parsed_files, store)
+
+    # ====================================
+    # Filter samples to be included in PCA
+    # ====================================
+
+    samples = samples.take(select(samples, ~removed_in_pca()))
+
+    rows = samples["spectrum"]
+
+    if rows.size == 0:
+        sys.exit("Every spectrum has been removed from the PCA")
+
+    # Resample the spectra of every plate onto the shift axis of the first
+    # selected plate into a single (n_samples, n_shifts) matrix
+    grid, _ = store.spectrum(rows[0])
+
+    # Shifts outside the range of any selected plate would be extrapolated
+    if SPECTRAL_ALIGNMENT != "none":
+        grid = common_grid(grid, store.shifts, store.index["axis"][rows])
+
+        if grid.size == 0:
+            sys.exit("The shift axes of the selected spectra do not overlap")
+
+    # Summarise the acquisition settings combined into the PCA
+    # Only the spectra selected for PCA are counted
+    groups = group_by_settings(store.acquisitions)
+    selected = store.groups()[rows]
+    counts = np.bincount(selected, minlength=groups.size)
+
+    for group in np.unique(selected):
+        acquisition = store.acquisitions[np.flatnonzero(groups == group)[0]]
+        print(f"Acquisition group {group}: {acquisition} ({counts[group]} spectra)")
+
+    return store, samples, rows, grid
+
+
+def align_rows(store, rows, grid):
+
+    if NORMALISE_TO_COUNTS_PER_SECOND is True:
+        spectra = store.counts_per_second(rows)
+    else:
+        spectra = store.spectra[rows]
+
+    try:
+        return align_spectra(
+            spectra,
+            store.shifts,
+            store.index["axis"][rows],
+            grid,
+            SPECTRAL_ALIGNMENT,
+        )
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+def crop_grid(grid, lower_bound, upper_bound):
+
+    crop = crop_shifts(grid, lower_bound, upper_bound)
+
+    if crop.start == crop.stop:
+        sys.exit(f"No shifts found between {lower_bound} and {upper_bound} cm-1")
+
+    return crop
+
+
+# ===============================================================
+# Lower and upper bounds of a wavenumber range such as (None, 1800)
+# None defaults to MINIMUM_WAVENUMBER or MAXIMUM_WAVENUMBER
+# ===============================================================
+def wavenumber_bounds(wavenumber_range):
+
+    lower_bound, upper_bound = wavenumber_range
+
+    if lower_bound is None:
+        lower_bound = MINIMUM_WAVENUMBER
+
+    if upper_bound is None:
+        upper_bound = MAXIMUM_WAVENUMBER
+
+    return lower_bound, upper_bound
+
+
+# ==========================================================================
+# Slice of the shifts within the wavenumber range
+# MINIMUM_WAVENUMBER and MAXIMUM_WAVENUMBER leave that end of the range open
+# ==========================================================================
+def crop_shifts(grid, lower_bound, upper_bound):
+
+    keep = np.ones(grid.size, dtype=bool)
+
+    if lower_bound != MINIMUM_WAVENUMBER:
+        keep &= grid >= lower_bound
+
+    if upper_bound != MAXIMUM_WAVENUMBER:
+        keep &= grid <= upper_bound
+
+    # Shifts are monotonic, so the range is a single contiguous block
+    kept = np.flatnonzero(keep)
+
+    if kept.size == 0:
+        return slice(0, 0)
+
+    return slice(kept[0], kept[-1] + 1)
 
 
 if __name__ == "__main__":
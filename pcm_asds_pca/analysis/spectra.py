@@ -17,13 +17,17 @@ from matplotlib.ticker import MaxNLocator
 
 from pcm_asds_pca.config.settings import *
 
-from pcm_asds_pca.core.sample import Sample
+from pcm_asds_pca.core.filters import removed_in_spectra, select
+
+from pcm_asds_pca.core.model import open_model
+
+from pcm_asds_pca.core.store import open_store
 
 
 def main():
 
-    # Read pcaobj from .npy file
-    pcaobj = np.load(f"{PCA_OUTPUT}/pcaobj_not_viewable.npy", allow_pickle=True).item()
+    # Read pcaobj from the PCA model, arrays are memory-mapped rather than loaded
+    pcaobj = open_model(f"{PCA_OUTPUT}/{MODEL_FOLDER}").to_pcaobj()
 
     # Filter pcaobj according to settings.py
     pcaobj, rows_to_remove = filter_pcaobj(pcaobj)
@@ -51,14 +55,13 @@ def main():
     # ===========
 
     # Filter sample_df by PLATES_TO_REMOVE_IN_SPECTRA, ROWS_TO_REMOVE_IN_SPECTRA and COLS_TO_REMOVE_IN_SPECTRA
-    sample_df = sample_df[
-        (~sample_df["plate"].isin(PLATES_TO_REMOVE_IN_SPECTRA))
-        & (~sample_df["row"].isin(ROWS_TO_REMOVE_IN_SPECTRA))
-        & (~sample_df["column"].isin(COLS_TO_REMOVE_IN_SPECTRA))
-    ]
+    sample_df = sample_df.iloc[select(sample_df, ~removed_in_spectra())]
 
     sample_df_labels = (
-        sample_df["well"] + " (" + sample_df["concentration"].astype(str) + " mg/mL)"
+        sample_df["well"].astype(str)
+        + " ("
+        + sample_df["concentration"].astype(str)
+        + " mg/mL)"
     ).tolist()
 
     # ========
@@ -72,12 +75,12 @@ def main():
     # Create a list of sample labels
     # The label for each sample is in the format: "well (concentration mg/mL) (polymer)"
     subset_A_sample_labels = (
-        subset_A["well"]
+        subset_A["well"].astype(str)
         + " ("
         + subset_A["concentration"].astype(str)
         + " mg/mL)"
         + " ("
-        + subset_A["polymer"]
+        + subset_A["polymer"].astype(str)
         + ")"
     ).tolist()
 
@@ -90,12 +93,12 @@ def main():
     subset_B = sample_df.iloc[subset_B]
 
     subset_B_sample_labels = (
-        subset_B["well"]
+        subset_B["well"].astype(str)
         + " ("
         + subset_B["concentration"].astype(str)
         + " mg/mL)"
         + " ("
-        + subset_B["polymer"]
+        + subset_B["polymer"].astype(str)
         + ")"
     ).tolist()
 
@@ -108,12 +111,12 @@ def main():
     subset_C = sample_df.iloc[subset_C]
 
     subset_C_sample_labels = (
-        subset_C["well"]
+        subset_C["well"].astype(str)
         + " ("
         + subset_C["concentration"].astype(str)
         + " mg/mL)"
         + " ("
-        + subset_C["polymer"]
+        + subset_C["polymer"].astype(str)
         + ")"
     ).tolist()
 
@@ -125,7 +128,7 @@ def main():
 
     subset_D = sample_df.iloc[subset_D]
 
-    subset_D_sample_labels = (subset_D["well"]).tolist()
+    subset_D_sample_labels = subset_D["well"].astype(str).tolist()
 
     # Save samples to spectra_samples.txt
     with open(f"{SPECTRA_OUTPUT}/{NAME}_samples.txt", "w") as f:
@@ -286,7 +289,8 @@ def main():
             )
 
         # Wait for plots to load in browser
-        time.sleep(5)
+        if BATCH_MODE is False:
+            time.sleep(5)
 
         # Move .html files to spectra_output/ folder
         src_dir = pathlib.Path(".")
@@ -313,7 +317,8 @@ def main():
             )
 
         # Wait for plots to load in browser
-        time.sleep(5)
+        if BATCH_MODE is False:
+            time.sleep(5)
 
         # Move .html files to spectra_output/ folder
         src_dir = pathlib.Path(".")
@@ -343,6 +348,7 @@ def display_spectra(samples, labels, title):
         settings = json.load(f)
         preprocess_with_savgol = settings["Savitzky-Golay"]
         preprocess_with_snv = settings["Standard Normal Variate"]
+        counts_per_second = settings.get("Counts per second", False)
 
     if preprocess_with_snv is True:
         pipeline.append(rp.preprocessing.PreprocessingStep(standard_normal_variate))
@@ -416,22 +422,15 @@ def display_spectra(samples, labels, title):
 
     cropper = rp.preprocessing.misc.Cropper(region=wavenumber_range)
 
-    spectra_to_visualise = []
-
-    samples = samples.index.tolist()
+    # Spectra are read from the memory-mapped spectral store written by parse()
+    store = open_store()
 
-    for sample in samples:
+    spectra_to_visualise = []
 
-        # Filter spectra
-        if sample.plate in PLATES_TO_REMOVE_IN_SPECTRA:
-            continue
-        elif sample.row in ROWS_TO_REMOVE_IN_SPECTRA:
-            continue
-        elif sample.col in COLS_TO_REMOVE_IN_SPECTRA:
-            continue
+    for sample in samples.itertuples():
 
         # Crop spectra
-        spectrum = cropper.apply(sample.spectrum)
+        spectrum = cropper.apply(load_spectrum(store, sample, counts_per_second))
 
         # Preprocess the spectrum with the same preprocessing techniques as those applied before PCA
         preprocessed_spectrum = preprocessing_pipeline.apply(spectrum)
@@ -453,7 +452,7 @@ def display_spectra(samples, labels, title):
     ax.set_ylim()
 
     plt.savefig(f"{SPECTRA_OUTPUT}/{filename}", bbox_inches="tight", dpi=300)
-    plt.show()
+    show(fig)
 
 
 def display_spectra_highlighted_by_subset(subsets, subset_labels, title):
@@ -462,10 +461,10 @@ def display_spectra_highlighted_by_subset(subsets, subset_labels, title):
 
     filename = f"raman_spectrum_{title}"
 
-    subset_A = subsets[0].index.tolist()
-    subset_B = subsets[1].index.tolist()
-    subset_C = subsets[2].index.tolist()
-    subset_D = subsets[3].index.tolist()
+    subset_A = subsets[0].itertuples()
+    subset_B = subsets[1].itertuples()
+    subset_C = subsets[2].itertuples()
+    subset_D = subsets[3].itertuples()
 
     if DISPLAY_SAMPLE_LABELS is True:
         subset_A_sample_labels = subset_labels[0]
@@ -485,6 +484,7 @@ def display_spectra_highlighted_by_subset(subsets, subset_labels, title):
         settings = json.load(f)
         preprocess_with_savgol = settings["Savitzky-Golay"]
         preprocess_with_snv = settings["Standard Normal Variate"]
+        counts_per_second = settings.get("Counts per second", False)
 
     if preprocess_with_snv is True:
         pipeline.append(rp.preprocessing.PreprocessingStep(standard_normal_variate))
@@ -558,20 +558,15 @@ def display_spectra_highlighted_by_subset(subsets, subset_labels, title):
 
     cropper = rp.preprocessing.misc.Cropper(region=wavenumber_range)
 
+    # Spectra are read from the memory-mapped spectral store written by parse()
+    store = open_store()
+
     subset_A_spectra = []
 
     for sample in subset_A:
 
-        # Filter spectra
-        if sample.plate in PLATES_TO_REMOVE_IN_SPECTRA:
-            continue
-        elif sample.row in ROWS_TO_REMOVE_IN_SPECTRA:
-            continue
-        elif sample.col in COLS_TO_REMOVE_IN_SPECTRA:
-            continue
-
         # Crop spectra
-        spectrum = cropper.apply(sample.spectrum)
+        spectrum = cropper.apply(load_spectrum(store, sample, counts_per_second))
 
         # Preprocess the spectrum with the same preprocessing techniques as those applied before PCA
         preprocessed_spectrum = preprocessing_pipeline.apply(spectrum)
@@ -582,16 +577,8 @@ def display_spectra_highlighted_by_subset(subsets, subset_labels, title):
 
     for sample in subset_B:
 
-        # Filter spectra
-        if sample.plate in PLATES_TO_REMOVE_IN_SPECTRA:
-            continue
-        elif sample.row in ROWS_TO_REMOVE_IN_SPECTRA:
-            continue
-        elif sample.col in COLS_TO_REMOVE_IN_SPECTRA:
-            continue
-
         # Crop spectra
-        spectrum = cropper.apply(sample.spectrum)
+        spectrum = cropper.apply(load_spectrum(store, sample, counts_per_second))
 
         # Preprocess the spectrum with the same preprocessing techniques as those applied before PCA
         preprocessed_spectrum = preprocessing_pipeline.apply(spectrum)
@@ -602,16 +589,8 @@ def display_spectra_highlighted_by_subset(subsets, subset_labels, title):
 
     for sample in subset_C:
 
-        # Filter spectra
-        if sample.plate in PLATES_TO_REMOVE_IN_SPECTRA:
-            continue
-        elif sample.row in ROWS_TO_REMOVE_IN_SPECTRA:
-            continue
-        elif sample.col in COLS_TO_REMOVE_IN_SPECTRA:
-            continue
-
         # Crop spectra
-        spectrum = cropper.apply(sample.spectrum)
+        spectrum = cropper.apply(load_spectrum(store, sample, counts_per_second))
 
         # Preprocess the spectrum with the same preprocessing techniques as those applied before PCA
         preprocessed_spectrum = preprocessing_pipeline.apply(spectrum)
@@ -622,16 +601,8 @@ def display_spectra_highlighted_by_subset(subsets, subset_labels, title):
 
     for sample in subset_D:
 
-        # Filter spectra
-        if sample.plate in PLATES_TO_REMOVE_IN_SPECTRA:
-            continue
-        elif sample.row in ROWS_TO_REMOVE_IN_SPECTRA:
-            continue
-        elif sample.col in COLS_TO_REMOVE_IN_SPECTRA:
-            continue
-
         # Crop spectra
-        spectrum = cropper.apply(sample.spectrum)
+        spectrum = cropper.apply(load_spectrum(store, sample, counts_per_second))
 
         # Preprocess the spectrum with the same preprocessing techniques as those applied before PCA
         preprocessed_spectrum = preprocessing_pipeline.apply(spectrum)
@@ -684,7 +655,23 @@ def display_spectra_highlighted_by_subset(subsets, subset_labels, title):
     ax.set_ylim()
 
     plt.savefig(f"{SPECTRA_OUTPUT}/{filename}", bbox_inches="tight", dpi=300)
-    plt.show()
+    show(fig)
+
+
+# ==========================================================
+# Create a ramanspy spectrum from a row of the spectral store
+# ==========================================================
+def load_spectrum(store, sample, counts_per_second=False):
+
+    row = store.lookup(sample.plate, sample.well, sample.replicate)
+
+    shifts, intensities = store.spectrum(row)
+
+    # Normalise with the acquisition time of the plate, as before PCA
+    if counts_per_second is True:
+        intensities = intensities / store.acquisition(row).acquisition_time
+
+    return rp.Spectrum(intensities, shifts)
 
 
 # ===================================
@@ -750,7 +737,17 @@ def display_PCs_R2X(num_pcs, pcaobj):
     fig.canvas.manager.set_window_title(filename)
 
     fig.savefig(f"{SPECTRA_OUTPUT}/{filename}", bbox_inches="tight", dpi=300)
-    plt.show()
+    show(fig)
+
+
+# ==================================================
+# Display a saved figure, or close it in batch mode
+# ==================================================
+def show(fig):
+    if BATCH_MODE is True:
+        plt.close(fig)
+    else:
+        plt.show()
 
 
 # ====================================================
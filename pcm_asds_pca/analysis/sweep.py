@@ -0,0 +1,308 @@
+# ============================================================================
+# Fit a PCA model for every combination of a grid of settings in parallel
+# The spectra are parsed, filtered and aligned once into shared memory, then
+# every worker crops, preprocesses and fits its own configurations, e.g.
+#
+#   python -m pcm_asds_pca.analysis.sweep --grid sweep.toml --workers 8
+#
+# with sweep.toml listing the values of each setting to try:
+#
+#   NUM_PCS = [2, 3, 4]
+#   PREPROCESS_WITH_SAVGOL = [true]
+#   SAVGOL_WINDOW = [5, 7, 11]
+#   SAVGOL_POLYNOMIAL = [2, 3]
+#   WAVENUMBER_RANGE_FOR_PCA = [[200, 1800], [300, 1700]]
+#
+# Settings left out of the grid keep their value from settings.py
+# R2X and Q2 of every configuration are written to sweep_results.csv
+# ============================================================================
+
+import argparse
+import io
+import itertools
+import json
+import numpy as np
+import pandas as pd
+import pathlib
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from multiprocessing.shared_memory import SharedMemory
+
+from pcm_asds_pca.analysis.batch import (
+    EXIT_FAILED,
+    EXIT_OK,
+    EXIT_USAGE,
+    apply_settings,
+    parse_overrides,
+    read_config,
+)
+
+# Settings that can be swept
+GRID_SETTINGS = (
+    "WAVENUMBER_RANGE_FOR_PCA",
+    "PREPROCESS_WITH_SNV",
+    "PREPROCESS_WITH_SAVGOL",
+    "SAVGOL_WINDOW",
+    "SAVGOL_DERIVATIVE",
+    "SAVGOL_POLYNOMIAL",
+    "NUM_PCS",
+    "CROSS_VAL",
+    "PCA_ALGORITHM",
+)
+
+# Spectral matrix attached by each worker process
+shared = {}
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        prog="python -m pcm_asds_pca.analysis.sweep",
+        description="Fit a PCA model for every combination of a grid of settings",
+    )
+    parser.add_argument(
+        "--grid",
+        required=True,
+        help="Values of each setting, from a .json or .toml file",
+    )
+    parser.add_argument(
+        "--config", help="Settings to override, from a .json or .toml file"
+    )
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes, all available cores if not given",
+    )
+    parser.add_argument("--output", default="sweep_output")
+    args = parser.parse_args(argv)
+
+    from pcm_asds_pca.config import settings
+
+    try:
+        overrides = read_config(args.config) if args.config else {}
+        overrides.update(parse_overrides(args.set))
+        apply_settings(settings, overrides)
+        configs = expand_grid(read_config(args.grid), settings)
+    except (OSError, ValueError) as e:
+        print(f"Invalid settings: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    settings.BATCH_MODE = True
+
+    from pcm_asds_pca.analysis.pca import create_dataframes
+    from pcm_asds_pca.core.parse import parse
+
+    output = pathlib.Path(f"{settings.PATH_TO_DIR}{args.output}")
+    output.mkdir(parents=True, exist_ok=True)
+
+    try:
+        # Uncropped and unprocessed spectra, shared by every configuration
+        spectral_df, _ = create_dataframes(
+            parse(), settings.MINIMUM_WAVENUMBER, settings.MAXIMUM_WAVENUMBER
+        )
+    except SystemExit as e:
+        print(e.code, file=sys.stderr)
+        return EXIT_FAILED
+
+    matrix = np.ascontiguousarray(spectral_df.to_numpy(dtype=np.float64))
+
+    memory = SharedMemory(create=True, size=max(matrix.nbytes, 1))
+
+    try:
+        np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=memory.buf)[:] = matrix
+
+        print(f"Fitting {len(configs)} configurations of {matrix.shape[0]} spectra...")
+        print()
+
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=attach,
+            initargs=(
+                overrides,
+                memory.name,
+                matrix.shape,
+                spectral_df.columns.to_numpy(dtype=np.float64),
+                spectral_df.index,
+            ),
+        ) as executor:
+            results = list(
+                executor.map(
+                    fit_config,
+                    range(1, len(configs) + 1),
+                    configs,
+                    itertools.repeat(output),
+                )
+            )
+
+    finally:
+        memory.close()
+        memory.unlink()
+
+    table = pd.DataFrame(results).set_index("config")
+    table.to_csv(output / "sweep_results.csv")
+
+    with pd.option_context("display.max_rows", None, "display.width", None):
+        print(table.drop(columns="folder"))
+
+    print()
+    print(
+        f'Please see "{output}/sweep_results.csv" for the results of every configuration.'
+    )
+
+    if table["error"].notna().any():
+        return EXIT_FAILED
+
+    return EXIT_OK
+
+
+def expand_grid(grid, settings):
+    """
+    Every combination of the values in grid, as dicts of all GRID_SETTINGS
+    """
+    for name in grid:
+        if name not in GRID_SETTINGS:
+            raise ValueError(
+                f"{name} cannot be swept, choose from {', '.join(GRID_SETTINGS)}"
+            )
+
+    values = []
+
+    for name in GRID_SETTINGS:
+        options = grid.get(name, [getattr(settings, name)])
+
+        if not isinstance(options, list) or not options:
+            raise ValueError(f"{name} must be a non-empty list of values")
+
+        # Wavenumber ranges are lists in .json and .toml files
+        if name == "WAVENUMBER_RANGE_FOR_PCA":
+            options = [tuple(option) for option in options]
+
+        values.append(options)
+
+    configs = [
+        dict(zip(GRID_SETTINGS, combination))
+        for combination in itertools.product(*values)
+    ]
+
+    # Rejected before any configuration is fitted, as fit_pca would fail
+    for config in configs:
+        if config["PCA_ALGORITHM"] == "randomized" and config["CROSS_VAL"] != 0:
+            raise ValueError(
+                f'CROSS_VAL = {config["CROSS_VAL"]} cannot be swept with PCA_ALGORITHM = "randomized", which has no cross validation'
+            )
+
+    return configs
+
+
+def attach(overrides, name, shape, shifts, index):
+
+    # Workers started without fork import settings.py afresh
+    from pcm_asds_pca.config import settings
+
+    apply_settings(settings, overrides)
+    settings.BATCH_MODE = True
+
+    memory = SharedMemory(name=name)
+
+    matrix = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+
+    # Configurations must never modify the shared spectra
+    matrix.flags.writeable = False
+
+    shared.update(memory=memory, matrix=matrix, shifts=shifts, index=index)
+
+
+def fit_config(number, config, output):
+
+    from pcm_asds_pca.analysis.pca import (
+        crop_shifts,
+        fit_pca,
+        preprocess,
+        wavenumber_bounds,
+    )
+    from pcm_asds_pca.config.settings import MODEL_FOLDER
+    from pcm_asds_pca.core.model import write_model
+
+    start = time.perf_counter()
+
+    result = dict(config=number)
+    result.update({name.lower(): config[name] for name in GRID_SETTINGS})
+
+    try:
+        lower_bound, upper_bound = wavenumber_bounds(config["WAVENUMBER_RANGE_FOR_PCA"])
+
+        crop = crop_shifts(shared["shifts"], lower_bound, upper_bound)
+
+        if crop.start == crop.stop:
+            raise ValueError(
+                f"No shifts found between {lower_bound} and {upper_bound} cm-1"
+            )
+
+        spectral_df = pd.DataFrame(
+            shared["matrix"][:, crop],
+            index=shared["index"],
+            columns=pd.Index(shared["shifts"][crop], name="shift"),
+            copy=False,
+        )
+
+        with redirect_stdout(io.StringIO()):
+            spectral_df = preprocess(
+                spectral_df,
+                snv=config["PREPROCESS_WITH_SNV"],
+                savgol=config["PREPROCESS_WITH_SAVGOL"],
+                window=config["SAVGOL_WINDOW"],
+                derivative=config["SAVGOL_DERIVATIVE"],
+                polynomial=config["SAVGOL_POLYNOMIAL"],
+            )
+
+        pcaobj, diagnostics = fit_pca(
+            spectral_df,
+            num_pcs=config["NUM_PCS"],
+            cross_val=config["CROSS_VAL"],
+            algorithm=config["PCA_ALGORITHM"],
+        )
+
+        if np.isnan(pcaobj["r2x"]).any():
+            raise ValueError("PCA not successful")
+
+        folder = output / f"config_{number:03d}"
+        folder.mkdir(parents=True, exist_ok=True)
+
+        with open(folder / "pca_terminal_output.txt", "w") as f:
+            f.write(diagnostics)
+
+        write_model(folder / MODEL_FOLDER, pcaobj, config, spectrum=spectral_df.index)
+
+        with open(folder / "pca_settings.json", "w") as f:
+            json.dump(config, f, indent=2)
+
+        result.update(
+            shifts=spectral_df.shape[1],
+            r2x=float(np.sum(pcaobj["r2x"])),
+            q2=float(np.sum(pcaobj["q2"])) if "q2" in pcaobj else np.nan,
+            folder=folder.name,
+            error=None,
+        )
+
+    except Exception as e:
+        # A failed configuration is recorded without stopping the sweep
+        result.update(
+            shifts=np.nan,
+            r2x=np.nan,
+            q2=np.nan,
+            folder=None,
+            error=f"{type(e).__name__}: {e}",
+        )
+
+    result["seconds"] = round(time.perf_counter() - start, 3)
+
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+# ===========================================================================
+# Benchmark ingestion of multiwell files on synthetic plates
+# Times each stage between the multiwell files and the PCA dataframes and
+# reports throughput in wells per second and peak memory
+#
+# e.g. python -m pcm_asds_pca.benchmark.ingest --plates 4 --wells 384
+# ===========================================================================
+
+import argparse
+import io
+import os
+import pathlib
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from contextlib import redirect_stdout
+
+from pcm_asds_pca.benchmark.synthetic import (
+    HEADER_VARIANTS,
+    generate_plates,
+    plate_positions,
+)
+from pcm_asds_pca.core.wells import PLATE_FORMATS, well_labels
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plates", type=int, default=3)
+    parser.add_argument("--wells", type=int, default=96, choices=list(PLATE_FORMATS))
+    parser.add_argument("--points", type=int, default=1212)
+    parser.add_argument("--header", default="labspec", choices=HEADER_VARIANTS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--folder",
+        default=None,
+        help="Working folder, a temporary folder is used and removed if not given",
+    )
+    args = parser.parse_args()
+
+    if args.folder is None:
+        folder = pathlib.Path(tempfile.mkdtemp(prefix="pcm_asds_pca_benchmark_"))
+    else:
+        folder = pathlib.Path(args.folder).resolve()
+        folder.mkdir(parents=True, exist_ok=True)
+
+    try:
+        run(folder, args)
+    finally:
+        if args.folder is None:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def run(folder, args):
+
+    # Settings are read when pcm_asds_pca is first imported, so the working
+    # folder must be set up before any of the modules being timed are imported
+    os.environ["PATH_TO_DIR"] = f"{folder}/"
+    os.chdir(folder)
+
+    from pcm_asds_pca.config.settings import (
+        ANALYSIS_FOLDER,
+        CACHE_FOLDER,
+        MAXIMUM_WAVENUMBER,
+        MINIMUM_WAVENUMBER,
+        PARSED_FOLDER,
+        STORE_FOLDER,
+    )
+
+    print(
+        f"Generating {args.plates} plates of {args.wells} wells with {args.points} shifts "
+        f"({args.header} headers)..."
+    )
+    print()
+
+    paths = generate_plates(
+        folder / ANALYSIS_FOLDER,
+        plates=args.plates,
+        wells=args.wells,
+        points=args.points,
+        header=args.header,
+        seed=args.seed,
+    )
+
+    n_wells = args.plates * args.wells
+
+    def clear_outputs():
+        for name in [PARSED_FOLDER, CACHE_FOLDER, STORE_FOLDER]:
+            shutil.rmtree(folder / name, ignore_errors=True)
+
+    from pcm_asds_pca.analysis.pca import create_dataframes
+    from pcm_asds_pca.core.labspec import parse_multiwell_array
+    from pcm_asds_pca.core.parse import parse, parse_multiwell_file
+    from pcm_asds_pca.core.readers import EXTENSIONS
+    from pcm_asds_pca.core.reduce import WellReducer
+    from pcm_asds_pca.core.sample import Sample
+    from pcm_asds_pca.core.scan import parse_names, scan
+    from pcm_asds_pca.core.sort import sort_files
+
+    def well_files():
+        rows, cols = plate_positions(args.wells)
+        wells = well_labels(rows, cols)
+
+        files = []
+        for path in paths:
+            plate = path.name.removesuffix("_multiwell.txt")
+            files.extend(f"{PARSED_FOLDER}/{plate}_{well}.txt" for well in wells)
+
+        random.Random(args.seed).shuffle(files)
+        return files
+
+    def ingest():
+        clear_outputs()
+        return parse()
+
+    stages = [
+        ("parse_multiwell_file", lambda: [parse_multiwell_file(p) for p in paths]),
+        (
+            "parse_multiwell_array",
+            lambda: [parse_multiwell_array(p, WellReducer()) for p in paths],
+        ),
+        ("scan", lambda: scan(ANALYSIS_FOLDER, EXTENSIONS)),
+        ("sort_files", lambda files: sort_files(files), well_files),
+        (
+            "Sample",
+            lambda records: [Sample(r["path"], None, r) for r in records],
+            lambda: parse_names(well_files()),
+        ),
+        ("parse (cold)", ingest),
+        ("parse (warm)", parse),
+        (
+            "create_dataframes",
+            lambda files: create_dataframes(
+                files, MINIMUM_WAVENUMBER, MAXIMUM_WAVENUMBER
+            ),
+            parse,
+        ),
+    ]
+
+    results = []
+
+    for stage in stages:
+        name, func = stage[:2]
+        setup = stage[2] if len(stage) > 2 else None
+
+        print(f"Timing {name}...")
+
+        try:
+            seconds, peak = measure(func, setup, args.repeat)
+        except (Exception, SystemExit) as e:
+            results.append((name, None, None, f"{type(e).__name__}: {e}"))
+            continue
+
+        results.append((name, seconds, peak, ""))
+
+    print()
+    report(results, n_wells)
+
+
+def measure(func, setup, repeat):
+    # Best of repeat runs, then one run under tracemalloc for peak memory
+    # Memory allocated by worker processes is not included
+    times = []
+
+    with redirect_stdout(io.StringIO()):
+
+        for _ in range(max(repeat, 1)):
+            args = () if setup is None else (setup(),)
+
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+
+        args = () if setup is None else (setup(),)
+
+        tracemalloc.start()
+        try:
+            func(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return min(times), peak
+
+
+def report(results, n_wells):
+
+    print(f"{'Stage':<24}{'Time (s)':>12}{'Wells/s':>14}{'Peak (MiB)':>14}")
+
+    for name, seconds, peak, error in results:
+
+        if seconds is None:
+            print(f"{name:<24}{'failed':>12}  {error}")
+            continue
+
+        rate = n_wells / seconds if seconds > 0 else float("inf")
+
+        print(f"{name:<24}{seconds:>12.4f}{rate:>14.0f}{peak / 2**20:>14.1f}")
+
+    print()
+    print(f"{n_wells} wells in total")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# ===========================================================================
+# Generate synthetic multiwell files in the LabSpec 6 export format
+# Used to benchmark ingestion on more plates, wells and shifts than in data/
+# ===========================================================================
+
+import numpy as np
+import pathlib
+
+from pcm_asds_pca.core.wells import PLATE_FORMATS
+
+HEADER_VARIANTS = ["labspec", "minimal", "none", "mixed"]
+
+# Approximate positions of the main paracetamol bands (cm-1)
+PEAKS = [329, 390, 465, 651, 797, 858, 1237, 1323, 1371, 1561, 1611, 1648]
+
+
+def generate_plates(
+    folder,
+    plates=3,
+    wells=96,
+    points=1212,
+    header="labspec",
+    seed=0,
+):
+    """
+    Write synthetic plateN_XXmgml_multiwell.txt files to folder.
+
+    header is one of HEADER_VARIANTS, "mixed" cycles through the others
+    from plate to plate. Returns the paths of the files written
+    """
+    if wells not in PLATE_FORMATS:
+        raise ValueError(f"Number of wells must be one of {list(PLATE_FORMATS)}")
+
+    if header not in HEADER_VARIANTS:
+        raise ValueError(f"Header variant must be one of {HEADER_VARIANTS}")
+
+    folder = pathlib.Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+
+    shifts = make_shifts(points)
+
+    paths = []
+
+    for plate in range(1, plates + 1):
+
+        variant = header
+        if variant == "mixed":
+            variant = HEADER_VARIANTS[(plate - 1) % (len(HEADER_VARIANTS) - 1)]
+
+        concentration = 60 // plate or 1
+
+        rows, cols = plate_positions(wells)
+        matrix = make_spectra(rows.size, shifts, rng)
+
+        path = folder / f"plate{plate}_{concentration}mgml_multiwell.txt"
+
+        write_multiwell_file(
+            path, make_header(variant, plate), shifts, matrix, rows, cols
+        )
+
+        paths.append(path)
+
+    return paths
+
+
+def plate_positions(wells):
+    # Wells are exported row by row, e.g. 1 1, 1 2, ..., 8 12
+    n_rows, n_cols = PLATE_FORMATS[wells]
+
+    rows = np.repeat(np.arange(1, n_rows + 1), n_cols)
+    cols = np.tile(np.arange(1, n_cols + 1), n_rows)
+
+    return rows, cols
+
+
+def make_shifts(points):
+    return np.linspace(5.92113, 2000.0, points)
+
+
+def make_spectra(n_wells, shifts, rng):
+    # Sloping background with Lorentzian bands and shot noise
+    background = 2500 + 1.5 * shifts
+
+    heights = rng.uniform(500, 20000, size=(n_wells, len(PEAKS)))
+    widths = rng.uniform(4, 12, size=len(PEAKS))
+
+    bands = widths**2 / ((shifts[:, np.newaxis] - PEAKS) ** 2 + widths**2)
+
+    spectra = background + heights @ bands.T
+
+    return rng.poisson(spectra).astype(np.float64)
+
+
+def make_header(variant, plate):
+
+    if variant == "none":
+        return []
+
+    header = [
+        f"#Acq. time (s)=\t{5 if plate % 2 else 3}",
+        "#Accumulations=\t2",
+        "#Range (cm-¹)=\t5...2000",
+    ]
+
+    if variant == "labspec":
+        header += [
+            "#Windows=\t4",
+            "#Spike filter=\tMultiple accum.",
+            "#Detector temperature (°C)=\t-60.1",
+            "#Instrument=\tLabRAM HR Evol",
+            "#Detector=\tSyncerity OE",
+            "#Objective=\tx20_VIS_LWD",
+            "#Grating=\t600 (500nm)",
+            "#ND Filter=\t100%",
+            "#Laser=\t532nm_ULF",
+            "#X (µm)=\t0",
+            "#Y (µm)=\t0",
+            f"#Title=\tsynthetic plate {plate}",
+            "#Acquired=\t15.12.2025 12:20:29",
+        ]
+
+    header += [
+        "#AxisType[0]=Intens",
+        "#AxisUnit[0]=Cnt",
+        "#AxisType[1]=Spectr",
+        "#AxisUnit[1]=1/cm",
+        "#AxisType[2]=Column",
+        "#AxisUnit[2]=Number",
+        "#AxisType[3]=Row",
+        "#AxisUnit[3]=Number",
+    ]
+
+    return header
+
+
+def write_multiwell_file(path, header, shifts, matrix, rows, cols):
+    # file Column = plate row, file Row = plate column
+    lines = list(header)
+    lines.append("\t\t" + "\t".join(f"{x:g}" for x in shifts))
+
+    for row, col, intensities in zip(rows, cols, matrix):
+        lines.append(f"{row}\t{col}\t" + "\t".join(f"{y:g}" for y in intensities))
+
+    # LabSpec exports are latin-1 encoded with CRLF line endings
+    with open(path, "w", encoding="latin-1", newline="\r\n") as f:
+        f.write("\n".join(lines))
+        f.write("\n")
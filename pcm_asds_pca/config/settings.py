@@ -11,8 +11,17 @@ load_dotenv()
 PATH_TO_DIR = getenv("PATH_TO_DIR")
 
 ANALYSIS_FOLDER = "analyse"
+PARSED_FOLDER = "parsed"
 PCA_OUTPUT = "pca_output"
 SPECTRA_OUTPUT = "spectra_output"
+CACHE_FOLDER = ".parse_cache"
+STORE_FOLDER = "spectral_store"
+STAGE_CACHE_FOLDER = ".stage_cache"
+MODEL_FOLDER = "pca_model"
+
+# Toggle running without prompts, pauses, windows or browsers
+# Set by pcm_asds_pca.analysis.batch, existing output files are overwritten
+BATCH_MODE = False
 
 # ==============================================================
 # Change according to your multiwell data acquisition parameters
@@ -20,6 +29,42 @@ SPECTRA_OUTPUT = "spectra_output"
 MINIMUM_WAVENUMBER = 5
 MAXIMUM_WAVENUMBER = 2000
 
+# Parser used for multiwell files
+# "array" parses LabSpec files with NumPy a chunk of lines at a time, combining
+# the spectra of every well as it reads (other formats are read in one pass)
+# "lines" parses the file line by line (LabSpec multiwell files only)
+MULTIWELL_PARSER = "array"
+
+# Toggle caching of parsed multiwell files in CACHE_FOLDER
+# Unchanged files are loaded from the cache instead of being parsed again
+USE_PARSE_CACHE = True
+
+# Number of processes used to parse multiwell files
+# None uses all available cores, 1 parses files one after another
+INGEST_WORKERS = None
+
+# Combine spectra recorded in the same well (e.g. maps or replicates)
+# "mean", "median" or "trimmed_mean" keeps one spectrum per well
+# "all" keeps every spectrum, numbering replicates e.g. plate1_60mgml_A1_r2
+WELL_REDUCER = "mean"
+
+# Proportion of spectra cut from each end of a well by "trimmed_mean"
+TRIMMED_MEAN_PROPORTION = 0.1
+
+# Toggle writing a .txt file for every well to PARSED_FOLDER
+# Each plate is always written to a single .npz file
+WRITE_WELL_TXT = False
+
+# Data type of the memory-mapped spectral store in STORE_FOLDER
+# "float32" halves the size of the store on disk
+# The store is rebuilt when STORE_DTYPE changes
+STORE_DTYPE = "float64"
+
+# Layout of the plates (drug, polymer, drug loading, appearance and volume per well)
+# None uses the layouts of plates 1-3 in pcm_asds_pca/config/plate_layouts.csv
+# Otherwise the path to a .csv, .json or .toml file with one row per well
+PLATE_LAYOUT = None
+
 # ================
 # Configure pca.py
 # ================
@@ -27,6 +72,14 @@ MAXIMUM_WAVENUMBER = 2000
 # Toggle whether to conduct PCA
 CONDUCT_PCA = False
 
+# Toggle caching the dataframes, preprocessed spectra and PCA model in STAGE_CACHE_FOLDER
+# Only the stages whose inputs or settings have changed are recomputed
+USE_STAGE_CACHE = True
+
+# Maximum size of STAGE_CACHE_FOLDER in MB
+# The least recently used results are removed first
+STAGE_CACHE_SIZE_MB = 1024
+
 # Number of Principal Components
 NUM_PCS = 0
 
@@ -50,10 +103,36 @@ APPEARANCE_TO_REMOVE_IN_PCA = ""
 # Must be integers between MINIMUM_WAVENUMBER and MAXIMUM_WAVENUMBER
 WAVENUMBER_RANGE_FOR_PCA = (None, None)
 
+# Algorithm used to fit the PCA model
+# "pyphi" uses phi.pca (SVD or NIPALS)
+# "randomized" aligns, crops and preprocesses the spectra a chunk at a time from
+# the spectral store into spectra.npy in STAGE_CACHE_FOLDER, and fits the model
+# reading that memory-mapped matrix a chunk at a time with a fixed number of
+# passes, so the spectra are never held in memory. Requires CROSS_VAL = 0
+PCA_ALGORITHM = "pyphi"
+
+# Toggle incremental PCA
+# Only spectra that are not yet in the PCA model saved in PCA_OUTPUT are fitted
+# and absorbed into it, e.g. a new plate. Every spectrum is refitted when the
+# settings below change or spectra are removed or changed. Requires CROSS_VAL = 0
+# PCA_ALGORITHM is not used
+INCREMENTAL_PCA = False
+
 # % of data to remove per round of PCA
 # Must be an integer between 0 and 100
 CROSS_VAL = 0
 
+# Toggle normalising intensities to counts per second
+# Uses the acquisition time in the header of each multiwell file
+NORMALISE_TO_COUNTS_PER_SECOND = False
+
+# Alignment of plates recorded on different shift axes
+# All spectra are resampled onto the shift axis of the first plate selected for
+# PCA, within the shifts covered by every selected plate
+# "linear" or "cubic" interpolates between neighbouring shifts
+# "none" reuses the shifts of the first selected plate without resampling
+SPECTRAL_ALIGNMENT = "linear"
+
 # Toggle preprocessing with Standard Normal Variate
 PREPROCESS_WITH_SNV = False
 
@@ -67,6 +146,17 @@ SAVGOL_POLYNOMIAL = 0
 
 SAVGOL_WINDOW = 0
 
+# Export the scores and loadings of the PCA model to PCA_OUTPUT
+# None does not export, otherwise "csv" or "parquet" (requires pyarrow)
+EXPORT_MODEL = None
+
+# Number of first and last rows shown in dataframes.txt and pcaobj.txt
+REPORT_ROWS = 5
+
+# Toggle exporting the full spectral and sample dataframes analysed by PCA
+# to spectral_df.csv and sample_df.csv in PCA_OUTPUT
+EXPORT_DATAFRAMES = False
+
 # =====================
 # Configure spectra.py
 # =====================
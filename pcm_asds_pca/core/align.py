@@ -0,0 +1,126 @@
+# ==============================================================================
+# Align spectra recorded on different shift axes onto a common wavenumber grid
+# Every group of spectra sharing an axis is resampled in one batched
+# interpolation over its (wells, shifts) matrix
+# ==============================================================================
+
+import numpy as np
+
+from scipy.interpolate import CubicSpline
+
+
+def align_spectra(spectra, shifts, axes, grid, method="linear"):
+    """
+    Resample every row of spectra onto grid.
+
+    spectra : (n_spectra, n_shifts) matrix, rows may be NaN padded
+    shifts  : (n_axes, n_shifts) matrix of shift axes, NaN padded
+    axes    : axis of each row of spectra
+    grid    : common wavenumber grid
+    method  : "linear", "cubic" or "none"
+
+    Returns the aligned (n_spectra, len(grid)) matrix and the maximum
+    deviation in cm-1 between the shift axes and the grid
+    Grid points outside the shifts of a row are NaN, never extrapolated
+    """
+    grid = np.asarray(grid, dtype=np.float64)
+    axes = np.asarray(axes)
+
+    aligned = np.empty((spectra.shape[0], grid.size))
+    deviation = 0.0
+
+    for axis in np.unique(axes):
+
+        x = np.asarray(shifts[axis], dtype=np.float64)
+        x = x[~np.isnan(x)]
+
+        rows = np.flatnonzero(axes == axis)
+
+        aligned[rows] = resample(spectra[rows, : x.size], x, grid, method)
+
+        deviation = max(deviation, axis_deviation(x, grid))
+
+    return aligned, deviation
+
+
+def resample(matrix, x, grid, method="linear"):
+
+    x, reverse = ascending(x)
+
+    if reverse:
+        matrix = matrix[:, ::-1]
+
+    if np.array_equal(x, grid):
+        return np.asarray(matrix, dtype=np.float64)
+
+    match method:
+
+        case "linear":
+            # Neighbouring shifts and weights are shared by every row
+            right = np.clip(np.searchsorted(x, grid), 1, x.size - 1)
+            left = right - 1
+            weight = (grid - x[left]) / (x[right] - x[left])
+
+            resampled = matrix[:, left] * (1 - weight) + matrix[:, right] * weight
+            resampled[:, (grid < x[0]) | (grid > x[-1])] = np.nan
+
+            return resampled
+
+        case "cubic":
+            return CubicSpline(x, matrix, axis=1, extrapolate=False)(grid)
+
+        case "none":
+            # Use the grid as the shift values without resampling
+            if x.size != grid.size:
+                raise ValueError(
+                    f"Cannot combine {x.size} shifts with {grid.size} shifts without resampling"
+                )
+
+            # Columns follow the direction of the grid
+            if grid.size > 1 and grid[0] > grid[-1]:
+                matrix = matrix[:, ::-1]
+
+            return np.asarray(matrix, dtype=np.float64)
+
+        case _:
+            raise ValueError(f"Unknown alignment method: {method}")
+
+
+def common_grid(grid, shifts, axes):
+    """
+    Points of grid within the shifts of every axis in axes, so that
+    no spectrum has to be extrapolated onto the grid
+    """
+    axes = np.unique(axes)
+
+    lower = max(np.nanmin(shifts[axis]) for axis in axes)
+    upper = min(np.nanmax(shifts[axis]) for axis in axes)
+
+    return grid[(grid >= lower) & (grid <= upper)]
+
+
+def ascending(x):
+    """
+    Shift axis x in ascending order and whether it was reversed
+    Axes recorded from high to low wavenumber are reversed
+    """
+    step = np.diff(x)
+
+    if np.all(step > 0):
+        return x, False
+
+    if np.all(step < 0):
+        return x[::-1], True
+
+    raise ValueError("Shift axis is not strictly increasing or decreasing")
+
+
+def axis_deviation(x, grid):
+    # Largest distance from a grid point to the nearest shift in x
+    x = np.sort(x)
+    right = np.clip(np.searchsorted(x, grid), 1, x.size - 1)
+    left = right - 1
+
+    distance = np.minimum(np.abs(grid - x[left]), np.abs(grid - x[right]))
+
+    return float(np.max(distance, initial=0.0))
@@ -0,0 +1,159 @@
+# =========================================================================
+# Content-addressed cache of parsed multiwell files
+# Each plate is stored as an .npz bundle of its spectra, already combined
+# well by well, keyed on its full file name, a hash of its path and a hash
+# of the decoded file and of the way the spectra were combined
+# Entries of files that have changed or been removed are evicted by
+# prune_cache, once per run of parse()
+# =========================================================================
+
+import hashlib
+import numpy as np
+import os
+import pathlib
+
+from pcm_asds_pca.config.settings import CACHE_FOLDER, PATH_TO_DIR
+
+# Increment when the layout of a cache entry changes
+CACHE_VERSION = 4
+
+
+def cached_parse(path, text, parser, variant=""):
+    """
+    Return parser() for a multiwell file, reusing a cached result
+    if the file contents are unchanged since it was last parsed.
+
+    text is the decoded contents of the file, which are hashed
+    parser must return (header, matrix, shifts, rows, cols, replicates)
+    variant names any setting the result depends on, e.g. the well reducer
+    """
+    path = pathlib.Path(path)
+
+    digest = text_hash(text, variant)
+
+    cached = read_cache(path, digest)
+
+    if cached is not None:
+        return cached
+
+    header, matrix, shifts, rows, cols, replicates = parser()
+
+    write_cache(path, digest, header, matrix, shifts, rows, cols, replicates)
+
+    return header, matrix, shifts, rows, cols, replicates
+
+
+def text_hash(text, variant=""):
+    h = hashlib.sha256(variant.encode())
+    h.update(text.encode())
+
+    return h.hexdigest()
+
+
+def cache_folder():
+    return pathlib.Path(f"{PATH_TO_DIR}{CACHE_FOLDER}")
+
+
+def cache_prefix(path):
+    # Files with the same stem, e.g. plate1_60mgml.txt and plate1_60mgml.csv,
+    # or the same name in different folders have their own entries
+    key = hashlib.sha256(str(path.resolve()).encode()).hexdigest()[:16]
+
+    return f"{path.name}.{key}."
+
+
+def cache_entry(path, digest):
+    return cache_folder() / f"{cache_prefix(path)}v{CACHE_VERSION}.{digest[:16]}.npz"
+
+
+def read_cache(path, digest):
+    entry = cache_entry(path, digest)
+
+    if not entry.exists():
+        return None
+
+    try:
+        with np.load(entry, allow_pickle=False) as bundle:
+            if str(bundle["digest"]) != digest:
+                raise ValueError("Cache entry does not match file contents")
+
+            cached = (
+                bundle["header"].tolist(),
+                bundle["matrix"],
+                bundle["shifts"],
+                bundle["rows"],
+                bundle["cols"],
+                bundle["replicates"],
+            )
+
+    except (OSError, KeyError, ValueError):
+        # Corrupt or truncated entry
+        entry.unlink(missing_ok=True)
+        return None
+
+    # Mark the entry as recently used, so that prune_cache keeps it
+    os.utime(entry)
+
+    return cached
+
+
+def prune_cache(paths):
+    """
+    Remove the entries of files that are not in paths, and every entry of a
+    file in paths but its most recently used one, i.e. those of previous
+    versions of the file. The cache folder is listed once
+    """
+    folder = cache_folder()
+
+    if not folder.is_dir():
+        return
+
+    prefixes = {cache_prefix(pathlib.Path(path)) for path in paths}
+
+    latest = {}
+
+    for entry in folder.iterdir():
+        if entry.suffix != ".npz":
+            continue
+
+        # Entry names end in .v{CACHE_VERSION}.{digest}.npz after the prefix
+        prefix = entry.name.rsplit(".", 3)[0] + "."
+
+        if prefix not in prefixes:
+            entry.unlink(missing_ok=True)
+            continue
+
+        mtime = entry.stat().st_mtime_ns
+
+        if prefix in latest:
+            previous, previous_mtime = latest[prefix]
+
+            if previous_mtime >= mtime:
+                entry.unlink(missing_ok=True)
+                continue
+
+            previous.unlink(missing_ok=True)
+
+        latest[prefix] = entry, mtime
+
+
+def write_cache(path, digest, header, matrix, shifts, rows, cols, replicates):
+    entry = cache_entry(path, digest)
+    entry.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write to a temporary file first so that readers never see a partial entry
+    tmp = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            digest=np.array(digest),
+            header=np.array(header, dtype=str),
+            matrix=matrix,
+            shifts=shifts,
+            rows=rows,
+            cols=cols,
+            replicates=replicates,
+        )
+
+    os.replace(tmp, entry)
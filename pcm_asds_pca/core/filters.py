@@ -0,0 +1,110 @@
+# ============================================================================
+# Sample filters evaluated as boolean masks over columns of sample metadata
+# Works on a SampleTable or a DataFrame such as sample_df, e.g.
+#   removed = isin("plate", [2]) | (equals("row", "A") & between("column", 1, 6))
+#   kept = select(sample_df, ~removed)
+# ============================================================================
+
+import numpy as np
+
+from pcm_asds_pca.config.settings import (
+    APPEARANCE_TO_REMOVE_IN_PCA,
+    COLS_TO_REMOVE_IN_PCA,
+    COLS_TO_REMOVE_IN_SPECTRA,
+    PLATES_TO_REMOVE_IN_PCA,
+    PLATES_TO_REMOVE_IN_SPECTRA,
+    ROWS_TO_REMOVE_IN_PCA,
+    ROWS_TO_REMOVE_IN_SPECTRA,
+)
+
+
+class Predicate:
+    """
+    Condition on the samples, combined with &, | and ~
+    """
+
+    def __init__(self, function):
+        self.function = function
+
+    def mask(self, samples):
+        return np.asarray(self.function(samples), dtype=bool)
+
+    def __and__(self, other):
+        return Predicate(lambda samples: self.mask(samples) & other.mask(samples))
+
+    def __or__(self, other):
+        return Predicate(lambda samples: self.mask(samples) | other.mask(samples))
+
+    def __invert__(self):
+        return Predicate(lambda samples: ~self.mask(samples))
+
+
+def column(samples, name):
+    return np.asarray(samples[name])
+
+
+def isin(name, values):
+    values = list(values)
+    return Predicate(lambda samples: np.isin(column(samples, name), values))
+
+
+def equals(name, value):
+    return Predicate(lambda samples: column(samples, name) == value)
+
+
+def between(name, low=None, high=None):
+    """
+    low <= value <= high, with None leaving that end open
+    """
+
+    def function(samples):
+        values = column(samples, name)
+        mask = np.ones(len(values), dtype=bool)
+
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values <= high
+
+        return mask
+
+    return Predicate(function)
+
+
+def where(name, function):
+    """
+    Any vectorised condition on a column, e.g. where("volume", lambda v: v > 2)
+    """
+    return Predicate(lambda samples: function(column(samples, name)))
+
+
+def select(samples, predicate):
+    """
+    Positions of the samples matching predicate, in their original order
+    """
+    return np.flatnonzero(predicate.mask(samples))
+
+
+# =================================
+# Filters configured in settings.py
+# =================================
+def removed_in_pca():
+    removed = (
+        isin("plate", PLATES_TO_REMOVE_IN_PCA)
+        | isin("row", ROWS_TO_REMOVE_IN_PCA)
+        | isin("column", COLS_TO_REMOVE_IN_PCA)
+    )
+
+    # "" does not filter by appearance
+    if APPEARANCE_TO_REMOVE_IN_PCA != "":
+        removed = removed | equals("appearance", APPEARANCE_TO_REMOVE_IN_PCA)
+
+    return removed
+
+
+def removed_in_spectra():
+    return (
+        isin("plate", PLATES_TO_REMOVE_IN_SPECTRA)
+        | isin("row", ROWS_TO_REMOVE_IN_SPECTRA)
+        | isin("column", COLS_TO_REMOVE_IN_SPECTRA)
+    )
@@ -0,0 +1,134 @@
+# ============================================================================
+# Typed record of the acquisition parameters in the header of a LabSpec export
+# e.g. #Acq. time (s)=	5
+# Plates acquired with the same settings share a group and can be combined
+# ============================================================================
+
+import datetime
+import numpy as np
+
+
+class Acquisition:
+
+    def __init__(self, header=None):
+
+        fields = {}
+
+        for line in header or []:
+            key, sep, value = line.lstrip("#").partition("=")
+            if sep:
+                fields[key.strip()] = value.strip()
+
+        self.acquisition_time = to_float(fields.get("Acq. time (s)"))
+        self.accumulations = to_int(fields.get("Accumulations"))
+        self.spectral_range = to_range(
+            next((v for k, v in fields.items() if k.startswith("Range (")), None)
+        )
+        self.grating = fields.get("Grating")
+        self.detector = fields.get("Detector")
+        self.objective = fields.get("Objective")
+        self.laser = fields.get("Laser")
+        self.nd_filter = fields.get("ND Filter")
+        self.acquired = to_datetime(fields.get("Acquired"))
+
+    def settings(self):
+        # Acquisition settings that must match for spectra to be combined directly
+        return (
+            self.acquisition_time,
+            self.accumulations,
+            self.spectral_range,
+            self.grating,
+            self.detector,
+        )
+
+    def to_dict(self):
+        record = dict(vars(self))
+
+        if self.spectral_range is not None:
+            record["spectral_range"] = list(self.spectral_range)
+
+        if self.acquired is not None:
+            record["acquired"] = self.acquired.isoformat()
+
+        return record
+
+    @classmethod
+    def from_dict(cls, record):
+        acquisition = cls()
+
+        for key, value in record.items():
+            setattr(acquisition, key, value)
+
+        if acquisition.spectral_range is not None:
+            acquisition.spectral_range = tuple(acquisition.spectral_range)
+
+        if acquisition.acquired is not None:
+            acquisition.acquired = datetime.datetime.fromisoformat(acquisition.acquired)
+
+        return acquisition
+
+    def __eq__(self, other):
+        return isinstance(other, Acquisition) and vars(self) == vars(other)
+
+    def __str__(self):
+        return (
+            f"{self.acquisition_time} s x {self.accumulations} accumulations, "
+            f"{self.grating}, {self.detector}"
+        )
+
+
+# =======================================================================
+# Group spectra by acquisition settings
+# Returns the group number of each acquisition, in order of first appearance
+# =======================================================================
+def group_by_settings(acquisitions):
+    groups = {}
+
+    return np.array(
+        [groups.setdefault(a.settings(), len(groups)) for a in acquisitions],
+        dtype=np.int64,
+    )
+
+
+# ===================================================================
+# Normalise intensities to counts per second in a single vectorised pass
+# acquisition_times holds the acquisition time of each row of matrix
+# ===================================================================
+def counts_per_second(matrix, acquisition_times):
+    acquisition_times = np.asarray(acquisition_times, dtype=np.float64)
+
+    if np.isnan(acquisition_times).any():
+        raise ValueError("Acquisition time not found for every spectrum")
+
+    return matrix / acquisition_times[:, np.newaxis]
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_range(value):
+    # e.g. 5...2000
+    try:
+        low, high = value.split("...")
+        return float(low), float(high)
+    except (AttributeError, ValueError):
+        return None
+
+
+def to_datetime(value):
+    # e.g. 15.12.2025 12:20:29
+    try:
+        return datetime.datetime.strptime(value, "%d.%m.%Y %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,357 @@
+# ============================================================================
+# Incremental PCA that absorbs new blocks of spectra into a fitted model
+# The mean and scatter matrix of every spectrum absorbed so far are kept, so
+# P, mx, sx, r2x, r2xpv and the T2 limits are those of phi.pca on all of the
+# spectra, while absorbing a block only costs time proportional to its size
+# Spectra absorbed earlier are kept as their coordinates in the SKETCH_RANK
+# leading directions of the model (plus the energy left outside them), from
+# which their scores, T2 and SPE are updated without the original spectra
+# A digest of every spectrum absorbed is kept so that spectra which have
+# changed since, e.g. a plate acquired again under the same name, are found
+# ============================================================================
+
+import datetime
+import hashlib
+import numpy as np
+import pandas as pd
+import pcm_asds_pca.pyphi.pyphi as phi
+
+from scipy.linalg import eigh
+
+# Directions of the model kept for the spectra absorbed earlier
+SKETCH_RANK = 50
+
+# Arrays of the incremental state saved alongside the PCA model
+STATE = (
+    "count",
+    "mean",
+    "scatter",
+    "basis",
+    "eigenvalues",
+    "coordinates",
+    "residual",
+    "keys",
+    "digests",
+)
+
+
+class IncrementalPCA:
+    """
+    PCA model updated one block of spectra at a time, e.g.
+
+        model = IncrementalPCA(3)
+        model.partial_fit(plates_1_to_3)
+        model.partial_fit(plate_4)
+        pcaobj = model.to_pcaobj()
+
+    X is a DataFrame or array as for phi.pca, the first column of a DataFrame
+    being the observation id. Data are mean centred and autoscaled (mcs=True)
+    """
+
+    def __init__(self, num_pcs, sketch_rank=SKETCH_RANK):
+        self.num_pcs = int(num_pcs)
+        self.sketch_rank = int(sketch_rank)
+
+        self.count = 0
+        self.mean = None
+        self.scatter = None
+
+        self.scale = None
+        self.basis = None
+        self.eigenvalues = None
+        self.coordinates = None
+        self.residual = None
+
+        self.obsid = []
+        self.varid = None
+        self.keys = []
+        self.digests = []
+
+    def __len__(self):
+        return self.count
+
+    def partial_fit(self, X, keys=None):
+        """
+        Absorb a block of spectra
+
+        keys : label of every spectrum in the block, e.g. plate and well
+        """
+        matrix, obsid, varid = split(X)
+
+        if matrix.shape[0] == 0:
+            return self
+
+        if np.isnan(matrix).any():
+            raise ValueError("Incremental PCA does not support missing values")
+
+        if self.varid is not None and (
+            len(varid) != len(self.varid) or not np.allclose(varid, self.varid)
+        ):
+            raise ValueError("Spectra must have the same shifts as the model")
+
+        if keys is None:
+            keys = [str(i) for i in range(self.count, self.count + len(matrix))]
+        elif len(keys) != len(matrix):
+            raise ValueError("Expected a key for every spectrum")
+
+        # Mean the coordinates of the spectra absorbed earlier are centred on
+        centre = self.mean
+
+        self.merge_moments(matrix)
+
+        if self.count <= self.num_pcs:
+            raise ValueError(
+                f"At least {self.num_pcs + 1} spectra are needed for {self.num_pcs} Principal Components"
+            )
+
+        scale = np.sqrt(np.diag(self.scatter) / (self.count - 1))
+
+        if np.any(scale == 0):
+            raise ValueError("Every shift must vary between the spectra")
+
+        # Leading eigenvectors of the correlation matrix, largest first
+        correlation = self.scatter / np.outer(scale, scale) / (self.count - 1)
+
+        variables = correlation.shape[0]
+        rank = min(max(self.sketch_rank, self.num_pcs), variables)
+
+        eigenvalues, vectors = eigh(
+            correlation, subset_by_index=[variables - rank, variables - 1]
+        )
+        eigenvalues, vectors = eigenvalues[::-1], vectors[:, ::-1]
+
+        coordinates, residual = [], []
+
+        if self.basis is not None:
+            old = self.reproject(centre, vectors, scale)
+            coordinates.append(old[0])
+            residual.append(old[1])
+
+        Z = (matrix - self.mean) / scale
+        U = Z @ vectors
+
+        coordinates.append(U)
+        residual.append(np.maximum(np.sum(Z**2, axis=1) - np.sum(U**2, axis=1), 0))
+
+        coordinates = np.vstack(coordinates)
+
+        # Signs follow phi.pca on the first block and are kept stable afterwards
+        for a in range(self.num_pcs):
+
+            if self.basis is None:
+                t = coordinates[:, a]
+                flip = (
+                    np.any(t < 0)
+                    and np.any(t > 0)
+                    and np.var(t[t < 0]) > np.var(t[t >= 0])
+                )
+            else:
+                flip = vectors[:, a] @ self.basis[:, a] < 0
+
+            if flip:
+                vectors[:, a] = -vectors[:, a]
+                coordinates[:, a] = -coordinates[:, a]
+
+        self.basis = vectors
+        self.scale = scale
+        self.eigenvalues = eigenvalues
+        self.coordinates = coordinates
+        self.residual = np.concatenate(residual)
+
+        self.obsid.extend(obsid)
+        self.varid = varid
+        self.keys.extend(str(key) for key in keys)
+        self.digests.extend(row_digests(matrix))
+
+        return self
+
+    def merge_moments(self, matrix):
+        """
+        Combine the mean and scatter matrix of the block with those absorbed so far
+        """
+        block = matrix.shape[0]
+        block_mean = matrix.mean(axis=0)
+
+        centred = matrix - block_mean
+        block_scatter = centred.T @ centred
+
+        if self.count == 0:
+            self.mean = block_mean
+            self.scatter = block_scatter
+            self.count = block
+            return
+
+        total = self.count + block
+        delta = block_mean - self.mean
+
+        self.scatter += block_scatter + np.outer(delta, delta) * (
+            self.count * block / total
+        )
+        self.mean = self.mean + delta * block / total
+        self.count = total
+
+    def reproject(self, centre, vectors, scale):
+        """
+        Coordinates and residual energy of the spectra absorbed earlier, in the
+        directions of the updated model. The mean and scale of the model move
+        as spectra are absorbed, so every spectrum z is rescaled to A z + b
+        """
+        A = self.scale / scale
+        b = (centre - self.mean) / scale
+
+        Q = self.basis
+        U = self.coordinates
+
+        AQ = A[:, None] * Q
+        projected = U @ (vectors.T @ AQ).T + vectors.T @ b
+
+        # Energy of A Q u + b, plus the residual rescaled by the average of A**2
+        energy = (
+            np.einsum("ij,jk,ik->i", U, AQ.T @ AQ, U, optimize=True)
+            + 2 * U @ (AQ.T @ b)
+            + b @ b
+            + self.residual * np.mean(A**2)
+        )
+
+        residual = np.maximum(energy - np.sum(projected**2, axis=1), 0)
+
+        return projected, residual
+
+    def to_pcaobj(self):
+        """
+        pcaobj with the same keys as phi.pca
+        """
+        A = self.num_pcs
+
+        T = self.coordinates[:, :A].copy()
+        P = self.basis[:, :A].copy()
+
+        eigenvalues = self.eigenvalues[:A]
+
+        # Autoscaled variables each have a total sum of squares of count - 1
+        r2x = eigenvalues / P.shape[0]
+        r2xpv = P**2 * eigenvalues
+
+        pcaobj = {
+            "T": T,
+            "P": P,
+            "r2x": r2x,
+            "r2xpv": r2xpv,
+            "mx": self.mean.reshape(1, -1).copy(),
+            "sx": self.scale.reshape(1, -1).copy(),
+            "obsidX": list(self.obsid),
+            "varidX": list(self.varid),
+        }
+
+        n = T.shape[0]
+
+        speX = self.residual + np.sum(self.coordinates[:, A:] ** 2, axis=1)
+        speX = speX.reshape(-1, 1)
+
+        pcaobj["T2"] = phi.hott2(pcaobj, Tnew=T)
+        pcaobj["T2_lim99"] = (((n - 1) * (n + 1) * A) / (n * (n - A))) * phi.f99(
+            A, (n - A)
+        )
+        pcaobj["T2_lim95"] = (((n - 1) * (n + 1) * A) / (n * (n - A))) * phi.f95(
+            A, (n - A)
+        )
+        pcaobj["speX"] = speX
+        pcaobj["speX_lim95"], pcaobj["speX_lim99"] = phi.spe_ci(speX)
+        pcaobj["type"] = "pca"
+
+        return pcaobj
+
+    def summary(self, absorbed):
+        """
+        Table of the model in the style of the diagnostics printed by phi.pca
+        """
+        T = self.coordinates[:, : self.num_pcs]
+        eigs = np.var(T, axis=0)
+        r2x = self.eigenvalues[: self.num_pcs] / self.basis.shape[0]
+        r2xc = np.cumsum(r2x)
+
+        lines = [
+            f"Incremental PCA absorbed {absorbed} spectra ({self.count} in total) on: {datetime.datetime.now()}",
+            "--------------------------------------------------------------",
+            "PC #      Eig        R2X       sum(R2X) ",
+        ]
+
+        for a in range(self.num_pcs):
+            lines.append(
+                "PC #"
+                + str(a + 1)
+                + ":   {:8.3f}    {:.3f}     {:.3f}".format(eigs[a], r2x[a], r2xc[a])
+            )
+
+        lines.append("--------------------------------------------------------------")
+
+        return "\n".join(lines) + "\n"
+
+    # ==========================================================
+    # State saved with the PCA model by write_model(extra=...)
+    # ==========================================================
+    def state(self):
+        return dict(
+            count=np.array(self.count),
+            mean=self.mean,
+            scatter=self.scatter,
+            basis=self.basis,
+            eigenvalues=self.eigenvalues,
+            coordinates=self.coordinates,
+            residual=self.residual,
+            keys=np.array(self.keys, dtype=str),
+            digests=np.array(self.digests, dtype=str),
+        )
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        Resume from a PCA model opened with open_model
+        """
+        if not all(name in model for name in STATE):
+            raise ValueError(f"{model.folder} was not fitted incrementally")
+
+        basis = np.array(model["basis"])
+
+        self = cls(model.num_pcs, sketch_rank=basis.shape[1])
+
+        self.count = int(model["count"])
+        self.mean = np.array(model["mean"])
+        self.scatter = np.array(model["scatter"])
+        self.scale = np.array(model["sx"]).ravel()
+        self.basis = basis
+        self.eigenvalues = np.array(model["eigenvalues"])
+        self.coordinates = np.array(model["coordinates"])
+        self.residual = np.array(model["residual"])
+
+        self.obsid = model["obsidX"].tolist()
+        self.varid = model["varidX"].tolist()
+        self.keys = model["keys"].tolist()
+        self.digests = model["digests"].tolist()
+
+        return self
+
+
+def split(X):
+    """
+    Spectra, observation ids and variable ids of X as read by phi.pca
+    """
+    if isinstance(X, pd.DataFrame):
+        matrix = np.array(X.values[:, 1:]).astype(float)
+        obsid = X.values[:, 0].astype(str).tolist()
+        varid = X.columns.values[1:].tolist()
+    else:
+        matrix = np.array(X, dtype=float)
+        obsid = [str(i) for i in range(matrix.shape[0])]
+        varid = list(range(matrix.shape[1]))
+
+    return matrix, obsid, varid
+
+
+def row_digests(matrix):
+    """
+    sha256 of every spectrum, as the float64 values absorbed by partial_fit
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+
+    return [hashlib.sha256(row.tobytes()).hexdigest() for row in matrix]
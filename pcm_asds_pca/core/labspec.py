@@ -0,0 +1,205 @@
+# ===========================================================================
+# Native loader for .txt files exported by the LabSpec 6 Spectroscopy Suite
+# Single spectra have two columns: shift, intensity
+# Multiwell files have a shared shift axis followed by one line per well:
+#   file Column index, file Row index, intensities
+# Map files have the same layout with X and Y stage positions instead
+# Every file is read in one pass into NumPy arrays, or CHUNK_ROWS lines at a
+# time by parse_multiwell_array, which combines the spectra of every well
+# ===========================================================================
+
+import io
+import itertools
+import numpy as np
+import pathlib
+
+from pcm_asds_pca.core.reduce import WellReducer
+
+# Lines of a multiwell or map file parsed at a time by parse_multiwell_array
+CHUNK_ROWS = 1024
+
+
+def read_labspec(path, text=None):
+    """
+    Read a single spectrum or multiwell file.
+
+    Returns (header, matrix, shifts, rows, cols) where matrix is
+    (n_spectra, n_shifts). rows and cols are the plate row and column
+    of each spectrum, or 0 for a single spectrum. text is the contents of
+    the file if it has already been read
+    """
+    header, first, block = read_block(path, text)
+
+    # Multiwell file
+    if block.size and block.shape[1] == first.size + 2:
+
+        # For this acquisition:
+        #   file Column (1–8)  → plate Row (A–H)
+        #   file Row    (1–12) → plate Column (1–12)
+        # 384 and 1536-well plates follow the same convention
+        rows = block[:, 0].astype(np.int64)
+        cols = block[:, 1].astype(np.int64)
+
+        matrix = np.ascontiguousarray(block[:, 2:])
+
+        return header, matrix, first, rows, cols
+
+    # Single spectrum
+    if first.size == 2 and (block.size == 0 or block.shape[1] == 2):
+
+        data = np.vstack([first, block]) if block.size else first.reshape(1, 2)
+
+        no_well = np.zeros(1, dtype=np.int64)
+
+        return header, data[:, 1].reshape(1, -1), data[:, 0], no_well, no_well
+
+    if block.size == 0:
+        raise ValueError("No spectral data found in file")
+
+    raise ValueError(
+        f"Length mismatch: {block.shape[1] - 2} intensities for {first.size} shifts"
+    )
+
+
+def read_labspec_map(path, text=None):
+    """
+    Read a map file, numbering the X and Y positions from 1 in increasing
+    order so that every spectrum is given a plate row (Y) and column (X)
+    """
+    header, shifts, block = read_block(path, text)
+
+    if block.size == 0 or block.shape[1] != shifts.size + 2:
+        raise ValueError("File is not a LabSpec map")
+
+    _, cols = np.unique(block[:, 0], return_inverse=True)
+    _, rows = np.unique(block[:, 1], return_inverse=True)
+
+    matrix = np.ascontiguousarray(block[:, 2:])
+
+    return header, matrix, shifts, rows.astype(np.int64) + 1, cols.astype(np.int64) + 1
+
+
+def parse_multiwell_array(
+    path, reducer=None, is_map=False, chunk_rows=CHUNK_ROWS, text=None
+):
+    """
+    Read a multiwell or map file chunk_rows lines at a time with one NumPy
+    call per chunk, adding every chunk of spectra to reducer (a WellReducer)
+    so that only the reduced spectra and one chunk of the file are held in
+    memory. Every spectrum is kept if reducer is None. text is the contents
+    of the file if it has already been read
+
+    Returns (header, matrix, shifts, rows, cols, replicates)
+    """
+    if reducer is None:
+        reducer = WellReducer("all")
+
+    with io.StringIO(read_text(path) if text is None else text) as stream:
+
+        header, first_line = read_header(stream)
+
+        shifts = np.array(first_line.split(), dtype=np.float64)
+
+        if shifts.size == 0:
+            raise ValueError("No spectral data found in file")
+
+        while lines := list(itertools.islice(stream, chunk_rows)):
+
+            block = np.loadtxt(lines, dtype=np.float64, ndmin=2)
+
+            if block.size == 0:
+                continue
+
+            if shifts.size == 2 and block.shape[1] == 2:
+                raise ValueError("File is a single spectrum, not a multiwell file")
+
+            if block.shape[1] != shifts.size + 2:
+                raise ValueError(
+                    f"Length mismatch: {block.shape[1] - 2} intensities for {shifts.size} shifts"
+                )
+
+            if is_map:
+                # Y and X stage positions, numbered once the whole file is read
+                reducer.add_block(block[:, 1], block[:, 0], block[:, 2:])
+            else:
+                # file Column → plate Row, file Row → plate Column, as in read_labspec
+                rows = block[:, 0].astype(np.int64)
+                cols = block[:, 1].astype(np.int64)
+
+                reducer.add_block(rows, cols, block[:, 2:])
+
+    if len(reducer) == 0:
+        raise ValueError("No spectral data found in file")
+
+    matrix, rows, cols, replicates = reducer.result()
+
+    if is_map:
+        _, rows = np.unique(rows, return_inverse=True)
+        _, cols = np.unique(cols, return_inverse=True)
+
+        rows, cols = rows + 1, cols + 1
+
+    elif not rows.all():
+        raise ValueError("File is a single spectrum, not a multiwell file")
+
+    return (
+        header,
+        matrix,
+        shifts,
+        rows.astype(np.int64),
+        cols.astype(np.int64),
+        replicates,
+    )
+
+
+def read_block(path, text=None):
+    # Returns the header lines, the first line of data and the remaining lines
+    header, first_line, stream = read_header_lines(path, text)
+
+    first = np.array(first_line.split(), dtype=np.float64)
+
+    if first.size == 0:
+        raise ValueError("No spectral data found in file")
+
+    block = np.loadtxt(stream, dtype=np.float64, ndmin=2)
+
+    return header, first, block
+
+
+def read_header_lines(path, text=None):
+    # Returns the header lines, the first line of data and a stream of the rest
+    stream = io.StringIO(read_text(path) if text is None else text)
+
+    header, first_line = read_header(stream)
+
+    return header, first_line, stream
+
+
+def read_header(stream):
+    # Reads the header lines and the first line of data from stream
+    header = []
+
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#"):
+            header.append(line)
+        else:
+            return header, line
+
+    return header, ""
+
+
+def decode(raw):
+    # Files exported by LabSpec are latin-1 encoded
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin-1")
+
+
+def read_text(path):
+    # Reads a file once and decodes it once, so that the same text can be
+    # sniffed, hashed and parsed
+    return decode(pathlib.Path(path).read_bytes())
@@ -0,0 +1,151 @@
+# ============================================================================
+# Plate layouts: drug, polymer, drug loading, appearance and volume per well
+# Layouts are read from a .csv, .json or .toml file with one row per well, e.g.
+#   plate,well,drug,polymer,drug_loading,appearance,volume
+#   1,A1,PCM,PLS,100,amorphous,2
+# Adding a plate only requires adding its wells to the layout file
+# ============================================================================
+
+import functools
+import json
+import numpy as np
+import pandas as pd
+import pathlib
+import sys
+
+from pcm_asds_pca.config.settings import PLATE_LAYOUT
+
+# Layouts of plates 1-3 shipped with the package
+DEFAULT_LAYOUT = pathlib.Path(__file__).parent.parent / "config" / "plate_layouts.csv"
+
+# Metadata of wells missing from the layout
+DEFAULTS = dict(
+    drug="PCM",
+    polymer=" ",
+    drug_loading=0,
+    appearance="amorphous",
+    volume=2,
+)
+
+
+class PlateLayout:
+    """
+    Indexed table of well metadata.
+
+    Wells are looked up by (plate, well) in a hash table, either one at a
+    time with lookup() or for a whole set of samples at once with join()
+    """
+
+    def __init__(self, table):
+
+        missing = {"plate", "well"} - set(table.columns)
+
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(sorted(missing))}")
+
+        table = table.copy()
+        table["plate"] = table["plate"].astype(np.int64)
+        table["well"] = table["well"].astype(str).str.strip().str.upper()
+
+        # Columns left out of the layout take their default value
+        for field, default in DEFAULTS.items():
+            if field not in table.columns:
+                table[field] = default
+            else:
+                table[field] = table[field].fillna(default)
+
+        table["drug_loading"] = table["drug_loading"].astype(np.int64)
+        table["volume"] = table["volume"].astype(np.int64)
+
+        self.index = pd.MultiIndex.from_arrays([table["plate"], table["well"]])
+
+        if self.index.has_duplicates:
+            duplicates = self.index[self.index.duplicated()].unique()
+            raise ValueError(
+                f"Wells listed more than once: {', '.join(f'plate {p} {w}' for p, w in duplicates)}"
+            )
+
+        self.table = table[list(DEFAULTS)].reset_index(drop=True)
+
+        # (plate, well) -> row of the table
+        self._rows = dict(zip(self.index, range(len(self.index))))
+
+    def lookup(self, plate, well):
+        """
+        Metadata of a single well as a dict
+        """
+        row = self._rows.get((int(plate), str(well)))
+
+        if row is None:
+            return dict(DEFAULTS)
+
+        return {field: self.table[field].iat[row] for field in DEFAULTS}
+
+    def join(self, plates, wells):
+        """
+        Metadata of every (plate, well) pair as a DataFrame in the same order
+        """
+        keys = pd.MultiIndex.from_arrays(
+            [np.asarray(plates, dtype=np.int64), np.asarray(wells, dtype=str)]
+        )
+
+        rows = self.index.get_indexer(keys)
+        found = rows >= 0
+
+        metadata = self.table.iloc[np.where(found, rows, 0)].reset_index(drop=True)
+
+        for field, default in DEFAULTS.items():
+            metadata.loc[~found, field] = default
+
+        return metadata
+
+
+def read_layout(path):
+
+    path = pathlib.Path(path)
+
+    match path.suffix.lower():
+
+        case ".csv":
+            table = pd.read_csv(path, skipinitialspace=True)
+
+        case ".json":
+            with open(path, encoding="utf-8") as f:
+                table = pd.DataFrame(wells_from(json.load(f)))
+
+        case ".toml":
+            import tomllib
+
+            with open(path, "rb") as f:
+                table = pd.DataFrame(wells_from(tomllib.load(f)))
+
+        case _:
+            raise ValueError(f"Unsupported layout file: {path.name}")
+
+    return PlateLayout(table)
+
+
+def wells_from(data):
+    # A list of wells, or a table of wells under the "wells" key
+    if isinstance(data, dict):
+        data = data.get("wells", [])
+
+    if not isinstance(data, list):
+        raise ValueError("Layout must be a list of wells")
+
+    return data
+
+
+def layout_file():
+    return DEFAULT_LAYOUT if PLATE_LAYOUT is None else pathlib.Path(PLATE_LAYOUT)
+
+
+@functools.cache
+def plate_layout():
+
+    path = layout_file()
+
+    try:
+        return read_layout(path)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Plate layout could not be read from {path}: {e}")
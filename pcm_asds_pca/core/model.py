@@ -0,0 +1,234 @@
+# ============================================================================
+# Versioned PCA model artefact
+# A model is a folder of .npy arrays (T, P, mx, sx, r2x, r2xpv, T2, speX,
+# limits and the observation and variable ids) with a model.json manifest of
+# the settings, so that arrays can be memory-mapped one at a time without
+# unpickling anything
+# Scores and loadings can be exported as .csv or .parquet tables
+# ============================================================================
+
+import json
+import numpy as np
+import os
+import pandas as pd
+import pathlib
+import shutil
+
+MODEL_FORMAT = "pcm_asds_pca.model"
+MODEL_VERSION = 1
+
+# Arrays of a pyphi pcaobj, q2 and q2pv are only present with cross validation
+ARRAYS = ("T", "P", "mx", "sx", "r2x", "r2xpv", "T2", "speX", "q2", "q2pv")
+
+LIMITS = ("T2_lim95", "T2_lim99", "speX_lim95", "speX_lim99")
+
+LIMITS_DTYPE = np.dtype([(limit, "f8") for limit in LIMITS])
+
+# Tables written by export_model and the formats they can be written in
+EXPORT_TABLES = ("scores", "loadings")
+EXPORT_FORMATS = ("csv", "parquet")
+
+
+class PCAModel:
+    """
+    PCA model read from a model folder.
+
+    model["T"] memory-maps a single array on first access.
+    to_pcaobj() returns a pyphi pcaobj dict for plotting
+    """
+
+    def __init__(self, folder):
+
+        folder = pathlib.Path(folder)
+
+        with open(folder / "model.json") as f:
+            manifest = json.load(f)
+
+        if manifest.get("format") != MODEL_FORMAT:
+            raise ValueError(f"{folder} is not a PCA model")
+
+        if manifest["version"] != MODEL_VERSION:
+            raise ValueError(f"Unsupported PCA model version {manifest['version']}")
+
+        self.folder = folder
+        self.manifest = manifest
+        self.settings = manifest["settings"]
+        self.arrays = manifest["arrays"]
+
+        self._loaded = {}
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __getitem__(self, name):
+        if name not in self.arrays:
+            raise KeyError(name)
+
+        if name not in self._loaded:
+            self._loaded[name] = np.load(
+                self.folder / f"{name}.npy", mmap_mode="r", allow_pickle=False
+            )
+
+        return self._loaded[name]
+
+    @property
+    def num_pcs(self):
+        return self.manifest["num_pcs"]
+
+    def limits(self):
+        limits = self["limits"][0]
+        return {limit: float(limits[limit]) for limit in LIMITS}
+
+    def to_pcaobj(self):
+        pcaobj = {name: self[name] for name in ARRAYS if name in self}
+
+        pcaobj.update(self.limits())
+
+        pcaobj["obsidX"] = self["obsidX"].tolist()
+        pcaobj["varidX"] = self["varidX"].tolist()
+        pcaobj["type"] = self.manifest["type"]
+
+        return pcaobj
+
+
+def write_model(folder, pcaobj, settings=None, spectrum=None, extra=None):
+    """
+    Write a pyphi pcaobj to a model folder, replacing any existing model
+
+    settings : dict of the settings the model was fitted with
+    spectrum : row of every observation in the spectral store
+    extra : dict of further named arrays, e.g. the state of an IncrementalPCA
+    """
+    folder = pathlib.Path(folder)
+    folder.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write to a temporary folder first so that readers never see a partial model
+    tmp = folder.with_name(f"{folder.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+
+    arrays = {name: np.asarray(pcaobj[name]) for name in ARRAYS if name in pcaobj}
+
+    arrays["limits"] = np.array(
+        [tuple(float(pcaobj[limit]) for limit in LIMITS)], dtype=LIMITS_DTYPE
+    )
+    arrays["obsidX"] = np.array(pcaobj["obsidX"], dtype=str)
+    arrays["varidX"] = np.asarray(pcaobj["varidX"])
+
+    if spectrum is not None:
+        arrays["spectrum"] = np.asarray(spectrum, dtype=np.int64)
+
+    for name, array in (extra or {}).items():
+        arrays[name] = np.asarray(array)
+
+    for name, array in arrays.items():
+        np.save(tmp / f"{name}.npy", array, allow_pickle=False)
+
+    manifest = dict(
+        format=MODEL_FORMAT,
+        version=MODEL_VERSION,
+        type=pcaobj.get("type", "pca"),
+        num_pcs=int(np.shape(pcaobj["T"])[1]),
+        observations=int(np.shape(pcaobj["T"])[0]),
+        variables=int(np.shape(pcaobj["P"])[0]),
+        arrays={
+            name: dict(dtype=array.dtype.str, shape=list(array.shape))
+            for name, array in arrays.items()
+        },
+        settings=settings or {},
+    )
+
+    with open(tmp / "model.json", "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+    if folder.exists():
+        shutil.rmtree(folder)
+
+    os.replace(tmp, folder)
+
+    return folder
+
+
+def open_model(folder):
+    return PCAModel(folder)
+
+
+# =========================================================
+# Scores and loadings as tables for other tools
+# Scores: one row per observation, with T2 and SPE
+# Loadings: one row per shift, with R2X per variable
+# =========================================================
+def scores_table(model, samples=None):
+    pcs = [f"PC{a}" for a in range(1, model.num_pcs + 1)]
+
+    scores = pd.DataFrame(np.asarray(model["T"]), columns=pcs)
+    scores.insert(0, "obsid", np.asarray(model["obsidX"]))
+
+    if "spectrum" in model:
+        scores.insert(0, "spectrum", np.asarray(model["spectrum"]))
+
+    scores["T2"] = np.asarray(model["T2"])
+    scores["SPE"] = np.asarray(model["speX"])[:, 0]
+
+    # Sample metadata, e.g. sample_df, indexed by row in the spectral store
+    if samples is not None and "spectrum" in model:
+        scores = scores.join(samples, on="spectrum")
+
+    return scores
+
+
+def loadings_table(model):
+    pcs = [f"PC{a}" for a in range(1, model.num_pcs + 1)]
+
+    loadings = pd.DataFrame(np.asarray(model["P"]), columns=pcs)
+    loadings.insert(0, "shift", np.asarray(model["varidX"]))
+
+    r2xpv = np.asarray(model["r2xpv"])
+
+    for a, pc in enumerate(pcs):
+        loadings[f"R2X {pc}"] = r2xpv[:, a]
+
+    return loadings
+
+
+def export_model(model, folder, format="csv", samples=None):
+    """
+    Write scores and loadings tables as .csv or .parquet (requires pyarrow)
+    """
+    folder = pathlib.Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    tables = dict(scores=scores_table(model, samples), loadings=loadings_table(model))
+
+    outputs = []
+
+    for name, table in tables.items():
+
+        match format:
+
+            case "csv":
+                out = folder / f"{name}.csv"
+                table.to_csv(out, index=False)
+
+            case "parquet":
+                out = folder / f"{name}.parquet"
+                table.to_parquet(out, index=False)
+
+            case _:
+                raise ValueError(f"Unsupported export format: {format}")
+
+        outputs.append(out)
+
+    return outputs
+
+
+def remove_exports(folder, keep=None):
+    """
+    Remove the tables written by export_model in every format but keep
+    """
+    folder = pathlib.Path(folder)
+
+    for name in EXPORT_TABLES:
+        for format in EXPORT_FORMATS:
+            if format != keep:
+                (folder / f"{name}.{format}").unlink(missing_ok=True)
@@ -1,14 +1,62 @@
 # =========================================================================
-# Parse all files that end with "_multiwell.txt" and ignore all other files
-# Output individual spectra to .txt files
+# Parse all plate files (e.g. plate1_60mgml_multiwell.txt) and single spectra
+# Output each plate to a single .npz file in PARSED_FOLDER
+# Files in ANALYSIS_FOLDER are only ever read, never modified or moved
 # =========================================================================
 
+import io
+import json
+import numpy as np
+import os
 import pathlib
-import shutil
 import sys
 
-from pcm_asds_pca.config.settings import ANALYSIS_FOLDER, PATH_TO_DIR
-from pcm_asds_pca.core.sort import sort_files
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from pcm_asds_pca.config.settings import (
+    ANALYSIS_FOLDER,
+    INGEST_WORKERS,
+    MULTIWELL_PARSER,
+    PARSED_FOLDER,
+    PATH_TO_DIR,
+    STORE_DTYPE,
+    TRIMMED_MEAN_PROPORTION,
+    USE_PARSE_CACHE,
+    WELL_REDUCER,
+    WRITE_WELL_TXT,
+)
+from pcm_asds_pca.core.cache import cached_parse, prune_cache
+from pcm_asds_pca.core.header import Acquisition
+from pcm_asds_pca.core.labspec import parse_multiwell_array, read_text
+from pcm_asds_pca.core.readers import (
+    EXTENSIONS,
+    find_reader,
+    is_map_header,
+    read_spectra,
+)
+from pcm_asds_pca.core.reduce import WellReducer, reduce_wells
+from pcm_asds_pca.core.sample import Sample
+from pcm_asds_pca.core.scan import (
+    FILE_DTYPE,
+    PLATE,
+    WELL,
+    file_dtype,
+    scan,
+    sort_order,
+)
+from pcm_asds_pca.core.store import store_exists, store_folder, write_store
+from pcm_asds_pca.core.wells import (
+    ROW_LABELS,
+    position_labels,
+    row_label,
+    well_labels,
+)
+
+MANIFEST = "ingest_manifest.json"
+
+# Fields of every spectrum of a plate saved in the manifest
+WELL_FIELDS = ("well", "row", "column", "replicate")
 
 
 def parse():
@@ -21,127 +69,478 @@ def parse():
     if not folder.exists():
         folder.mkdir(parents=True, exist_ok=True)
 
-    files = pathlib.Path(ANALYSIS_FOLDER)
-    files = [str(x) for x in files.iterdir()]
+    # Every file is listed, stat-ed and has its name parsed once, in parsing order
+    records = scan(ANALYSIS_FOLDER, EXTENSIONS)
 
     # Confirm samples have been provided
-    try:
-        files[0]
-    except IndexError:
-        sys.exit(f"Please provide .txt files in {PATH_TO_DIR}{ANALYSIS_FOLDER}")
+    if records.size == 0:
+        sys.exit(
+            f"Please provide {', '.join(EXTENSIONS)} files in {PATH_TO_DIR}{ANALYSIS_FOLDER}"
+        )
+
+    output_dir = pathlib.Path(f"{PATH_TO_DIR}{PARSED_FOLDER}")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest = read_manifest(output_dir)
+
+    # Forget files that have been removed from ANALYSIS_FOLDER
+    names = records["name"].tolist()
+
+    changed = False
+
+    for name in list(manifest):
+        if name not in names:
+            entry = manifest.pop(name)
+            remove_outputs(output_dir, entry["outputs"] + entry.get("views", []))
+            changed = True
+
+    plates = []
 
-    # Sorts the order that the files are parsed
-    files = sort_files(files)
+    for record in records:
 
-    for file in files:
+        # Skip files that have not changed since they were last ingested
+        if is_ingested(manifest, output_dir, record):
+            continue
+
+        if record["kind"] != PLATE:
 
-        if "_multiwell.txt" not in file:
+            # Single spectra (e.g. glass reference) are copied as utf-8
+            outputs = copy_as_utf8(record["path"], output_dir)
+            record_ingested(manifest, output_dir, record, outputs, outputs)
+            changed = True
             continue
 
-        plate_num, plate_conc = (
-            file.removeprefix(f"{ANALYSIS_FOLDER}/")
-            .removesuffix("_multiwell.txt")
-            .split("_")
+        plates.append(record)
+
+    multiwell_files = [str(record["path"]) for record in plates]
+    plate_nums = [str(record["plate"]) for record in plates]
+    plate_concs = [str(record["concentration"]) for record in plates]
+
+    # Parse the multiwell files across a pool of processes
+    # Results are returned in the order given by scan
+    if INGEST_WORKERS == 1 or len(multiwell_files) <= 1:
+        results = list(
+            map(parse_and_write_plate, multiwell_files, plate_nums, plate_concs)
         )
+    else:
+        with ProcessPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+            results = list(
+                executor.map(
+                    parse_and_write_plate, multiwell_files, plate_nums, plate_concs
+                )
+            )
 
-        plate_num = plate_num.removeprefix("plate")
+    for record, (outputs, samples, wells) in zip(plates, results):
+        record_ingested(manifest, output_dir, record, outputs, samples, wells)
 
-        try:
-            int(plate_num)
-        except TypeError:
-            sys.exit("Plate number not found")
+    # Cached plates of files that have changed or been removed are evicted
+    if USE_PARSE_CACHE is True:
+        prune_cache(records["path"].tolist())
+
+    # Per-well .txt files are only written on request, from the combined plate files
+    if WRITE_WELL_TXT is True:
+        for record in records[records["kind"] == PLATE]:
+            write_well_views(output_dir, manifest[record["name"]])
 
-        plate_conc = plate_conc.removesuffix("mgml")
+    write_manifest(output_dir, manifest)
 
+    # Every spectrum must have its own plate, well and replicate in the store
+    find_duplicates(records, manifest)
+
+    # Rebuild the spectral store whenever a file has been added, changed or removed
+    if changed or multiwell_files or not store_exists():
         try:
-            int(plate_conc)
-        except TypeError:
-            sys.exit("Plate concentration not found")
+            write_store(
+                store_folder(),
+                store_sources(records, output_dir, manifest),
+                STORE_DTYPE,
+            )
+        except ValueError as e:
+            sys.exit(f"Spectral store could not be created: {e}")
+
+    # Every spectrum is named after the per-well .txt file it can be exported to
+    # Records of the spectra are returned in the same order as the files
+    samples = sample_records(records, manifest)
+
+    print("Files analysed.")
+    print()
 
-        # Convert files from latin-1 to utf-8 for parsing
-        with open(file, encoding="latin-1") as f:
-            text = f.read()
+    return samples[sort_order(samples)]
 
-        with open(file, "w", encoding="utf-8") as f:
-            f.write(text)
 
-        output_dir = f"{PATH_TO_DIR}{ANALYSIS_FOLDER}/"
+# ===========================================================
+# Parse a single plate file with the configured parser
+# Spectra recorded in the same well are combined with WELL_REDUCER
+# Returns (header, matrix, shifts, rows, cols, replicates)
+# ===========================================================
+def read_multiwell(file):
 
-        header, spectra = parse_multiwell_file(pathlib.Path(file))
-        write_txt_file(header, spectra, pathlib.Path(output_dir), plate_num, plate_conc)
+    path = pathlib.Path(file)
 
-        # Move multiwell file to Bin once parsed
-        trash = pathlib.Path.home() / ".Trash"
-        file = pathlib.Path(file)
-        shutil.move(file, trash / file.name)
+    # The file is read and decoded once, the same text being sniffed,
+    # hashed for the parse cache and parsed
+    text = read_text(path)
+    name, reader = find_reader(path, text)
 
-    files = pathlib.Path(ANALYSIS_FOLDER)
-    files = [str(x) for x in files.iterdir()]
+    # The line-by-line parser only reads LabSpec multiwell files
+    if MULTIWELL_PARSER == "array" or name != "labspec":
 
-    # Sorts the order that the files are returned by the function
-    files = sort_files(files)
+        parser = partial(reduce_plate, path, text, name, reader)
 
-    # Convert files from latin-1 to utf-8 for visualising the spectra and for PCA
-    for file in files:
-        with open(file, encoding="latin-1") as f:
-            text = f.read()
+        # Plates are cached after their wells have been combined
+        if USE_PARSE_CACHE is True:
+            return cached_parse(path, text, parser, reducer_name())
 
-        with open(file, "w", encoding="utf-8") as f:
-            f.write(text)
+        return parser()
 
-    print("Files analysed.")
-    print()
+    header, spectra = parse_multiwell_file(
+        path, WELL_REDUCER, TRIMMED_MEAN_PROPORTION, text=text
+    )
+
+    rows = np.array([row for row, _, _, _, _ in spectra], dtype=np.int64)
+    cols = np.array([col for _, col, _, _, _ in spectra], dtype=np.int64)
+    replicates = np.array([r for _, _, r, _, _ in spectra], dtype=np.int64)
+    matrix = np.array([y for _, _, _, _, y in spectra], dtype=np.float64)
+    shifts = np.array(spectra[0][3], dtype=np.float64)
+
+    return header, matrix, shifts, rows, cols, replicates
+
+
+def reduce_plate(path, text, name, reader):
+
+    # LabSpec files are read a chunk of lines at a time, each chunk being
+    # combined into the wells read so far, so that the unreduced spectra of
+    # a plate are never held in memory at once
+    if name in ("labspec", "labspec_map"):
+        reducer = WellReducer(WELL_REDUCER, TRIMMED_MEAN_PROPORTION)
+
+        return parse_multiwell_array(
+            path, reducer, is_map=name == "labspec_map", text=text
+        )
+
+    matrix, shifts, well_index, metadata = reader(path, text)
+
+    if not well_index["row"].all():
+        raise ValueError(f"Spectra without a well found in {pathlib.Path(path).name}")
+
+    matrix, rows, cols, replicates = reduce_wells(
+        matrix,
+        well_index["row"],
+        well_index["column"],
+        WELL_REDUCER,
+        TRIMMED_MEAN_PROPORTION,
+    )
+
+    return metadata["header"], matrix, shifts, rows, cols, replicates
+
+
+# ===================================================================
+# Spectra for the spectral store, one plate or single spectrum at a time
+# ===================================================================
+def store_sources(records, output_dir, manifest):
+
+    for record in records:
+
+        if record["kind"] == PLATE:
+
+            # Multiwell spectra are read from their combined plate file
+            (plate_file,) = manifest[record["name"]]["outputs"]
+
+            header, matrix, shifts, rows, cols, replicates = read_plate(
+                output_dir / plate_file
+            )
+
+            wells, row_labels = sample_labels(header, rows, cols)
+
+            index = dict(
+                plate=int(record["plate"]),
+                well=wells,
+                row=row_labels,
+                column=cols,
+                concentration=int(record["concentration"]),
+                replicate=replicates,
+            )
+
+            yield matrix, shifts, index, Acquisition(header)
+
+        else:
+
+            # Single spectra (e.g. glass reference)
+            sample = Sample(record["path"], None, record)
+
+            matrix, shifts, _, metadata = read_spectra(record["path"])
+
+            index = dict(
+                plate=sample.plate,
+                well=sample.well,
+                row=sample.row,
+                column=sample.col,
+                concentration=sample.concentration,
+                replicate=sample.replicate,
+            )
+
+            yield matrix, shifts, index, Acquisition(metadata["header"])
+
+
+def find_duplicates(records, manifest):
+    # e.g. a stray plate1_60mgml_A1.txt next to plate1_60mgml_multiwell.txt
+    sources = {}
+
+    for record in records:
+        name = str(record["name"])
+
+        if record["kind"] == PLATE:
+            wells = manifest[name]["wells"]
+            keys = [
+                (int(record["plate"]), well, replicate)
+                for well, replicate in zip(wells["well"], wells["replicate"])
+            ]
+        else:
+            sample = Sample(record["path"], None, record)
+            keys = [(sample.plate, sample.well, sample.replicate)]
+
+        for key in keys:
+            if key in sources:
+                plate, well, replicate = key
+                sys.exit(
+                    f"Plate {plate} well {well} replicate {replicate} is found in both {sources[key]} and {name}, please remove one of them from {PATH_TO_DIR}{ANALYSIS_FOLDER}"
+                )
+
+            sources[key] = name
+
+
+# ===========================================================
+# Parse a single multiwell file and output it as one plate file
+# Runs in a worker process when plates are parsed in parallel
+# Returns the files written, the name of every spectrum and the
+# well, row, column and replicate of every spectrum
+# ===========================================================
+def parse_and_write_plate(file, plate_num, plate_conc):
+
+    output_dir = pathlib.Path(f"{PATH_TO_DIR}{PARSED_FOLDER}")
+
+    header, matrix, shifts, rows, cols, replicates = read_multiwell(file)
+
+    output = write_plate(
+        header,
+        matrix,
+        shifts,
+        rows,
+        cols,
+        replicates,
+        output_dir,
+        plate_num,
+        plate_conc,
+    )
+
+    wells, row_labels = sample_labels(header, rows, cols)
+
+    samples = well_txt_names(plate_num, plate_conc, wells, replicates).tolist()
+
+    fields = dict(
+        well=wells.tolist(),
+        row=row_labels.tolist(),
+        column=cols.tolist(),
+        replicate=replicates.tolist(),
+    )
+
+    return [output], samples, fields
+
+
+# =====================================================================
+# Ingest manifest
+# Records the size and modification time of every file in
+# ANALYSIS_FOLDER along with the outputs written for it, so that
+# unchanged files are not read again when parse() is re-run
+# =====================================================================
+def read_manifest(output_dir):
+    try:
+        with open(output_dir / MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(output_dir, manifest):
+    tmp = output_dir / f"{MANIFEST}.{os.getpid()}.tmp"
+
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    os.replace(tmp, output_dir / MANIFEST)
 
-    return files
+
+def is_ingested(manifest, output_dir, record):
+    entry = manifest.get(record["name"])
+
+    if entry is None:
+        return False
+
+    if entry["size"] != record["size"] or entry["mtime_ns"] != record["mtime_ns"]:
+        return False
+
+    # Entries written before plates were combined into a single file
+    if "samples" not in entry:
+        return False
+
+    # Entries written before the wells of a plate were recorded
+    if record["kind"] == PLATE and "wells" not in entry:
+        return False
+
+    # Spectra in the same well were combined differently
+    if entry.get("reducer") != reducer_name():
+        return False
+
+    return all((output_dir / output).exists() for output in entry["outputs"])
+
+
+def record_ingested(manifest, output_dir, record, outputs, samples, wells=None):
+    name = str(record["name"])
+
+    # Remove outputs from a previous version of the file that are no longer written
+    # Per-well .txt views are removed as they may be out of date
+    if name in manifest:
+        previous = manifest[name]["outputs"] + manifest[name].get("views", [])
+        remove_outputs(output_dir, [o for o in previous if o not in outputs])
+
+    manifest[name] = dict(
+        size=int(record["size"]),
+        mtime_ns=int(record["mtime_ns"]),
+        outputs=outputs,
+        samples=samples,
+        reducer=reducer_name(),
+    )
+
+    # Fields of the spectra of a plate, so their names are never parsed again
+    if wells is not None:
+        manifest[name]["wells"] = wells
+
+
+# ==================================================================
+# Records of the spectra of every file, in the same order as records
+# Built from the fields saved in the manifest and the records of the
+# files rather than by parsing the names of the spectra again
+# ==================================================================
+def sample_records(records, manifest):
+    fields = {
+        field: [] for field in FILE_DTYPE.names if field not in ("size", "mtime_ns")
+    }
+
+    for record in records:
+        entry = manifest[str(record["name"])]
+        n = len(entry["samples"])
+
+        if record["kind"] == PLATE:
+            wells = entry["wells"]
+            kind = WELL
+        else:
+            wells = {field: [record[field].item()] * n for field in WELL_FIELDS}
+            kind = str(record["kind"])
+
+        fields["path"] += [f"{PARSED_FOLDER}/{sample}" for sample in entry["samples"]]
+        fields["name"] += entry["samples"]
+        fields["kind"] += [kind] * n
+        fields["plate"] += [int(record["plate"])] * n
+        fields["concentration"] += [int(record["concentration"])] * n
+
+        for field in WELL_FIELDS:
+            fields[field] += wells[field]
+
+    if not fields["path"]:
+        return np.zeros(0, dtype=FILE_DTYPE)
+
+    samples = np.zeros(
+        len(fields["path"]), dtype=file_dtype(fields["path"], fields["name"])
+    )
+
+    for field, values in fields.items():
+        samples[field] = values
+
+    return samples
+
+
+def reducer_name():
+    if WELL_REDUCER == "trimmed_mean":
+        return f"{WELL_REDUCER} {TRIMMED_MEAN_PROPORTION}"
+
+    return WELL_REDUCER
+
+
+def remove_outputs(output_dir, outputs):
+    for output in outputs:
+        (output_dir / output).unlink(missing_ok=True)
+
+
+def copy_as_utf8(file, output_dir):
+    text = read_text(file)
+
+    out = output_dir / pathlib.Path(file).name
+
+    with open(out, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+
+    return [out.name]
 
 
 # ==================
 # Core parsing logic
 # ==================
-def parse_multiwell_file(path):
+def parse_multiwell_file(path, method="mean", proportion=0.1, text=None):
     header = []
-    data_lines = []
+    x_vals = None
 
-    with open(path, "r", encoding="utf-8", errors="replace") as f:
+    # Spectra are combined well by well as the file is read
+    reducer = WellReducer(method, proportion)
+
+    # text is the contents of the file if it has already been read
+    with io.StringIO(read_text(path) if text is None else text) as f:
         for line in f:
             line = line.strip()
             if not line:
                 continue
             if line.startswith("#"):
                 header.append(line)
-            else:
-                data_lines.append(line)
+                continue
 
-    if len(data_lines) < 2:
-        raise ValueError("No spectral data found in file")
+            # First non-header line = shared Raman shift axis
+            if x_vals is None:
+                x_vals = list(map(float, line.split()))
+                continue
 
-    # First non-header line = shared Raman shift axis
-    x_vals = list(map(float, data_lines[0].split()))
+            parts = line.split()
 
-    spectra = []
+            # LabRAM export order:
+            #   parts[0] = file Column index
+            #   parts[1] = file Row index
+            file_col = int(parts[0])
+            file_row = int(parts[1])
 
-    for line in data_lines[1:]:
-        parts = line.split()
+            # IMPORTANT:
+            # For this acquisition:
+            #   file Column (1–8)  → plate Row (A–H)
+            #   file Row    (1–12) → plate Column (1–12)
+            # 384 and 1536-well plates follow the same convention
+            plate_row = file_col
+            plate_col = file_row
 
-        # LabRAM export order:
-        #   parts[0] = file Column index
-        #   parts[1] = file Row index
-        file_col = int(parts[0])
-        file_row = int(parts[1])
+            intensities = list(map(float, parts[2:]))
 
-        # IMPORTANT:
-        # For this acquisition:
-        #   file Column (1–8)  → plate Row (A–H)
-        #   file Row    (1–12) → plate Column (1–12)
-        plate_row = file_col
-        plate_col = file_row
+            if len(intensities) != len(x_vals):
+                raise ValueError(
+                    f"Length mismatch at file Col={file_col}, Row={file_row}"
+                )
 
-        intensities = list(map(float, parts[2:]))
+            reducer.add(plate_row, plate_col, intensities)
 
-        if len(intensities) != len(x_vals):
-            raise ValueError(f"Length mismatch at file Col={file_col}, Row={file_row}")
+    if x_vals is None or len(reducer) == 0:
+        raise ValueError("No spectral data found in file")
+
+    matrix, rows, cols, replicates = reducer.result()
 
-        spectra.append((plate_row, plate_col, x_vals, intensities))
+    spectra = [
+        (int(row), int(col), int(replicate), x_vals, intensities)
+        for row, col, replicate, intensities in zip(rows, cols, replicates, matrix)
+    ]
 
     return header, spectra
 
@@ -149,29 +548,111 @@ def parse_multiwell_file(path):
 # =============
 # Output logic
 # =============
-def write_txt_file(header, spectra, outdir, plate_number, plate_concentration):
+def write_plate(
+    header,
+    matrix,
+    shifts,
+    rows,
+    cols,
+    replicates,
+    outdir,
+    plate_number,
+    plate_concentration,
+):
     outdir.mkdir(parents=True, exist_ok=True)
 
-    for row, col, x, y in spectra:
+    out = outdir / f"plate{plate_number}_{plate_concentration}mgml.npz"
+
+    # Write to a temporary file first so that readers never see a partial plate
+    tmp = out.with_name(f"{out.name}.{os.getpid()}.tmp")
+
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            header=np.array(header, dtype=str),
+            matrix=matrix,
+            shifts=shifts,
+            rows=rows,
+            cols=cols,
+            replicates=replicates,
+        )
+
+    os.replace(tmp, out)
+
+    return out.name
+
+
+def read_plate(path):
+    with np.load(path, allow_pickle=False) as plate:
+        return (
+            plate["header"].tolist(),
+            plate["matrix"],
+            plate["shifts"],
+            plate["rows"],
+            plate["cols"],
+            plate["replicates"],
+        )
+
+
+# ==============================================================
+# Optional per-well .txt view of a combined plate file
+# Only wells whose .txt file is missing are written
+# ==============================================================
+def write_well_views(output_dir, entry):
+    views = entry["samples"]
 
-        well = rowcol_to_well(row, col)
+    if all((output_dir / view).exists() for view in views):
+        entry["views"] = views
+        return
 
-        out = outdir / f"plate{plate_number}_{plate_concentration}mgml_{well}.txt"
+    (plate_file,) = entry["outputs"]
 
-        with open(out, "w", encoding="utf-8", newline="\n") as f:
-            for xi, yi in zip(x, y):
-                f.write(f"{xi:.6f}\t{yi:.6f}\n")
+    _, matrix, shifts, _, _, _ = read_plate(output_dir / plate_file)
+
+    spectrum = np.empty((shifts.size, 2))
+    spectrum[:, 0] = shifts
+
+    for i, view in enumerate(views):
+
+        out = output_dir / view
+
+        if out.exists():
+            continue
+
+        spectrum[:, 1] = matrix[i]
+
+        np.savetxt(out, spectrum, fmt="%.6f", delimiter="\t", encoding="utf-8")
+
+    entry["views"] = views
+
+
+def well_txt_names(plate_number, plate_concentration, wells, replicates):
+    prefix = f"plate{plate_number}_{plate_concentration}mgml_"
+
+    # Replicates after the first in a well, e.g. plate1_60mgml_A1_r2.txt
+    suffix = np.where(replicates > 0, np.char.add("_r", replicates.astype(str)), "")
+
+    return np.char.add(np.char.add(np.char.add(prefix, wells), suffix), ".txt")
 
 
 # ================
 # Plate utilities
 # ================
+def sample_labels(header, rows, cols):
+    # Wells and row labels of the spectra of a plate, or the Y and X
+    # positions of a map, which may run past the rows and columns of a plate
+    if is_map_header(header):
+        return position_labels(rows, cols)
+
+    return well_labels(rows, cols), ROW_LABELS[rows - 1]
+
+
 def rowcol_to_well(row, col):
     """
     Plate convention:
-      Row    = A–H (1–8)
-      Column = 01–12
+      Row    = A–H (1–8), A–P (1–16) or A–AF (1–32)
+      Column = 1–12, 1–24 or 1–48
     """
-    if not (1 <= row <= 26):
+    if not (1 <= row <= len(ROW_LABELS)):
         raise ValueError(f"Row out of range: {row}")
-    return f"{chr(64 + row)}{col}"
+    return f"{row_label(row)}{col}"
@@ -0,0 +1,215 @@
+# ============================================================================
+# PCA by randomised range finding (Halko, Martinsson and Tropp)
+# The (samples, shifts) matrix is read CHUNK_ROWS rows at a time and mean
+# centred and autoscaled one chunk at a time, so the scaled matrix is never
+# held in memory. pca.py passes a np.memmap of the preprocessed spectra, so
+# the fit is out-of-core. The number of passes over the matrix is fixed at
+# 4 + 2 * power_iterations
+# Returns a pcaobj with the same keys as phi.pca
+# ============================================================================
+
+import datetime
+import numpy as np
+import pcm_asds_pca.pyphi.pyphi as phi
+
+# Rows of the matrix read at a time
+CHUNK_ROWS = 1024
+
+# Extra random directions sampled beyond the number of Principal Components
+OVERSAMPLING = 10
+
+# Passes refining the range of the matrix, more are needed for slowly decaying spectra
+POWER_ITERATIONS = 2
+
+
+def randomized_pca(
+    X,
+    A,
+    *,
+    obsid=None,
+    varid=None,
+    oversampling=OVERSAMPLING,
+    power_iterations=POWER_ITERATIONS,
+    chunk_rows=CHUNK_ROWS,
+    seed=0,
+    shush=False,
+):
+    """
+    PCA of X (mean centred and autoscaled as phi.pca with mcs=True)
+
+    X : (samples, shifts) array read by rows, e.g. np.load(path, mmap_mode="r")
+    obsid, varid : ids of the rows and columns, saved as obsidX and varidX
+    """
+    n, p = X.shape
+    A = int(A)
+
+    # T2 limits need more spectra than Principal Components, as for IncrementalPCA
+    if n <= A:
+        raise ValueError(
+            f"At least {A + 1} spectra are needed for {A} Principal Components"
+        )
+
+    if A > p:
+        raise ValueError(f"Cannot fit {A} Principal Components to {p} shifts")
+
+    chunks = [slice(start, start + chunk_rows) for start in range(0, n, chunk_rows)]
+
+    # ======================================================
+    # Pass 1: mean and standard deviation of every variable
+    # ======================================================
+    count = 0
+    mean = np.zeros(p)
+    m2 = np.zeros(p)
+
+    for chunk in chunks:
+        block = np.asarray(X[chunk], dtype=np.float64)
+        rows = block.shape[0]
+
+        block_mean = block.mean(axis=0)
+        delta = block_mean - mean
+
+        m2 += ((block - block_mean) ** 2).sum(axis=0) + delta**2 * (
+            count * rows / (count + rows)
+        )
+        mean += delta * rows / (count + rows)
+        count += rows
+
+    std = np.sqrt(m2 / (n - 1))
+
+    def scaled(chunk):
+        return (np.asarray(X[chunk], dtype=np.float64) - mean) / std
+
+    # ==========================================================
+    # Pass 2: sample the range of the matrix with random vectors
+    # ==========================================================
+    width = min(A + oversampling, n, p)
+
+    omega = np.random.default_rng(seed).standard_normal((p, width))
+
+    Y = np.empty((n, width))
+    norms = np.empty(n)
+
+    for chunk in chunks:
+        Z = scaled(chunk)
+        Y[chunk] = Z @ omega
+        norms[chunk] = np.sum(Z**2, axis=1)
+
+    # ===============================================
+    # Two passes per power iteration: Y = Z (Z' Q)
+    # ===============================================
+    for _ in range(power_iterations):
+        Q, _ = np.linalg.qr(Y)
+
+        W = np.zeros((p, width))
+
+        for chunk in chunks:
+            W += scaled(chunk).T @ Q[chunk]
+
+        W, _ = np.linalg.qr(W)
+
+        for chunk in chunks:
+            Y[chunk] = scaled(chunk) @ W
+
+    Q, _ = np.linalg.qr(Y)
+
+    # =======================================================
+    # Pass: project the matrix onto its range, B = Q' Z, and
+    # take the loadings from the SVD of the small matrix B
+    # =======================================================
+    B = np.zeros((Q.shape[1], p))
+
+    for chunk in chunks:
+        B += Q[chunk].T @ scaled(chunk)
+
+    _, _, Vt = np.linalg.svd(B, full_matrices=False)
+
+    P = Vt[:A].T.copy()
+
+    # ================================================
+    # Last pass: scores, and Z' T for R2X per variable
+    # ================================================
+    T = np.empty((n, A))
+    G = np.zeros((p, A))
+
+    for chunk in chunks:
+        Z = scaled(chunk)
+        T[chunk] = Z @ P
+        G += Z.T @ T[chunk]
+
+    # Signs as chosen by phi.pca
+    for a in range(A):
+        t = T[:, a]
+
+        if np.any(t < 0) and np.any(t > 0) and np.var(t[t < 0]) > np.var(t[t >= 0]):
+            T[:, a] = -t
+            P[:, a] = -P[:, a]
+            G[:, a] = -G[:, a]
+
+    # Every autoscaled variable has a sum of squares of n - 1
+    TSSpv = np.full(p, n - 1.0)
+    TSS = TSSpv.sum()
+
+    TT = T.T @ T
+
+    # Residual sum of squares after each Principal Component, as when deflating
+    # Z - T P', given that P has orthonormal columns and T = Z P
+    r2 = np.empty(A)
+    r2pv = np.empty((p, A))
+
+    for a in range(A):
+        Pa = P[:, : a + 1]
+
+        residual_pv = (
+            TSSpv
+            - 2 * np.sum(Pa * G[:, : a + 1], axis=1)
+            + np.einsum("jb,bc,jc->j", Pa, TT[: a + 1, : a + 1], Pa)
+        )
+
+        r2[a] = np.trace(TT[: a + 1, : a + 1]) / TSS
+        r2pv[:, a] = 1 - residual_pv / TSSpv
+
+    for a in range(A - 1, 0, -1):
+        r2[a] = r2[a] - r2[a - 1]
+        r2pv[:, a] = r2pv[:, a] - r2pv[:, a - 1]
+
+    pcaobj = {
+        "T": T,
+        "P": P,
+        "r2x": r2,
+        "r2xpv": r2pv,
+        "mx": mean.reshape(1, -1),
+        "sx": std.reshape(1, -1),
+    }
+
+    if obsid is not None:
+        pcaobj["obsidX"] = list(obsid)
+        pcaobj["varidX"] = list(varid) if varid is not None else list(range(p))
+
+    if not shush:
+        eigs = np.var(T, axis=0)
+        r2xc = np.cumsum(r2)
+
+        print(
+            f"Randomised PCA ({power_iterations} power iterations, {4 + 2 * power_iterations} passes) executed on: {datetime.datetime.now()}"
+        )
+        print("--------------------------------------------------------------")
+        print("PC #      Eig        R2X       sum(R2X) ")
+        for a in range(A):
+            print(
+                "PC #"
+                + str(a + 1)
+                + ":   {:8.3f}    {:.3f}     {:.3f}".format(eigs[a], r2[a], r2xc[a])
+            )
+        print("--------------------------------------------------------------")
+
+    pcaobj["T2"] = phi.hott2(pcaobj, Tnew=T)
+    pcaobj["T2_lim99"] = (((n - 1) * (n + 1) * A) / (n * (n - A))) * phi.f99(A, (n - A))
+    pcaobj["T2_lim95"] = (((n - 1) * (n + 1) * A) / (n * (n - A))) * phi.f95(A, (n - A))
+
+    speX = (norms - np.sum(T**2, axis=1)).reshape(-1, 1)
+
+    pcaobj["speX"] = np.maximum(speX, 0)
+    pcaobj["speX_lim95"], pcaobj["speX_lim99"] = phi.spe_ci(pcaobj["speX"])
+    pcaobj["type"] = "pca"
+
+    return pcaobj
@@ -0,0 +1,232 @@
+# ============================================================================
+# Registry of readers for the spectral export formats that can be analysed
+# The reader for a file is selected from the first few kilobytes of the file
+# Every reader returns (matrix, axis, well_index, metadata):
+#   matrix     (n_spectra, n_shifts) intensities
+#   axis       (n_shifts,) Raman shifts
+#   well_index (n_spectra,) plate row and column of each spectrum, 0 if none
+#   metadata   dict of the format name and any header lines
+# ============================================================================
+
+import io
+import numpy as np
+import pandas as pd
+import pathlib
+
+from pcm_asds_pca.core.labspec import decode, read_labspec, read_labspec_map, read_text
+from pcm_asds_pca.core.wells import split_wells
+
+WELL_DTYPE = np.dtype([("row", "i8"), ("column", "i8")])
+
+# Extensions of the files that are read from ANALYSIS_FOLDER
+EXTENSIONS = (".txt", ".csv", ".tsv")
+
+# Number of bytes read to select a reader
+SIGNATURE_SIZE = 1 << 16
+
+
+def read_spectra(path, text=None):
+    # text is the contents of the file if it has already been read
+    if text is None:
+        text = read_text(path)
+
+    name, reader = find_reader(path, text)
+
+    matrix, axis, well_index, metadata = reader(path, text)
+
+    metadata["format"] = name
+
+    return matrix, axis, well_index, metadata
+
+
+def find_reader(path, text=None):
+    head = read_head(path) if text is None else text_head(text)
+
+    for name, sniff, reader in READERS:
+        if sniff(head):
+            return name, reader
+
+    raise ValueError(f"No reader found for {pathlib.Path(path).name}")
+
+
+def register_reader(name, sniff, reader):
+    """
+    Add a reader, tried before the built-in readers.
+
+    sniff(head) returns True if the start of a file, decoded as text, is in
+    the format read by reader(path, text), text being the whole file decoded
+    """
+    READERS.insert(0, (name, sniff, reader))
+
+
+def read_head(path):
+    with open(path, "rb") as f:
+        head = f.read(SIGNATURE_SIZE)
+
+    # Drop a line that may have been cut off
+    if len(head) == SIGNATURE_SIZE and b"\n" in head:
+        head = head[: head.rindex(b"\n")]
+
+    return decode(head)
+
+
+def text_head(text):
+    # The start of a file already read, as returned by read_head
+    head = text[:SIGNATURE_SIZE]
+
+    if len(head) == SIGNATURE_SIZE and "\n" in head:
+        head = head[: head.rindex("\n")]
+
+    return head
+
+
+def index_wells(rows, cols):
+    well_index = np.zeros(len(rows), dtype=WELL_DTYPE)
+    well_index["row"] = rows
+    well_index["column"] = cols
+
+    return well_index
+
+
+# =======================================
+# LabSpec single spectrum, multiwell and map
+# =======================================
+def header_fields(head):
+    # Header lines and first line of data
+    header = []
+
+    for line in head.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("#"):
+            return header, line
+        header.append(line)
+
+    return header, ""
+
+
+def data_lines(head, count=2):
+    # First count lines of data, keeping a leading delimiter
+    lines = []
+
+    for line in head.splitlines():
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+
+        lines.append(line.rstrip())
+
+        if len(lines) == count:
+            break
+
+    return lines
+
+
+def is_numeric(values):
+    try:
+        np.array(values, dtype=np.float64)
+    except ValueError:
+        return False
+
+    return len(values) > 0
+
+
+def sniff_labspec(head):
+    lines = data_lines(head)
+
+    if not lines or not is_numeric(lines[0].split()):
+        return False
+
+    # Every line of data begins with a number, not a well label as in a .tsv
+    # file whose first cell is empty
+    return len(lines) == 1 or is_numeric(lines[1].split()[:1])
+
+
+def sniff_labspec_map(head):
+    header, _ = header_fields(head)
+
+    return sniff_labspec(head) and is_map_header(header)
+
+
+def is_map_header(header):
+    return any(
+        line.replace(" ", "") in ("#AxisType[2]=X", "#AxisType[3]=Y") for line in header
+    )
+
+
+def read_labspec_spectra(path, text):
+    header, matrix, shifts, rows, cols = read_labspec(path, text)
+
+    return matrix, shifts, index_wells(rows, cols), dict(header=header)
+
+
+def read_labspec_map_spectra(path, text):
+    header, matrix, shifts, rows, cols = read_labspec_map(path, text)
+
+    return matrix, shifts, index_wells(rows, cols), dict(header=header)
+
+
+# ===============================================================
+# Generic matrix exports
+# Either one spectrum per row, with the well in the first column
+# and the shifts in the first row, e.g.
+#   well,5.9,7.8,...
+#   A1,13148.3,4647.5,...
+# or one spectrum per column, with the shifts in the first column
+# and the wells in the first row
+# ===============================================================
+def sniff_delimited(delimiter):
+
+    def sniff(head):
+        lines = data_lines(head)
+
+        if not lines:
+            return False
+
+        cells = lines[0].strip(" ").split(delimiter)
+
+        if len(cells) < 2:
+            return False
+
+        if cells[0] != "":
+            return not is_numeric(cells[:1])
+
+        # The first cell may be empty, above the wells of the rows or before
+        # the wells of the columns. LabSpec files begin with an empty cell
+        # followed by the shifts, and every later line begins with a number
+        if not is_numeric(cells[1:]):
+            return True
+
+        return len(lines) > 1 and not is_numeric(lines[1].split(delimiter)[:1])
+
+    return sniff
+
+
+def read_delimited(delimiter):
+
+    def reader(path, text):
+        df = pd.read_csv(io.StringIO(text), sep=delimiter, index_col=0, comment="#")
+
+        # Spectra are in columns if the first row holds the well labels
+        if not is_numeric(list(df.columns)):
+            df = df.T
+
+        axis = np.array(df.columns, dtype=np.float64)
+        matrix = np.ascontiguousarray(df.to_numpy(dtype=np.float64))
+
+        _, rows, cols = split_wells(df.index.astype(str))
+
+        header = [line for line in text.splitlines() if line.startswith("#")]
+
+        return matrix, axis, index_wells(rows, cols), dict(header=header)
+
+    return reader
+
+
+# Readers are tried in order, the first whose signature matches is used
+READERS = [
+    ("labspec_map", sniff_labspec_map, read_labspec_map_spectra),
+    ("labspec", sniff_labspec, read_labspec_spectra),
+    ("tsv", sniff_delimited("\t"), read_delimited("\t")),
+    ("csv", sniff_delimited(","), read_delimited(",")),
+]
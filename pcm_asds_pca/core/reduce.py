@@ -0,0 +1,306 @@
+# ============================================================================
+# Combine several spectra recorded in the same well (e.g. maps or replicates)
+# "mean", "median" and "trimmed_mean" reduce them to one spectrum per well
+# "all" keeps every spectrum with a replicate index 0, 1, 2 ... per well
+# ============================================================================
+
+import numpy as np
+import pandas as pd
+
+from functools import partial
+from scipy.stats import trim_mean
+
+REDUCERS = ("mean", "median", "trimmed_mean", "all")
+
+# Spectra added one at a time that are combined as a single block
+BLOCK_ROWS = 1024
+
+
+class WellReducer:
+    """
+    Aggregates spectra as a file is read, one block of lines at a time.
+
+    Every block is grouped by well with one stable sort, as in reduce_wells.
+    mean keeps a running sum per well, so memory does not grow with the
+    number of spectra per well. median and trimmed_mean only hold back the
+    spectra of the last well of a block, which may continue in the next
+    block, so the spectra of a well must be contiguous in the file, as in
+    LabSpec exports
+    """
+
+    def __init__(self, method="mean", proportion=0.1):
+
+        if method not in REDUCERS:
+            raise ValueError(f"Unknown well reducer: {method}")
+
+        self.method = method
+        self.proportion = proportion
+
+        # Wells in order of first appearance and the spectra added to each
+        self.wells = pd.MultiIndex.from_arrays([[], []])
+        self.counts = np.zeros(0, dtype=np.int64)
+
+        self._lines = []
+        self._blocks = []
+        self._keys = []
+        self._replicates = []
+
+        self._sums = None
+        self._pending = None
+
+    def __len__(self):
+        # Number of spectra added
+        return int(self.counts.sum()) + len(self._lines) + self._held()
+
+    def add(self, row, col, intensities):
+        # Spectra added one at a time are combined BLOCK_ROWS at a time
+        self._lines.append((row, col, np.asarray(intensities, dtype=np.float64)))
+
+        if len(self._lines) >= BLOCK_ROWS:
+            self._flush_lines()
+
+    def add_block(self, rows, cols, matrix):
+        """
+        Add a block of spectra, e.g. a chunk of lines of a file
+        """
+        self._flush_lines()
+
+        rows = np.asarray(rows)
+        cols = np.asarray(cols)
+        matrix = np.asarray(matrix, dtype=np.float64)
+
+        if rows.size == 0:
+            return
+
+        match self.method:
+
+            case "all":
+                self._add_all(rows, cols, matrix)
+
+            case "mean":
+                self._add_sums(rows, cols, matrix)
+
+            case _:
+                self._add_runs(rows, cols, matrix)
+
+    def _flush_lines(self):
+        if not self._lines:
+            return
+
+        rows, cols, spectra = zip(*self._lines)
+        self._lines = []
+
+        self.add_block(np.array(rows), np.array(cols), np.vstack(spectra))
+
+    def _held(self):
+        return 0 if self._pending is None else self._pending[0].size
+
+    def _positions(self, keys):
+        # Position of every well of keys among the wells seen so far,
+        # adding the wells that have not been seen
+        positions = self.wells.get_indexer(keys)
+        new = positions < 0
+
+        if new.any():
+            start = len(self.wells)
+
+            self.wells = self.wells.append(keys[new])
+            self.counts = np.concatenate(
+                [self.counts, np.zeros(np.count_nonzero(new), dtype=np.int64)]
+            )
+
+            positions[new] = np.arange(start, len(self.wells))
+
+        return positions
+
+    def _add_all(self, rows, cols, matrix):
+        groups = WellGroups(rows, cols)
+        positions = self._positions(groups.first)
+
+        # Replicates continue from the spectra of the same well in earlier blocks
+        self._replicates.append(
+            self.counts[positions][groups.wells] + groups.replicates()
+        )
+        self.counts[positions] += groups.counts
+
+        self._blocks.append(matrix)
+        self._keys.append((rows, cols))
+
+    def _add_sums(self, rows, cols, matrix):
+        groups = WellGroups(rows, cols)
+        sums = np.add.reduceat(matrix[groups.order], groups.starts, axis=0)
+
+        positions = self._positions(groups.first)
+
+        # Running sums grow by doubling as new wells are found
+        if self._sums is None:
+            self._sums = np.zeros((max(len(self.wells), 16), matrix.shape[1]))
+        elif len(self.wells) > len(self._sums):
+            grown = np.zeros((2 * len(self.wells), matrix.shape[1]))
+            grown[: len(self._sums)] = self._sums
+            self._sums = grown
+
+        # Wells are unique within a block, so positions are never repeated
+        self._sums[positions] += sums
+        self.counts[positions] += groups.counts
+
+    def _add_runs(self, rows, cols, matrix):
+
+        # Spectra held back from the end of the previous block come first
+        if self._pending is not None:
+            rows = np.concatenate([self._pending[0], rows])
+            cols = np.concatenate([self._pending[1], cols])
+            matrix = np.vstack([self._pending[2], matrix])
+
+        change = np.flatnonzero((rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])) + 1
+
+        # The last well of the block may continue in the next block
+        last = change[-1] if change.size else 0
+
+        self._pending = (rows[last:], cols[last:], matrix[last:])
+
+        if last:
+            self._reduce_runs(rows[:last], cols[:last], matrix[:last])
+
+    def _reduce_runs(self, rows, cols, matrix):
+        groups = WellGroups(rows, cols)
+
+        # The spectra of a well must be contiguous and not continue a well
+        # reduced from an earlier block
+        last = groups.order[groups.starts + groups.counts - 1]
+        split = last - groups.order[groups.starts] + 1 != groups.counts
+        split |= self.wells.get_indexer(groups.first) >= 0
+
+        if split.any():
+            row, col = groups.first[np.flatnonzero(split)[0]]
+            raise ValueError(
+                f"Spectra of well ({row}, {col}) are not contiguous, use the mean reducer"
+            )
+
+        positions = self._positions(groups.first)
+        self.counts[positions] += groups.counts
+
+        self._blocks.append(reduce_groups(matrix, groups, self.method, self.proportion))
+
+    def result(self):
+        """
+        Returns (matrix, rows, cols, replicates)
+        """
+        self._flush_lines()
+
+        if self._pending is not None:
+            rows, cols, matrix = self._pending
+            self._pending = None
+            self._reduce_runs(rows, cols, matrix)
+
+        # Wells are plate rows and columns, or stage positions for maps
+        rows = self.wells.get_level_values(0).to_numpy()
+        cols = self.wells.get_level_values(1).to_numpy()
+        replicates = np.zeros(len(self.wells), dtype=np.int64)
+
+        match self.method:
+
+            case "all":
+                if not self._blocks:
+                    return np.empty((0, 0)), rows, cols, replicates
+
+                matrix = np.vstack(self._blocks)
+                rows = np.concatenate([rows for rows, _ in self._keys])
+                cols = np.concatenate([cols for _, cols in self._keys])
+                replicates = np.concatenate(self._replicates)
+
+            case "mean":
+                if self._sums is None:
+                    return np.empty((0, 0)), rows, cols, replicates
+
+                n = len(self.wells)
+                matrix = self._sums[:n] / self.counts[:, np.newaxis]
+
+            case _:
+                if not self._blocks:
+                    return np.empty((0, 0)), rows, cols, replicates
+
+                matrix = np.vstack(self._blocks)
+
+        return np.asarray(matrix, dtype=np.float64), rows, cols, replicates
+
+
+class WellGroups:
+    """
+    Spectra grouped by well with one stable sort, so that the spectra of
+    every well form a contiguous segment of matrix[order]
+    """
+
+    def __init__(self, rows, cols):
+        keys = pd.MultiIndex.from_arrays([rows, cols])
+
+        # Well of every spectrum, numbered in order of first appearance
+        self.wells, self.first = pd.factorize(keys)
+
+        self.order = np.argsort(self.wells, kind="stable")
+        self.counts = np.bincount(self.wells, minlength=len(self.first))
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+    def __len__(self):
+        return len(self.wells)
+
+    def replicates(self):
+        # Position of every spectrum among the spectra of its well
+        replicates = np.empty(len(self.wells), dtype=np.int64)
+        replicates[self.order] = np.arange(len(self.wells)) - np.repeat(
+            self.starts, self.counts
+        )
+
+        return replicates
+
+
+def reduce_groups(matrix, groups, method, proportion=0.1):
+    # One spectrum per well, in order of first appearance
+    if len(groups.first) == len(groups):
+        return np.asarray(matrix, dtype=np.float64)
+
+    grouped = matrix[groups.order]
+
+    match method:
+
+        case "mean":
+            sums = np.add.reduceat(grouped, groups.starts, axis=0, dtype=np.float64)
+            return sums / groups.counts[:, np.newaxis]
+
+        case "median":
+            reduce = np.median
+
+        case _:
+            reduce = partial(trim_mean, proportiontocut=proportion)
+
+    if np.all(groups.counts == groups.counts[0]):
+        # Wells with the same number of spectra are reduced in one call
+        shape = (len(groups.first), groups.counts[0], -1)
+        return np.asarray(reduce(grouped.reshape(shape), axis=1), dtype=np.float64)
+
+    segments = np.split(grouped, groups.starts[1:])
+
+    return np.array([reduce(segment, axis=0) for segment in segments])
+
+
+# ===================================================================
+# Vectorised equivalent of WellReducer for a matrix read in one pass
+# Returns (matrix, rows, cols, replicates)
+# ===================================================================
+def reduce_wells(matrix, rows, cols, method="mean", proportion=0.1):
+
+    if method not in REDUCERS:
+        raise ValueError(f"Unknown well reducer: {method}")
+
+    groups = WellGroups(rows, cols)
+
+    if method == "all":
+        return matrix, rows, cols, groups.replicates()
+
+    well_rows = groups.first.get_level_values(0).to_numpy()
+    well_cols = groups.first.get_level_values(1).to_numpy()
+    replicates = np.zeros(len(groups.first), dtype=np.int64)
+
+    reduced = reduce_groups(matrix, groups, method, proportion)
+
+    return reduced, well_rows, well_cols, replicates
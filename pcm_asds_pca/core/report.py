@@ -0,0 +1,195 @@
+# ============================================================================
+# Human-readable reports of the dataframes and PCA model written by pca.py
+# Reports are bounded summaries (shapes, first and last rows, statistics per
+# Principal Component and the T2 and SPE limits) so that their size and the
+# time taken to write them do not grow with the number of spectra
+# Full matrices are only written by write_csv, in chunks
+# ============================================================================
+
+import numpy as np
+import pandas as pd
+
+# Rows of a matrix read at a time by write_csv and intensity_statistics
+CSV_CHUNK_ROWS = 1000
+
+# Columns of the sample dataframe summarised by their counts
+COUNTED_COLUMNS = ("plate", "drug", "polymer", "drug_loading", "appearance")
+
+
+def write_dataframes_report(path, spectral_df, sample_df, rows=5):
+
+    with open(path, "w") as f:
+
+        heading("Spectral dataframe", f)
+
+        shifts = spectral_df.columns.to_numpy(dtype=np.float64)
+        matrix = spectral_df.to_numpy()
+
+        print(f"Spectra: {spectral_df.shape[0]}", file=f)
+        print(
+            f"Shifts: {spectral_df.shape[1]} ({shifts.min():.2f} to {shifts.max():.2f} cm-1)",
+            file=f,
+        )
+        low, high, mean, missing = intensity_statistics(matrix)
+
+        print(f"Size: {matrix.nbytes / 1024**2:.1f} MB ({matrix.dtype})", file=f)
+        print(
+            f"Intensity: min {low:.6g}, max {high:.6g}, mean {mean:.6g}",
+            file=f,
+        )
+        print(f"Missing values: {missing}", file=f)
+        print(file=f)
+
+        # pandas only formats the first and last rows and columns
+        print(spectral_df.to_string(max_rows=2 * rows, max_cols=2 * rows), file=f)
+
+        heading("Sample dataframe", f)
+
+        print(f"Samples: {sample_df.shape[0]}", file=f)
+        print(file=f)
+
+        print(sample_df.to_string(max_rows=2 * rows), file=f)
+
+        for name in COUNTED_COLUMNS:
+            if name not in sample_df:
+                continue
+
+            counts = sample_df[name].astype(str).value_counts(sort=False)
+
+            print(file=f)
+            print(f"Samples per {name}:", file=f)
+
+            for value, count in counts.items():
+                print(f"  {value}: {count}", file=f)
+
+
+def write_model_report(path, pcaobj, rows=5):
+
+    T = np.asarray(pcaobj["T"])
+    P = np.asarray(pcaobj["P"])
+    T2 = np.asarray(pcaobj["T2"])
+    spe = np.asarray(pcaobj["speX"])[:, 0]
+
+    obsids = np.asarray(pcaobj["obsidX"])
+    shifts = np.asarray(pcaobj["varidX"], dtype=np.float64)
+
+    num_pcs = T.shape[1]
+    pcs = [f"PC{a}" for a in range(1, num_pcs + 1)]
+
+    with open(path, "w") as f:
+
+        heading("Elements of the PCA model", f)
+
+        for key, value in pcaobj.items():
+
+            if isinstance(value, np.ndarray):
+                print(f"{key}: array {value.shape} {value.dtype}", file=f)
+            elif isinstance(value, list):
+                print(f"{key}: list of {len(value)}", file=f)
+            else:
+                print(f"{key}: {value}", file=f)
+
+        heading("Principal Components", f)
+
+        r2x = np.asarray(pcaobj["r2x"]).ravel()
+
+        components = pd.DataFrame(
+            {
+                "R2X": r2x,
+                "Cumulative R2X": np.cumsum(r2x),
+                "Score mean": T.mean(axis=0),
+                "Score std": T.std(axis=0, ddof=1) if T.shape[0] > 1 else np.nan,
+                "Score min": T.min(axis=0),
+                "Score max": T.max(axis=0),
+            },
+            index=pcs,
+        )
+
+        if "q2" in pcaobj:
+            components.insert(2, "Q2", np.asarray(pcaobj["q2"]).ravel())
+
+        print(components.to_string(), file=f)
+
+        heading("Limits", f)
+
+        for name, values in (("T2", T2), ("speX", spe)):
+            for level in (95, 99):
+                limit = float(pcaobj[f"{name}_lim{level}"])
+                above = np.count_nonzero(values > limit)
+
+                print(
+                    f"{name} {level}% limit: {limit:.6g} ({above} of {values.size} samples above)",
+                    file=f,
+                )
+
+        heading("Scores", f)
+
+        scores = pd.DataFrame(T, index=pd.Index(obsids, name="obsid"), columns=pcs)
+        scores["T2"] = T2
+        scores["SPE"] = spe
+
+        print(scores.to_string(max_rows=2 * rows), file=f)
+
+        heading("Shifts with the largest loadings", f)
+
+        # Only the largest rows of each column are sorted
+        count = min(rows, P.shape[0])
+        largest = np.argpartition(-np.abs(P), count - 1, axis=0)[:count]
+
+        for a, pc in enumerate(pcs):
+            top = largest[:, a][np.argsort(-np.abs(P[largest[:, a], a]))]
+
+            loadings = ", ".join(f"{shifts[i]:.2f} ({P[i, a]:+.4f})" for i in top)
+            print(f"{pc}: {loadings}", file=f)
+
+
+def heading(text, f):
+    print(file=f)
+    print(text, file=f)
+    print("=" * len(text), file=f)
+    print(file=f)
+
+
+def intensity_statistics(matrix, chunk_rows=CSV_CHUNK_ROWS):
+    # Minimum, maximum and mean of the values that are not NaN, and the number
+    # of NaN values, read chunk_rows rows at a time as matrix may be memory-mapped
+    low, high, total, count = np.inf, -np.inf, 0.0, 0
+
+    for start in range(0, matrix.shape[0], chunk_rows):
+        chunk = np.asarray(matrix[start : start + chunk_rows], dtype=np.float64)
+        values = chunk[~np.isnan(chunk)]
+
+        if values.size:
+            low = min(low, values.min())
+            high = max(high, values.max())
+            total += values.sum()
+            count += values.size
+
+    if count == 0:
+        return np.nan, np.nan, np.nan, matrix.size
+
+    return low, high, total / count, matrix.size - count
+
+
+def write_csv(path, frame, chunk_rows=CSV_CHUNK_ROWS, fmt="%.17g"):
+    """
+    Write a numeric dataframe such as spectral_df to .csv with its index as
+    the first column, formatting chunk_rows rows at a time
+    """
+    matrix = frame.to_numpy()
+    labels = frame.index.tolist()
+
+    row = "%s," + ",".join([fmt] * matrix.shape[1]) + "\n"
+
+    with open(path, "w") as f:
+
+        header = [str(frame.index.name or "")] + [str(c) for c in frame.columns]
+        print(",".join(header), file=f)
+
+        for start in range(0, matrix.shape[0], chunk_rows):
+            chunk = matrix[start : start + chunk_rows].astype(np.float64).tolist()
+
+            f.writelines(
+                row % (label, *values)
+                for label, values in zip(labels[start : start + chunk_rows], chunk)
+            )
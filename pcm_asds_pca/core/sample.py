@@ -4,211 +4,25 @@
 # The class also includes a method to return a string representation of the sample
 # ===========================================================================================
 
-from pcm_asds_pca.config.settings import ANALYSIS_FOLDER
+from pcm_asds_pca.core.layout import plate_layout
+from pcm_asds_pca.core.scan import WELL, parse_names
 
-drug_loadings = {
-    "A": 100,
-    "B": 95,
-    "C": 90,
-    "D": 85,
-    "E": 80,
-    "F": 75,
-    "G": 70,
-    "H": 0,
-}
+# The glass reference is not on a plate
+GLASS_REFERENCE = "glass_reference.txt"
 
-plate1_polymers = {
-    1: "PLS",
-    2: "PLS",
-    3: "PLS",
-    4: "AFF",
-    5: "AFF",
-    6: "AFF",
-    7: "PLS",
-    8: "PLS",
-    9: "PLS",
-    10: "AFF",
-    11: "AFF",
-    12: "AFF",
-}
-
-plate2_polymers = {
-    1: "PLS",
-    2: "PLS",
-    3: "PLS",
-    4: "AFF",
-    5: "AFF",
-    6: "AFF",
-    7: "HPMCAS",
-    8: "HPMCAS",
-    9: "HPMCAS",
-    10: "SOL",
-    11: "SOL",
-    12: "SOL",
-}
-
-plate3_polymers = {
-    1: "PLS",
-    2: "PLS",
-    3: "PLS",
-    4: "AFF",
-    5: "AFF",
-    6: "AFF",
-    7: "HPMCAS",
-    8: "HPMCAS",
-    9: "HPMCAS",
-    10: "SOL",
-    11: "SOL",
-    12: "SOL",
-}
-
-
-plate1_crystalline_wells = [
-    "A3",
-    "A10",
-    "A11",
-    "A12",
-    "B1",
-    "B4",
-    "B5",
-    "B6",
-    "B7",
-    "B9",
-    "B10",
-    "B11",
-    "C4",
-    "C5",
-    "C6",
-    "C7",
-    "C9",
-    "C10",
-    "C11",
-    "C12",
-    "D4",
-    "D5",
-    "D6",
-    "D10",
-    "D12",
-    "E9",
-    "E10",
-    "E11",
-    "E12",
-]
-
-plate2_crystalline_wells = [
-    "A2",
-    "A3",
-    "A4",
-    "A6",
-    "A7",
-    "A8",
-    "A9",
-    "A10",
-    "A11",
-    "A12",
-    "B1",
-    "B2",
-    "B3",
-    "B5",
-    "B6",
-    "B7",
-    "B8",
-    "B9",
-    "B10",
-    "B11",
-    "B12",
-    "C1",
-    "C3",
-    "C6",
-    "C7",
-    "C8",
-    "C9",
-    "C10",
-    "C11",
-    "C12",
-    "D1",
-    "D3",
-    "D4",
-    "D6",
-    "D7",
-    "D8",
-    "D9",
-    "D10",
-    "D11",
-    "D12",
-    "E1",
-    "E2",
-    "E3",
-    "E7",
-    "E8",
-    "E9",
-    "E10",
-    "E12",
-    "F3",
-    "F7",
-    "F8",
-    "F9",
-    "F10",
-    "F11",
-    "F12",
-    "G10",
-    "G11",
-]
-
-plate3_crystalline_wells = [
-    "A1",
-    "A4",
-    "A5",
-    "A6",
-    "A8",
-    "A10",
-    "B1",
-    "B2",
-    "B3",
-    "B5",
-    "B6",
-    "B8",
-    "B9",
-    "B10",
-    "B12",
-    "C1",
-    "C2",
-    "C4",
-    "C5",
-    "C6",
-    "C8",
-    "C10",
-    "C12",
-    "D2",
-    "D6",
-    "D7",
-    "D12",
-    "E2",
-    "E4",
-    "E5",
-    "E6",
-    "E7",
-    "E8",
-    "E10",
-    "F4",
-    "F5",
-    "F6",
-    "F9",
-    "F10",
-    "F12",
-    "G1",
-    "G4",
-    "G5",
-    "G6",
-    "G9",
-    "G10",
-    "G11",
-]
+GLASS = dict(
+    appearance="glass",
+    drug="glass",
+    polymer="glass",
+    row="glass",
+    well="Glass",
+    volume=0,
+)
 
 
 class Sample:
 
-    def __init__(self, filename: str, spectrum):
+    def __init__(self, filename: str, spectrum, record=None):
 
         self.appearance = "amorphous"
         self.drug = "PCM"
@@ -221,66 +35,47 @@ class Sample:
         self.concentration = 0
         self.drug_loading = 0
         self.volume = 2
+        self.replicate = 0
 
         # from rp.load.labspec
         self.spectrum = spectrum
 
-        file = filename.removeprefix(f"{ANALYSIS_FOLDER}/").removesuffix(".txt")
+        # Record of the file from core/scan.py, parsed here if not given
+        if record is None:
+            record = parse_names([filename])[0]
 
-        if file == "glass_reference":
-            self.appearance = "glass"
-            self.drug = "glass"
-            self.polymer = "glass"
-            self.row = "glass"
-            self.well = "Glass"
-            self.volume = 0
+        if record["name"] == GLASS_REFERENCE:
+            for field, value in GLASS.items():
+                setattr(self, field, value)
             return
 
-        for part in file.split("_"):
+        # e.g. plate1_60mgml_AF48_r2.txt, the third spectrum recorded in well AF48
+        if record["kind"] == WELL:
+            self.well = str(record["well"])
+            self.row = str(record["row"])
+            self.col = int(record["column"])
+            self.replicate = int(record["replicate"])
 
-            # e.g. A12
-            if part[0].isupper():
-                self.well = part
-                self.row = part[0]
-                self.col = int(self.well[1:])
+        self.plate = int(record["plate"])
+        self.concentration = int(record["concentration"])
 
-            # e.g. plate1
-            if part.startswith("plate"):
-                n = part.removeprefix("plate")
-                n = int(n)
-                self.plate = n
+        # Assign drug, polymer, drug loading, appearance and volume from the plate layout
+        # Wells missing from the layout keep the defaults
+        metadata = plate_layout().lookup(self.plate, self.well)
 
-            # e.g. 60mgml
-            if part.endswith("mgml"):
-                c = part.removesuffix("mgml")
-                c = int(c)
-                self.concentration = c
-
-        # Assign polymer, drug loading, polymer loading and appearance to each sample
-        match self.plate:
-
-            case 1:
-                self.polymer = plate1_polymers[self.col]
-                self.drug_loading = drug_loadings[self.row]
-                if self.well in plate1_crystalline_wells:
-                    self.appearance = "crystalline"
-                if self.col in [7, 8, 9, 10, 11, 12]:
-                    self.volume = 4
-
-            case 2:
-                self.polymer = plate2_polymers[self.col]
-                self.drug_loading = drug_loadings[self.row]
-                if self.well in plate2_crystalline_wells:
-                    self.appearance = "crystalline"
-
-            case 3:
-                self.polymer = plate3_polymers[self.col]
-                self.drug_loading = drug_loadings[self.row]
-                if self.well in plate3_crystalline_wells:
-                    self.appearance = "crystalline"
+        self.drug = str(metadata["drug"])
+        self.polymer = str(metadata["polymer"])
+        self.drug_loading = int(metadata["drug_loading"])
+        self.appearance = str(metadata["appearance"])
+        self.volume = int(metadata["volume"])
 
     def __str__(self):
         if self.well == "Glass":
             return "Glass"
         else:
-            return f"Sample {self.well} on plate {self.plate} ({self.concentration} mg/mL) {self.drug}/{self.polymer} {self.drug_loading}%/{100 - self.drug_loading}% {self.appearance}"
+            sample = f"Sample {self.well} on plate {self.plate} ({self.concentration} mg/mL) {self.drug}/{self.polymer} {self.drug_loading}%/{100 - self.drug_loading}% {self.appearance}"
+
+            if self.replicate > 0:
+                sample += f" replicate {self.replicate}"
+
+            return sample
@@ -0,0 +1,142 @@
+# ============================================================================
+# Scan a folder once into a typed, sorted manifest of file records
+# Plate, concentration, well, row, column and replicate are parsed from every
+# filename in a single vectorised pass, e.g.
+#   plate1_60mgml_multiwell.txt -> plate file of plate 1 at 60 mg/mL
+#   plate1_60mgml_AB12_r2.txt   -> well AB12, replicate 2
+#   glass_reference.txt         -> single spectrum
+# Records are passed to every later stage so filenames are parsed only once
+# ============================================================================
+
+import numpy as np
+import os
+import pandas as pd
+import pathlib
+
+from pcm_asds_pca.core.wells import ROW_INDEX
+
+# path and name are widened to the longest path and name by parse_names
+FILE_DTYPE = np.dtype(
+    [
+        ("path", "U1"),
+        ("name", "U1"),
+        ("kind", "U8"),
+        ("plate", "i4"),
+        ("concentration", "i4"),
+        ("well", "U16"),
+        ("row", "U8"),
+        ("column", "i4"),
+        ("replicate", "i4"),
+        ("size", "i8"),
+        ("mtime_ns", "i8"),
+    ]
+)
+
+# kind of each record
+PLATE = "plate"
+WELL = "well"
+SINGLE = "single"
+
+NAME_PATTERN = (
+    r"^plate(?P<plate>\d+)_(?P<concentration>\d+)mgml_"
+    r"(?:(?P<row>[A-Z]{1,2})(?P<column>\d+)(?:_r(?P<replicate>\d+))?\.txt$)?"
+)
+
+
+def scan(folder, extensions):
+    """
+    Records of the files in folder with one of extensions, sorted by
+    plate, row, column and replicate with single spectra at the end
+    """
+    paths = []
+    sizes = []
+    mtimes = []
+
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_file() or pathlib.Path(entry.name).suffix not in extensions:
+                continue
+
+            stat = entry.stat()
+
+            paths.append(str(pathlib.Path(folder) / entry.name))
+            sizes.append(stat.st_size)
+            mtimes.append(stat.st_mtime_ns)
+
+    records = parse_names(paths)
+    records["size"] = sizes
+    records["mtime_ns"] = mtimes
+
+    return records[sort_order(records)]
+
+
+def parse_names(paths):
+    if not paths:
+        return np.zeros(0, dtype=FILE_DTYPE)
+
+    names = pd.Series([pathlib.PurePath(path).name for path in paths], dtype=object)
+
+    records = np.zeros(len(paths), dtype=file_dtype(paths, names))
+    parts = names.str.extract(NAME_PATTERN)
+
+    is_plate = parts["plate"].notna().to_numpy()
+    is_well = parts["row"].notna().to_numpy()
+
+    records["path"] = paths
+    records["name"] = names.to_numpy(dtype=str)
+
+    records["kind"] = SINGLE
+    records["kind"][is_plate] = PLATE
+    records["kind"][is_well] = WELL
+
+    for field in ["plate", "concentration", "column", "replicate"]:
+        records[field] = parts[field].fillna(0).astype(np.int64).to_numpy()
+
+    row = parts["row"].fillna("")
+    records["row"] = row.to_numpy(dtype=str)
+    records["well"] = (row + parts["column"].fillna("")).to_numpy(dtype=str)
+
+    return records
+
+
+def file_dtype(paths, names):
+    # Strings longer than their field would be silently truncated
+    widths = dict(
+        path=max(len(str(path)) for path in paths),
+        name=max(len(name) for name in names),
+    )
+
+    return np.dtype(
+        [
+            (field, f"U{widths[field]}" if field in widths else FILE_DTYPE[field])
+            for field in FILE_DTYPE.names
+        ]
+    )
+
+
+def sort_order(records):
+    # Precomputed sort keys, from least to most significant
+    labels = pd.Series(records["row"])
+
+    # Rows of maps are labelled by their Y index, e.g. Y40
+    rows = labels.map(ROW_INDEX).fillna(
+        pd.to_numeric(labels.str.removeprefix("Y"), errors="coerce")
+    )
+    rows = np.array(rows.fillna(0), dtype=np.int64)
+
+    # Plate files come before the wells of their plate
+    rows[records["kind"] == PLATE] = -1
+
+    # Single spectra (e.g. glass reference) come last
+    single = records["kind"] == SINGLE
+
+    return np.lexsort(
+        (
+            records["name"],
+            records["replicate"],
+            records["column"],
+            rows,
+            records["plate"],
+            single,
+        )
+    )
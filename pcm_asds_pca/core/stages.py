@@ -0,0 +1,170 @@
+# ============================================================================
+# Cache of the results of each stage of pca.py (dataframes, preprocessing and
+# PCA), keyed on a fingerprint of the inputs and settings of the stage
+# A stage is only recomputed when its fingerprint changes, e.g. changing
+# NUM_PCS reuses the cached preprocessed spectra and only refits the model
+# Least recently used results are evicted once the cache exceeds its size
+# ============================================================================
+
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import pathlib
+import pickle
+
+from pcm_asds_pca.config.settings import (
+    PATH_TO_DIR,
+    STAGE_CACHE_FOLDER,
+    STAGE_CACHE_SIZE_MB,
+    USE_STAGE_CACHE,
+)
+
+# Increment when the result of a stage changes for the same inputs
+STAGE_VERSION = 1
+
+
+class StageCache:
+
+    def __init__(self, folder, max_bytes):
+        self.folder = pathlib.Path(folder)
+        self.max_bytes = max_bytes
+
+    def entry(self, stage, key):
+        return self.folder / f"{stage}.v{STAGE_VERSION}.{key[:32]}.pkl"
+
+    def get(self, stage, key):
+        """
+        Returns (True, result) if the stage has a cached result for key,
+        otherwise (False, None)
+        """
+        entry = self.entry(stage, key)
+
+        try:
+            with open(entry, "rb") as f:
+                cached_key, result = pickle.load(f)
+        except FileNotFoundError:
+            return False, None
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            # Corrupt or truncated entry
+            entry.unlink(missing_ok=True)
+            return False, None
+
+        if cached_key != key:
+            return False, None
+
+        # Mark the entry as recently used
+        os.utime(entry)
+
+        return True, result
+
+    def put(self, stage, key, result):
+        entry = self.entry(stage, key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first so that readers never see a partial entry
+        tmp = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+
+        with open(tmp, "wb") as f:
+            pickle.dump((key, result), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp, entry)
+
+        self.evict(keep=entry)
+
+    def evict(self, keep=None):
+        entries = [(e, e.stat()) for e in self.folder.glob("*.pkl")]
+
+        # Least recently used first
+        entries.sort(key=lambda item: item[1].st_mtime_ns)
+
+        total = sum(stat.st_size for _, stat in entries)
+
+        for entry, stat in entries:
+            if total <= self.max_bytes:
+                break
+
+            if entry == keep:
+                continue
+
+            entry.unlink(missing_ok=True)
+            total -= stat.st_size
+
+
+def stage_cache():
+    return StageCache(
+        f"{PATH_TO_DIR}{STAGE_CACHE_FOLDER}", int(STAGE_CACHE_SIZE_MB * 1024**2)
+    )
+
+
+def cached(stage, key, compute):
+    """
+    Result of compute() for the stage, reused while key is unchanged
+    """
+    if USE_STAGE_CACHE is not True:
+        return compute()
+
+    cache = stage_cache()
+
+    found, result = cache.get(stage, key)
+
+    if found:
+        print(f"Reusing cached {stage}.")
+        print()
+        return result
+
+    result = compute()
+
+    cache.put(stage, key, result)
+
+    return result
+
+
+# ==================================================
+# Fingerprints of the inputs and settings of a stage
+# Arrays and dataframes are hashed by their contents
+# ==================================================
+def fingerprint(*parts):
+    h = hashlib.sha256()
+
+    for part in parts:
+        update(h, part)
+
+    return h.hexdigest()
+
+
+def update(h, part):
+
+    if isinstance(part, np.ndarray) and part.dtype.hasobject:
+        update(h, part.tolist())
+
+    elif isinstance(part, np.ndarray):
+        h.update(str((part.dtype.str, part.dtype.names, part.shape)).encode())
+        h.update(np.ascontiguousarray(part).tobytes())
+
+    elif isinstance(part, (pd.DataFrame, pd.Series)):
+        h.update(pd.util.hash_pandas_object(part).to_numpy().tobytes())
+        update(h, json.dumps(list(map(str, getattr(part, "columns", [])))))
+
+    elif isinstance(part, bytes):
+        h.update(part)
+
+    else:
+        h.update(json.dumps(part, sort_keys=True, default=str).encode())
+
+    # Separate consecutive parts
+    h.update(b"\0")
+
+
+def files_fingerprint(paths):
+    """
+    Fingerprint of files from their size and modification time
+    """
+    stats = []
+
+    for path in paths:
+        stat = os.stat(path)
+        stats.append((str(path), stat.st_size, stat.st_mtime_ns))
+
+    return fingerprint(stats)
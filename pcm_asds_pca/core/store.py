@@ -0,0 +1,314 @@
+# =============================================================================
+# Memory-mapped spectral store for a whole campaign
+# All spectra are kept in a single (n_spectra, n_shifts) matrix on disk with a
+# sidecar index of plate, well, row, column and concentration for every row
+# and the acquisition parameters read from the header of every source file
+# Opening a store is near-instant and reading a spectrum does not copy the data
+# Spectra with fewer shifts than the widest axis are padded with NaN
+# =============================================================================
+
+import json
+import numpy as np
+import os
+import pandas as pd
+import pathlib
+
+from pcm_asds_pca.config.settings import PATH_TO_DIR, STORE_DTYPE, STORE_FOLDER
+from pcm_asds_pca.core.header import Acquisition, counts_per_second, group_by_settings
+
+STORE_VERSION = 5
+
+INDEX_DTYPE = np.dtype(
+    [
+        ("plate", "i4"),
+        ("well", "U16"),
+        ("row", "U8"),
+        ("column", "i4"),
+        ("concentration", "i4"),
+        ("replicate", "i4"),
+        ("axis", "i4"),
+        ("acquisition", "i4"),
+    ]
+)
+
+# Files of a store, store.json last
+STORE_FILES = (
+    "spectra.dat",
+    "shifts.npy",
+    "index.npy",
+    "acquisitions.json",
+    "store.json",
+)
+
+
+class SpectralStore:
+
+    def __init__(self, folder):
+
+        folder = pathlib.Path(folder)
+
+        with open(folder / "store.json") as f:
+            meta = json.load(f)
+
+        if meta["version"] != STORE_VERSION:
+            raise ValueError(f"Unsupported spectral store version {meta['version']}")
+
+        self.folder = folder
+        self.dtype = np.dtype(meta["dtype"])
+        self.shape = tuple(meta["shape"])
+
+        # (n_spectra, n_shifts) matrix, read from disk on access
+        if self.shape[0] == 0:
+            self.spectra = np.empty(self.shape, dtype=self.dtype)
+        else:
+            self.spectra = np.memmap(
+                folder / "spectra.dat", dtype=self.dtype, mode="r", shape=self.shape
+            )
+
+        # (n_axes, n_shifts) matrix of the distinct shift axes in the campaign
+        self.shifts = np.load(folder / "shifts.npy", mmap_mode="r")
+
+        # Number of shifts in each axis, excluding NaN padding
+        self.lengths = np.sum(~np.isnan(self.shifts), axis=1)
+
+        self.index = np.load(folder / "index.npy", mmap_mode="r")
+
+        if len(self.index) != self.shape[0]:
+            raise ValueError("Spectral store index does not match the spectra")
+
+        with open(folder / "acquisitions.json") as f:
+            self.acquisitions = [Acquisition.from_dict(a) for a in json.load(f)]
+
+        self._rows = None
+
+    def __len__(self):
+        return self.shape[0]
+
+    def lookup(self, plate, well, replicate=0):
+
+        # Hash table of (plate, well, replicate) -> row, built on first use
+        if self._rows is None:
+            self._rows = {
+                (int(p), str(w), int(r)): i
+                for i, (p, w, r) in enumerate(
+                    zip(
+                        self.index["plate"],
+                        self.index["well"],
+                        self.index["replicate"],
+                    )
+                )
+            }
+
+        return self._rows[(int(plate), str(well), int(replicate))]
+
+    def rows(self, plates, wells, replicates):
+        """
+        Rows of many (plate, well, replicate) at once, in the same order
+        """
+        keys = pd.MultiIndex.from_arrays(
+            [
+                np.asarray(plates, dtype=np.int64),
+                np.asarray(wells, dtype=str),
+                np.asarray(replicates, dtype=np.int64),
+            ]
+        )
+
+        index = pd.MultiIndex.from_arrays(
+            [
+                self.index["plate"].astype(np.int64),
+                self.index["well"],
+                self.index["replicate"].astype(np.int64),
+            ]
+        )
+
+        rows = index.get_indexer(keys)
+
+        if (rows < 0).any():
+            missing = keys[rows < 0][0]
+            raise KeyError(missing)
+
+        return rows
+
+    def spectrum(self, row):
+        axis = self.index["axis"][row]
+        length = self.lengths[axis]
+
+        return self.shifts[axis, :length], self.spectra[row, :length]
+
+    def acquisition(self, row):
+        return self.acquisitions[self.index["acquisition"][row]]
+
+    def groups(self):
+        # Acquisition settings group of every spectrum
+        return group_by_settings(self.acquisitions)[self.index["acquisition"]]
+
+    def counts_per_second(self, rows=None):
+        # Only the given rows are read from disk
+        if rows is None:
+            rows = slice(None)
+
+        times = [a.acquisition_time for a in self.acquisitions]
+        times = np.array(times, dtype=np.float64)[self.index["acquisition"][rows]]
+
+        return counts_per_second(self.spectra[rows], times)
+
+
+def store_folder():
+    return pathlib.Path(f"{PATH_TO_DIR}{STORE_FOLDER}")
+
+
+def open_store(folder=None):
+    if folder is None:
+        folder = store_folder()
+
+    return SpectralStore(folder)
+
+
+def store_exists(folder=None, dtype=STORE_DTYPE):
+    if folder is None:
+        folder = store_folder()
+
+    # Stores written by a different version or with a different dtype
+    # are treated as missing
+    try:
+        with open(pathlib.Path(folder) / "store.json") as f:
+            meta = json.load(f)
+
+        same_dtype = np.dtype(meta["dtype"]) == np.dtype(dtype)
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+    return meta["version"] == STORE_VERSION and same_dtype
+
+
+def write_store(folder, sources, dtype):
+    """
+    Stream spectra into a store one block at a time.
+
+    sources yields (matrix, shifts, index, acquisition) where matrix is
+    (n, n_shifts), shifts is the shift axis shared by the block, index is a
+    dict of plate, well, row, column, concentration and replicate values
+    for each spectrum and acquisition is the Acquisition the block was recorded with
+    """
+    folder = pathlib.Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    tmp = f"{os.getpid()}.tmp"
+
+    # Temporary files are removed if any block cannot be written
+    try:
+        write_store_files(folder, sources, dtype, tmp)
+    except BaseException:
+        for name in STORE_FILES:
+            (folder / f"{name}.{tmp}").unlink(missing_ok=True)
+
+        (folder / f"spectra.dat.{tmp}.padded").unlink(missing_ok=True)
+        raise
+
+    # store.json is removed first and replaced last so that a store is never
+    # opened half-written
+    (folder / "store.json").unlink(missing_ok=True)
+
+    for name in STORE_FILES:
+        os.replace(folder / f"{name}.{tmp}", folder / name)
+
+
+def write_store_files(folder, sources, dtype, tmp):
+    """
+    Write every file of the store with the suffix tmp
+    """
+    axes = []
+    acquisitions = []
+    indexes = []
+    blocks = []
+
+    # Blocks are written one after another at their own width
+    with open(folder / f"spectra.dat.{tmp}", "wb") as f:
+
+        for matrix, shifts, index, acquisition in sources:
+
+            if matrix.shape[1] != shifts.size:
+                raise ValueError(
+                    f"Spectra have {matrix.shape[1]} intensities for {shifts.size} shifts"
+                )
+
+            # Reuse an identical shift axis if one is already stored
+            for axis, existing in enumerate(axes):
+                if np.array_equal(existing, shifts):
+                    break
+            else:
+                axis = len(axes)
+                axes.append(np.asarray(shifts, dtype=np.float64))
+
+            if acquisition not in acquisitions:
+                acquisitions.append(acquisition)
+
+            block = np.zeros(matrix.shape[0], dtype=INDEX_DTYPE)
+            for field, values in index.items():
+                block[field] = values
+            block["axis"] = axis
+            block["acquisition"] = acquisitions.index(acquisition)
+
+            np.ascontiguousarray(matrix, dtype=dtype).tofile(f)
+
+            indexes.append(block)
+            blocks.append(matrix.shape)
+
+    n_spectra = sum(rows for rows, _ in blocks)
+    n_shifts = max((width for _, width in blocks), default=0)
+
+    # Pad narrower blocks with NaN, streaming them from the temporary file
+    if any(width != n_shifts for _, width in blocks):
+        pad_blocks(folder / f"spectra.dat.{tmp}", blocks, n_shifts, dtype)
+
+    shifts = np.full((len(axes), n_shifts), np.nan)
+    for axis, values in enumerate(axes):
+        shifts[axis, : values.size] = values
+
+    if indexes:
+        index = np.concatenate(indexes)
+    else:
+        index = np.zeros(0, dtype=INDEX_DTYPE)
+
+    with open(folder / f"shifts.npy.{tmp}", "wb") as f:
+        np.save(f, shifts)
+
+    with open(folder / f"index.npy.{tmp}", "wb") as f:
+        np.save(f, index)
+
+    with open(folder / f"acquisitions.json.{tmp}", "w") as f:
+        json.dump([a.to_dict() for a in acquisitions], f, indent=2)
+
+    meta = dict(
+        version=STORE_VERSION,
+        dtype=np.dtype(dtype).name,
+        shape=[n_spectra, n_shifts],
+    )
+
+    with open(folder / f"store.json.{tmp}", "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def pad_blocks(path, blocks, n_shifts, dtype):
+    padded = path.with_name(f"{path.name}.padded")
+
+    n_spectra = sum(rows for rows, _ in blocks)
+
+    out = np.memmap(padded, dtype=dtype, mode="w+", shape=(n_spectra, n_shifts))
+
+    row = 0
+    offset = 0
+
+    for rows, width in blocks:
+        block = np.fromfile(path, dtype=dtype, count=rows * width, offset=offset)
+
+        out[row : row + rows, :width] = block.reshape(rows, width)
+        out[row : row + rows, width:] = np.nan
+
+        row += rows
+        offset += block.nbytes
+
+    out.flush()
+    del out
+
+    os.replace(padded, path)
@@ -0,0 +1,99 @@
+# ============================================================================
+# Columnar table of the samples analysed, one entry per spectrum
+# Text columns are stored as categoricals and numeric columns as NumPy arrays
+# "spectrum" links every sample to its row in the spectral store
+# ============================================================================
+
+import numpy as np
+import pandas as pd
+
+from pcm_asds_pca.core.layout import plate_layout
+from pcm_asds_pca.core.sample import GLASS, GLASS_REFERENCE
+from pcm_asds_pca.core.scan import WELL
+
+COLUMNS = {
+    "plate": np.int32,
+    "well": "category",
+    "row": "category",
+    "column": np.int32,
+    "concentration": np.int32,
+    "drug": "category",
+    "drug_loading": np.int16,
+    "polymer": "category",
+    "appearance": "category",
+    "volume": np.int8,
+    "replicate": np.int32,
+    "spectrum": np.int64,
+}
+
+
+class SampleTable:
+
+    def __init__(self, columns):
+        self.columns = {
+            name: (
+                pd.Categorical(columns[name])
+                if dtype == "category"
+                else np.asarray(columns[name], dtype=dtype)
+            )
+            for name, dtype in COLUMNS.items()
+        }
+
+    @classmethod
+    def from_records(cls, records, store):
+        """
+        Samples of the file records returned by parse(), with their metadata
+        joined from the plate layout and their rows in the spectral store
+        """
+        metadata = plate_layout().join(records["plate"], records["well"])
+
+        columns = dict(
+            plate=records["plate"],
+            well=records["well"].astype(object),
+            row=records["row"].astype(object),
+            column=records["column"],
+            concentration=records["concentration"],
+            replicate=records["replicate"],
+        )
+
+        for field in metadata.columns:
+            columns[field] = metadata[field].to_numpy(dtype=object)
+
+        # Files that are not wells of a plate (e.g. glass reference)
+        single = records["kind"] != WELL
+        columns["well"][single] = " "
+        columns["row"][single] = " "
+
+        glass = records["name"] == GLASS_REFERENCE
+
+        for field, value in GLASS.items():
+            columns[field][glass] = value
+
+        columns["spectrum"] = store.rows(
+            columns["plate"], columns["well"], columns["replicate"]
+        )
+
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.columns["spectrum"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def take(self, indices):
+        """
+        Samples at the given positions, e.g. from np.flatnonzero(mask)
+        """
+        return SampleTable(
+            {name: column[indices] for name, column in self.columns.items()}
+        )
+
+    def to_frame(self):
+        """
+        DataFrame of the samples indexed by their row in the spectral store
+        """
+        return pd.DataFrame(
+            {name: self.columns[name] for name in COLUMNS if name != "spectrum"},
+            index=pd.Index(self.columns["spectrum"], name="spectrum"),
+        )
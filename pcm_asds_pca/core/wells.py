@@ -0,0 +1,81 @@
+# ============================================================================
+# Well labels and indices for 96, 384 and 1536-well plates
+# Rows are labelled A-Z then AA-AF, e.g. A1 ... H12, P24 or AF48
+# Positions of maps are labelled by their Y and X index, e.g. Y40X7
+# Labels, row/column indices and sort keys are computed for whole arrays of
+# wells at once rather than one well or filename at a time
+# ============================================================================
+
+import numpy as np
+import pandas as pd
+
+# Number of wells -> (plate rows, plate columns)
+PLATE_FORMATS = {
+    96: (8, 12),
+    384: (16, 24),
+    1536: (32, 48),
+}
+
+MAX_ROWS = max(rows for rows, _ in PLATE_FORMATS.values())
+MAX_COLS = max(cols for _, cols in PLATE_FORMATS.values())
+
+
+def row_label(row):
+    # 1 -> A, 26 -> Z, 27 -> AA
+    label = ""
+
+    while row > 0:
+        row, remainder = divmod(row - 1, 26)
+        label = chr(65 + remainder) + label
+
+    return label
+
+
+# Label of every row, ROW_LABELS[0] is row 1
+ROW_LABELS = np.array([row_label(row) for row in range(1, MAX_ROWS + 1)])
+
+ROW_INDEX = {label: row for row, label in enumerate(ROW_LABELS, start=1)}
+
+
+def well_labels(rows, cols):
+    """
+    Well labels of 1-based plate rows and columns, e.g. (1, 12) -> "A12"
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+
+    if rows.size and (rows.min() < 1 or rows.max() > MAX_ROWS):
+        raise ValueError(f"Row out of range: {rows[(rows < 1) | (rows > MAX_ROWS)][0]}")
+
+    if cols.size and (cols.min() < 1 or cols.max() > MAX_COLS):
+        raise ValueError(
+            f"Column out of range: {cols[(cols < 1) | (cols > MAX_COLS)][0]}"
+        )
+
+    return np.char.add(ROW_LABELS[rows - 1], cols.astype(str))
+
+
+def position_labels(rows, cols):
+    """
+    Labels of the 1-based Y and X positions of a map, which may have more
+    positions than a plate has wells, e.g. (40, 7) -> ("Y40X7", "Y40")
+    Returns the labels of the positions and of their rows
+    """
+    rows = np.char.add("Y", np.asarray(rows, dtype=np.int64).astype(str))
+    cols = np.char.add("X", np.asarray(cols, dtype=np.int64).astype(str))
+
+    return np.char.add(rows, cols), rows
+
+
+def split_wells(wells):
+    """
+    Row labels, row indices and column indices of well labels, e.g.
+    "AB7" -> ("AB", 28, 7). Labels that are not wells give ("", 0, 0)
+    """
+    parts = pd.Series(np.asarray(wells, dtype=str)).str.extract(r"^([A-Z]{1,2})(\d+)$")
+
+    labels = parts[0].fillna("")
+    rows = np.array(labels.map(ROW_INDEX).fillna(0), dtype=np.int64)
+    cols = np.array(pd.to_numeric(parts[1], errors="coerce").fillna(0), dtype=np.int64)
+
+    return np.array(labels, dtype=str), rows, cols
@@ -0,0 +1,195 @@
+# ============================================================================
+# Chunked LabSpec reader and well reducers checked against the line-by-line
+# parser and the one-pass reduce_wells on synthetic multiwell exports
+# ============================================================================
+
+import numpy as np
+import pytest
+
+from pcm_asds_pca.core.labspec import parse_multiwell_array, read_labspec_map
+from pcm_asds_pca.core.parse import parse_multiwell_file
+from pcm_asds_pca.core.reduce import REDUCERS, WellReducer, reduce_wells
+
+# Lines parsed at a time, so that the spectra of some wells span two chunks
+CHUNK_ROWS = 7
+
+
+def write_multiwell(path, seed=0, p=30):
+    # 96-well plate with 1 to 4 spectra per well, in a latin-1 encoded export
+    rng = np.random.default_rng(seed)
+    shifts = np.linspace(5, 2000, p)
+
+    lines = ["#Acq. time (s)=5", "#Title=Plaque à 96 puits"]
+    lines.append("\t" + "\t".join(f"{x:.3f}" for x in shifts))
+
+    for row in range(1, 9):
+        for col in range(1, 13):
+            for _ in range(rng.integers(1, 5)):
+                values = "\t".join(f"{v:.4f}" for v in rng.normal(1000, 50, p))
+                lines.append(f"{row}\t{col}\t{values}")
+
+    path.write_bytes(("\n".join(lines) + "\n").encode("latin-1"))
+
+    return path
+
+
+def write_map(path, seed=0, p=30):
+    # Y positions before X positions, neither in increasing order
+    rng = np.random.default_rng(seed)
+    shifts = np.linspace(5, 2000, p)
+
+    lines = ["#AxisType[2]=X", "#AxisType[3]=Y"]
+    lines.append("\t" + "\t".join(f"{x:.3f}" for x in shifts))
+
+    for y in (3.5, -1.0, 10.0):
+        for x in (0.1, 5.0):
+            values = "\t".join(f"{v:.4f}" for v in rng.normal(1000, 50, p))
+            lines.append(f"{x}\t{y}\t{values}")
+
+    path.write_text("\n".join(lines) + "\n")
+
+    return path
+
+
+@pytest.fixture
+def multiwell(tmp_path):
+    return write_multiwell(tmp_path / "plate1_60mgml_multiwell.txt")
+
+
+@pytest.mark.parametrize("method", REDUCERS)
+def test_parse_multiwell_array_matches_parse_multiwell_file(multiwell, method):
+    reducer = WellReducer(method, 0.2)
+
+    header, matrix, shifts, rows, cols, replicates = parse_multiwell_array(
+        multiwell, reducer, chunk_rows=CHUNK_ROWS
+    )
+
+    expected_header, spectra = parse_multiwell_file(multiwell, method, 0.2)
+
+    assert header == expected_header
+    assert "#Title=Plaque à 96 puits" in header
+
+    assert np.array_equal(shifts, spectra[0][3])
+    assert rows.tolist() == [row for row, _, _, _, _ in spectra]
+    assert cols.tolist() == [col for _, col, _, _, _ in spectra]
+    assert replicates.tolist() == [r for _, _, r, _, _ in spectra]
+    assert np.allclose(matrix, [y for _, _, _, _, y in spectra], rtol=1e-12)
+
+
+def test_parse_multiwell_array_keeps_every_spectrum(multiwell):
+    header, matrix, shifts, rows, cols, replicates = parse_multiwell_array(
+        multiwell, chunk_rows=CHUNK_ROWS
+    )
+
+    spectra = np.loadtxt(multiwell, skiprows=3, encoding="latin-1")
+
+    assert np.array_equal(matrix, spectra[:, 2:])
+    assert np.array_equal(rows, spectra[:, 0])
+    assert np.array_equal(cols, spectra[:, 1])
+
+    # Replicates count up from 0 within every well
+    for row, col in set(zip(rows.tolist(), cols.tolist())):
+        well = (rows == row) & (cols == col)
+        assert replicates[well].tolist() == list(range(np.count_nonzero(well)))
+
+
+def test_parse_multiwell_array_numbers_map_positions(tmp_path):
+    path = write_map(tmp_path / "plate1_60mgml_map.txt")
+
+    _, matrix, shifts, rows, cols, _ = parse_multiwell_array(
+        path, WellReducer("mean"), is_map=True, chunk_rows=4
+    )
+
+    _, expected, expected_shifts, expected_rows, expected_cols = read_labspec_map(path)
+
+    assert np.array_equal(shifts, expected_shifts)
+    assert np.array_equal(matrix, expected)
+    assert np.array_equal(rows, expected_rows)
+    assert np.array_equal(cols, expected_cols)
+
+
+def test_parse_multiwell_array_rejects_single_spectrum(tmp_path):
+    path = tmp_path / "glass_reference.txt"
+    path.write_text("5.0\t100\n6.0\t110\n")
+
+    with pytest.raises(ValueError, match="single spectrum"):
+        parse_multiwell_array(path)
+
+
+def contiguous_wells(seed=0, wells=60, p=20):
+    # Wells with 1 to 5 spectra each, the spectra of every well in a run
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(1, 6, wells)
+
+    rows = np.repeat(np.arange(wells) // 12 + 1, counts)
+    cols = np.repeat(np.arange(wells) % 12 + 1, counts)
+
+    return rng.normal(size=(rows.size, p)), rows, cols
+
+
+def reduce_in_blocks(matrix, rows, cols, method, block_rows):
+    reducer = WellReducer(method, 0.2)
+
+    for start in range(0, rows.size, block_rows):
+        block = slice(start, start + block_rows)
+        reducer.add_block(rows[block], cols[block], matrix[block])
+
+    assert len(reducer) == rows.size
+
+    return reducer.result()
+
+
+def assert_same_reduction(actual, expected):
+    matrix, rows, cols, replicates = actual
+    expected_matrix, expected_rows, expected_cols, expected_replicates = expected
+
+    assert np.allclose(matrix, expected_matrix, rtol=1e-12, atol=1e-12)
+    assert np.array_equal(rows, expected_rows)
+    assert np.array_equal(cols, expected_cols)
+    assert np.array_equal(replicates, expected_replicates)
+
+
+@pytest.mark.parametrize("method", REDUCERS)
+@pytest.mark.parametrize("block_rows", [1, 7, 1000])
+def test_reduce_wells_matches_well_reducer(method, block_rows):
+    matrix, rows, cols = contiguous_wells()
+
+    assert_same_reduction(
+        reduce_in_blocks(matrix, rows, cols, method, block_rows),
+        reduce_wells(matrix, rows, cols, method, 0.2),
+    )
+
+
+@pytest.mark.parametrize("method", ["mean", "all"])
+def test_reduce_wells_matches_well_reducer_in_any_order(method):
+    matrix, rows, cols = contiguous_wells()
+
+    order = np.random.default_rng(1).permutation(rows.size)
+    matrix, rows, cols = matrix[order], rows[order], cols[order]
+
+    assert_same_reduction(
+        reduce_in_blocks(matrix, rows, cols, method, 7),
+        reduce_wells(matrix, rows, cols, method, 0.2),
+    )
+
+
+def test_well_reducer_add_matches_add_block():
+    matrix, rows, cols = contiguous_wells()
+
+    reducer = WellReducer("median")
+
+    for row, col, spectrum in zip(rows, cols, matrix):
+        reducer.add(row, col, spectrum)
+
+    assert_same_reduction(reducer.result(), reduce_wells(matrix, rows, cols, "median"))
+
+
+@pytest.mark.parametrize("method", ["median", "trimmed_mean"])
+def test_well_reducer_needs_contiguous_wells(method):
+    reducer = WellReducer(method)
+
+    reducer.add_block([1, 1, 1], [1, 2, 2], np.ones((3, 2)))
+    reducer.add_block([1], [1], np.ones((1, 2)))
+
+    with pytest.raises(ValueError, match=r"well \(1, 1\) are not contiguous"):
+        reducer.result()
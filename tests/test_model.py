@@ -0,0 +1,113 @@
+# ============================================================================
+# PCA model folder written by write_model and read back by open_model
+# ============================================================================
+
+import numpy as np
+import pytest
+
+from pcm_asds_pca.core.model import (
+    ARRAYS,
+    LIMITS,
+    export_model,
+    open_model,
+    remove_exports,
+    write_model,
+)
+
+
+def synthetic_pcaobj(n=20, p=15, a=3, seed=0):
+    # Arrays of the shapes returned by phi.pca, without cross validation
+    rng = np.random.default_rng(seed)
+
+    pcaobj = dict(
+        T=rng.normal(size=(n, a)),
+        P=rng.normal(size=(p, a)),
+        mx=rng.normal(size=p),
+        sx=np.ones(p),
+        r2x=np.array([0.6, 0.25, 0.1]),
+        r2xpv=rng.uniform(size=(p, a)),
+        T2=rng.gamma(2.0, 1.0, n),
+        speX=rng.gamma(2.0, 1.0, (n, 1)),
+        obsidX=[f"Plate {i // 12 + 1} well {i % 12 + 1}" for i in range(n)],
+        varidX=np.linspace(200, 1800, p),
+    )
+
+    pcaobj.update({limit: i + 0.5 for i, limit in enumerate(LIMITS)})
+
+    return pcaobj
+
+
+@pytest.fixture
+def pcaobj():
+    return synthetic_pcaobj()
+
+
+def test_model_round_trip(tmp_path, pcaobj):
+    settings = {"Principal Components": 3, "Lower cut-off": 200}
+    spectrum = np.arange(20)[::-1]
+    extra = dict(count=np.array([20]), mean=pcaobj["mx"] * 2)
+
+    folder = write_model(
+        tmp_path / "model", pcaobj, settings=settings, spectrum=spectrum, extra=extra
+    )
+
+    model = open_model(folder)
+
+    assert model.num_pcs == 3
+    assert model.settings == settings
+
+    for name in ARRAYS:
+        if name in pcaobj:
+            assert np.array_equal(model[name], pcaobj[name])
+        else:
+            assert name not in model
+
+    assert model.limits() == {limit: pcaobj[limit] for limit in LIMITS}
+
+    assert np.array_equal(model["spectrum"], spectrum)
+    assert np.array_equal(model["count"], extra["count"])
+    assert np.array_equal(model["mean"], extra["mean"])
+
+    restored = model.to_pcaobj()
+
+    assert restored["obsidX"] == pcaobj["obsidX"]
+    assert np.array_equal(restored["varidX"], pcaobj["varidX"])
+    assert restored["type"] == "pca"
+
+    # No temporary folder is left behind
+    assert [path.name for path in tmp_path.iterdir()] == ["model"]
+
+
+def test_write_model_replaces_existing_model(tmp_path, pcaobj):
+    write_model(tmp_path / "model", pcaobj, spectrum=np.arange(20))
+
+    other = synthetic_pcaobj(seed=1)
+    model = open_model(write_model(tmp_path / "model", other))
+
+    assert np.array_equal(model["T"], other["T"])
+
+    # Arrays of the earlier model are not kept
+    assert "spectrum" not in model
+    assert not (tmp_path / "model" / "spectrum.npy").exists()
+
+
+def test_open_model_rejects_other_folders(tmp_path):
+    (tmp_path / "model.json").write_text('{"version": 1}')
+
+    with pytest.raises(ValueError, match="is not a PCA model"):
+        open_model(tmp_path)
+
+
+def test_export_and_remove_tables(tmp_path, pcaobj):
+    model = open_model(write_model(tmp_path / "model", pcaobj))
+
+    scores, loadings = export_model(model, tmp_path / "export")
+
+    assert scores.read_text().splitlines()[0] == "obsid,PC1,PC2,PC3,T2,SPE"
+    assert loadings.read_text().splitlines()[0].startswith("shift,PC1,PC2,PC3")
+
+    remove_exports(tmp_path / "export", keep="csv")
+    assert scores.exists() and loadings.exists()
+
+    remove_exports(tmp_path / "export")
+    assert list((tmp_path / "export").iterdir()) == []
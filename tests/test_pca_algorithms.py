@@ -0,0 +1,178 @@
+# ============================================================================
+# Incremental and randomised PCA checked against phi.pca on synthetic spectra
+# ============================================================================
+
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+import pcm_asds_pca.pyphi.pyphi as phi
+import pytest
+
+from pcm_asds_pca.analysis.pca import resume_pca
+from pcm_asds_pca.config.settings import MODEL_FOLDER, PCA_OUTPUT
+from pcm_asds_pca.core.incremental import IncrementalPCA, row_digests
+from pcm_asds_pca.core.model import write_model
+from pcm_asds_pca.core.randomized import randomized_pca
+
+
+def synthetic_spectra(n=120, p=60, seed=0):
+    # Three Gaussian bands with random heights on a sloping background
+    rng = np.random.default_rng(seed)
+    shifts = np.linspace(200, 1800, p)
+
+    bands = np.array(
+        [np.exp(-(((shifts - centre) / 60) ** 2)) for centre in (500, 1000, 1500)]
+    )
+    heights = rng.gamma(2.0, 1.0, (n, 3))
+
+    matrix = heights @ bands + np.outer(rng.normal(1, 0.1, n), shifts / 1000)
+    matrix += rng.normal(0, 0.01, (n, p))
+
+    # First column is the observation id, as read by phi.pca
+    X = pd.DataFrame(matrix, columns=shifts)
+    X.insert(0, "obsid", [f"S{i}" for i in range(n)])
+
+    return X
+
+
+# Largest difference from phi.pca allowed, relative to the largest value
+TOLERANCE = 1e-3
+
+# T2 limits only depend on the numbers of spectra and Principal Components
+LIMIT_TOLERANCE = 1e-9
+
+
+@pytest.fixture(scope="module")
+def spectra():
+    return synthetic_spectra()
+
+
+@pytest.fixture(scope="module")
+def reference(spectra):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return phi.pca(spectra, 3)
+
+
+def assert_close(actual, expected, tolerance=TOLERANCE):
+    actual = np.asarray(actual, dtype=np.float64)
+    expected = np.asarray(expected, dtype=np.float64)
+
+    assert actual.shape == expected.shape
+    assert np.abs(actual - expected).max() <= tolerance * np.abs(expected).max()
+
+
+def assert_same_model(pcaobj, reference):
+    # Scores and loadings agree in sign as well as magnitude
+    for name in ("T", "P", "mx", "sx", "r2x", "r2xpv", "T2", "speX"):
+        assert_close(pcaobj[name], reference[name])
+
+    for name in ("T2_lim95", "T2_lim99"):
+        assert_close(pcaobj[name], reference[name], LIMIT_TOLERANCE)
+
+    for name in ("speX_lim95", "speX_lim99"):
+        assert_close(pcaobj[name], reference[name])
+
+    assert list(pcaobj["obsidX"]) == list(reference["obsidX"])
+    assert np.allclose(pcaobj["varidX"], reference["varidX"])
+
+
+def test_incremental_in_blocks_matches_phi(spectra, reference):
+    model = IncrementalPCA(3)
+
+    for start in range(0, len(spectra), 40):
+        model.partial_fit(spectra.iloc[start : start + 40])
+
+    pcaobj = model.to_pcaobj()
+
+    assert_same_model(pcaobj, reference)
+
+    # Fewer variables kept than shifts, as for real spectra
+    assert model.basis.shape[1] < pcaobj["P"].shape[0]
+
+
+def test_incremental_sign_convention(spectra):
+    pcaobj = IncrementalPCA(3).partial_fit(spectra).to_pcaobj()
+
+    # As phi.pca, the negative scores of a component never vary more than the rest
+    for t in pcaobj["T"].T:
+        assert np.var(t[t < 0]) <= np.var(t[t >= 0])
+
+
+def test_incremental_needs_more_spectra_than_components(spectra):
+    with pytest.raises(ValueError, match="At least 11 spectra"):
+        IncrementalPCA(10).partial_fit(spectra.iloc[:10])
+
+
+def fit_randomized(spectra, num_pcs=3, **kwargs):
+    # Ids are read as by phi.pca, as in fit_pca
+    with contextlib.redirect_stdout(io.StringIO()):
+        return randomized_pca(
+            spectra.iloc[:, 1:].to_numpy(),
+            num_pcs,
+            obsid=spectra.iloc[:, 0],
+            varid=spectra.columns[1:],
+            **kwargs,
+        )
+
+
+def test_randomized_matches_phi(spectra, reference):
+    assert_same_model(fit_randomized(spectra), reference)
+
+
+def test_randomized_memmap_in_chunks(spectra, reference, tmp_path):
+    # Chunks that do not divide the number of spectra
+    path = tmp_path / "spectra.npy"
+    np.save(path, spectra.iloc[:, 1:].to_numpy())
+
+    memmap = np.load(path, mmap_mode="r")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        pcaobj = randomized_pca(
+            memmap,
+            3,
+            obsid=spectra.iloc[:, 0],
+            varid=spectra.columns[1:],
+            chunk_rows=25,
+        )
+
+    assert_same_model(pcaobj, reference)
+
+
+def test_randomized_sign_convention(spectra):
+    pcaobj = fit_randomized(spectra, seed=1)
+
+    for t in pcaobj["T"].T:
+        assert np.var(t[t < 0]) <= np.var(t[t >= 0])
+
+
+def test_randomized_needs_more_spectra_than_components(spectra):
+    with pytest.raises(ValueError, match="At least 11 spectra"):
+        fit_randomized(spectra.iloc[:10], num_pcs=10)
+
+
+def test_resume_refits_changed_spectra(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+
+    X = synthetic_spectra()
+    keys = [f"1/A{i}/0" for i in range(len(X))]
+    settings = {"Principal Components": 3}
+
+    model = IncrementalPCA(3).partial_fit(X, keys=keys)
+
+    write_model(
+        f"{PCA_OUTPUT}/{MODEL_FOLDER}",
+        model.to_pcaobj(),
+        settings=settings,
+        extra=model.state(),
+    )
+
+    matrix = X.iloc[:, 1:].to_numpy(copy=True)
+
+    assert resume_pca(keys, row_digests(matrix), settings) is not None
+
+    # The same plate and well acquired again
+    matrix[5] *= 1.05
+
+    assert resume_pca(keys, row_digests(matrix), settings) is None
+    assert "spectra have changed" in capsys.readouterr().out
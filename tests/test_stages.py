@@ -0,0 +1,114 @@
+# ============================================================================
+# Stage cache of pca.py: results are reused while their fingerprint is
+# unchanged and evicted least recently used first
+# ============================================================================
+
+import numpy as np
+import os
+import pandas as pd
+
+from pcm_asds_pca.core.stages import StageCache, files_fingerprint, fingerprint
+
+# Large enough for every entry written by these tests
+MAX_BYTES = 10 * 1024**2
+
+
+def test_stage_cache_round_trip(tmp_path):
+    cache = StageCache(tmp_path, MAX_BYTES)
+    key = fingerprint("preprocessing", 3)
+
+    assert cache.get("preprocessing", key) == (False, None)
+
+    result = pd.DataFrame(np.arange(6.0).reshape(2, 3), columns=[100, 200, 300])
+    cache.put("preprocessing", key, result)
+
+    found, cached = cache.get("preprocessing", key)
+
+    assert found
+    pd.testing.assert_frame_equal(cached, result)
+
+    # The same key in another stage is a different entry
+    assert cache.get("pca", key) == (False, None)
+
+
+def test_stage_cache_misses_when_key_changes(tmp_path):
+    cache = StageCache(tmp_path, MAX_BYTES)
+
+    cache.put("pca", fingerprint("settings", 3), "three components")
+
+    assert cache.get("pca", fingerprint("settings", 4)) == (False, None)
+
+    # Keys sharing the first 32 characters share an entry, but not a result
+    key = fingerprint("settings", 3)
+    assert cache.get("pca", key[:32] + "0" * 32) == (False, None)
+
+
+def test_stage_cache_drops_corrupt_entries(tmp_path):
+    cache = StageCache(tmp_path, MAX_BYTES)
+    key = fingerprint("dataframes")
+
+    cache.put("dataframes", key, [1, 2, 3])
+    cache.entry("dataframes", key).write_bytes(b"truncated")
+
+    assert cache.get("dataframes", key) == (False, None)
+    assert not cache.entry("dataframes", key).exists()
+
+
+def test_fingerprint_changes_with_data():
+    matrix = np.arange(12.0).reshape(3, 4)
+    df = pd.DataFrame(matrix, columns=[1, 2, 3, 4])
+
+    assert fingerprint(matrix, 3) == fingerprint(matrix.copy(), 3)
+    assert fingerprint(df) == fingerprint(df.copy())
+
+    changed = matrix.copy()
+    changed[1, 2] += 1e-9
+
+    assert fingerprint(changed) != fingerprint(matrix)
+    assert fingerprint(matrix.reshape(4, 3)) != fingerprint(matrix)
+    assert fingerprint(matrix.astype(np.float32)) != fingerprint(matrix)
+
+    assert fingerprint(df.set_axis([1, 2, 3, 5], axis=1)) != fingerprint(df)
+    assert fingerprint(matrix, 3) != fingerprint(matrix, 4)
+
+    # Parts are separated, so moving a boundary changes the fingerprint
+    assert fingerprint("ab", "c") != fingerprint("a", "bc")
+
+
+def test_files_fingerprint_changes_with_files(tmp_path):
+    path = tmp_path / "plate1_60mgml_multiwell.txt"
+    path.write_text("1\t1\t100\n")
+
+    before = files_fingerprint([path])
+
+    path.write_text("1\t1\t100.5\n")
+
+    assert files_fingerprint([path]) != before
+
+
+def test_stage_cache_evicts_least_recently_used(tmp_path):
+    payload = np.zeros(1000)
+    cache = StageCache(tmp_path, 2.5 * payload.nbytes)
+
+    for stage in ("dataframes", "preprocessing"):
+        cache.put(stage, fingerprint(stage), payload)
+
+    # Reading the older entry marks it as recently used
+    older = cache.entry("dataframes", fingerprint("dataframes"))
+    os.utime(older, ns=(0, 0))
+
+    assert cache.get("dataframes", fingerprint("dataframes"))[0]
+
+    cache.put("pca", fingerprint("pca"), payload)
+
+    assert cache.get("dataframes", fingerprint("dataframes"))[0]
+    assert cache.get("pca", fingerprint("pca"))[0]
+    assert cache.get("preprocessing", fingerprint("preprocessing")) == (False, None)
+
+
+def test_stage_cache_keeps_entry_larger_than_cache(tmp_path):
+    cache = StageCache(tmp_path, 1)
+
+    cache.put("pca", fingerprint("pca"), np.zeros(1000))
+
+    assert cache.get("pca", fingerprint("pca"))[0]
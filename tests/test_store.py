@@ -0,0 +1,144 @@
+# ============================================================================
+# Spectral store written block by block and read back, and spectra aligned
+# from the store with SPECTRAL_ALIGNMENT = "none"
+# ============================================================================
+
+import numpy as np
+import pytest
+
+from pcm_asds_pca.core.align import align_spectra
+from pcm_asds_pca.core.header import Acquisition
+from pcm_asds_pca.core.store import SpectralStore, store_exists, write_store
+from pcm_asds_pca.core.wells import well_labels
+
+FIVE_SECONDS = Acquisition(["#Acq. time (s)=5", "#Accumulations=2"])
+TWO_SECONDS = Acquisition(["#Acq. time (s)=2", "#Accumulations=2"])
+
+
+def plate_block(plate, n, shifts, acquisition, seed):
+    # One block of spectra as yielded by parse.store_sources
+    rng = np.random.default_rng(seed)
+
+    rows = np.arange(n) // 12 + 1
+    cols = np.arange(n) % 12 + 1
+    wells = well_labels(rows, cols)
+
+    index = dict(
+        plate=plate,
+        well=wells,
+        row=np.array([well[0] for well in wells]),
+        column=cols,
+        concentration=60,
+        replicate=np.zeros(n, dtype=np.int64),
+    )
+
+    return rng.normal(1000, 50, (n, shifts.size)), shifts, index, acquisition
+
+
+@pytest.fixture
+def blocks():
+    # The second plate has fewer shifts, so its spectra are padded with NaN
+    return [
+        plate_block(1, 24, np.linspace(5, 2000, 40), FIVE_SECONDS, seed=0),
+        plate_block(2, 12, np.linspace(10, 1990, 30), TWO_SECONDS, seed=1),
+    ]
+
+
+@pytest.fixture
+def store(tmp_path, blocks):
+    write_store(tmp_path / "store", iter(blocks), "float64")
+
+    return SpectralStore(tmp_path / "store")
+
+
+def test_store_round_trip(store, blocks):
+    assert len(store) == 36
+    assert store.shape == (36, 40)
+    assert store.shifts.shape == (2, 40)
+
+    start = 0
+
+    for axis, (matrix, shifts, index, acquisition) in enumerate(blocks):
+        rows = np.arange(start, start + matrix.shape[0])
+        start += matrix.shape[0]
+
+        assert np.array_equal(store.index["axis"][rows], np.full(rows.size, axis))
+        assert np.array_equal(
+            store.index["plate"][rows], np.full(rows.size, index["plate"])
+        )
+        assert np.array_equal(store.index["well"][rows], index["well"])
+
+        # Spectra are read back at their own width, without the padding
+        for row, expected in zip(rows, matrix):
+            spectrum_shifts, spectrum = store.spectrum(row)
+
+            assert np.array_equal(spectrum_shifts, shifts)
+            assert np.array_equal(spectrum, expected)
+            assert store.acquisition(row) == acquisition
+
+        assert np.isnan(store.spectra[rows, shifts.size :]).all()
+
+        plates = np.full(rows.size, index["plate"])
+        assert np.array_equal(
+            store.rows(plates, index["well"], index["replicate"]), rows
+        )
+
+    assert store.lookup(2, "A3") == 26
+
+
+def test_store_counts_per_second(store, blocks):
+    rows = np.array([0, 30])
+    spectra = store.counts_per_second(rows)
+
+    assert np.allclose(spectra[0], blocks[0][0][0] / 5)
+    assert np.allclose(spectra[1, :30], blocks[1][0][6] / 2)
+
+
+def test_store_exists_only_for_the_same_dtype(tmp_path, blocks):
+    folder = tmp_path / "store"
+    write_store(folder, iter(blocks), "float32")
+
+    assert SpectralStore(folder).spectra.dtype == np.float32
+
+    assert store_exists(folder, dtype="float32")
+    assert not store_exists(folder, dtype="float64")
+    assert not store_exists(tmp_path / "missing")
+
+
+def test_failed_store_leaves_no_files(tmp_path, blocks):
+    matrix, shifts, index, acquisition = blocks[1]
+
+    # More intensities than shifts
+    bad = (matrix, shifts[:-1], index, acquisition)
+
+    with pytest.raises(ValueError, match="intensities"):
+        write_store(tmp_path / "store", iter([blocks[0], bad]), "float64")
+
+    assert list((tmp_path / "store").iterdir()) == []
+
+
+def test_align_none_matches_inputs(tmp_path):
+    # Plates recorded on slightly different axes of the same length, the
+    # second one from high to low wavenumber
+    first = plate_block(1, 24, np.linspace(5, 2000, 40), FIVE_SECONDS, seed=0)
+    second = plate_block(2, 12, np.linspace(2001, 6, 40), FIVE_SECONDS, seed=1)
+
+    write_store(tmp_path / "store", iter([first, second]), "float64")
+    store = SpectralStore(tmp_path / "store")
+
+    grid = store.shifts[0]
+
+    matrix, deviation = align_spectra(
+        store.spectra, store.shifts, store.index["axis"], grid, "none"
+    )
+
+    assert deviation == pytest.approx(1.0)
+    assert np.array_equal(matrix[:24], first[0])
+    assert np.array_equal(matrix[24:], second[0][:, ::-1])
+
+
+def test_align_none_needs_the_same_number_of_shifts(store):
+    grid, _ = store.spectrum(0)
+
+    with pytest.raises(ValueError, match="without resampling"):
+        align_spectra(store.spectra, store.shifts, store.index["axis"], grid, "none")